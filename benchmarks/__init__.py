@@ -0,0 +1,20 @@
+import logging
+import math
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return math.nan
+    idx = min(len(ordered) - 1, max(0, int(math.ceil(pct / 100 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+def report(name, rows):
+    print(name)
+    for key, value in rows:
+        print(f"  {key:<24} {value}")
+
+
+def quiet():
+    logging.getLogger().setLevel(logging.WARNING)
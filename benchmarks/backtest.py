@@ -0,0 +1,65 @@
+# Time to backtest signals against months of 1s prices - a random walk per symbol, held in memory
+# rather than loaded from CSVs - with the signals spread evenly over the period.
+#
+#   python -m benchmarks.backtest [--signals 5000] [--days 90] [--symbols 5]
+import argparse
+import time
+
+import numpy as np
+
+from trader.backtest import Backtester, Outcome, PriceSeries, summary
+from trader.signal import BINANCE_USDT_FUTURES
+
+from . import quiet, report
+
+START = 1_600_000_000  # secs
+COINS = ["BTC", "ETH", "SOL", "XRP", "DOGE", "ADA", "LINK", "DOT", "LTC", "AVAX"]
+
+
+def random_walk(rng, size, start=100.0):
+    close = start * np.exp(np.cumsum(rng.normal(0, 0.0004, size)))
+    spread = np.abs(rng.normal(0, 0.0002, size)) * close
+    return PriceSeries(START + np.arange(size, dtype=float), close + spread, close - spread, close)
+
+
+def signals(rng, series, count, secs):
+    # at market, with SL and targets a few % away from the price at the time
+    coins = list(series)
+    messages = []
+    for ts in np.sort(rng.uniform(0, secs * 0.9, count)):
+        coin = coins[rng.integers(len(coins))]
+        price = series[coin].close[int(ts)]
+        side = 1 if rng.random() < 0.5 else -1
+        sl, targets = price * (1 - side * 0.02), [price * (1 + side * pct) for pct in (0.01, 0.02, 0.03)]
+        text = f"{'long' if side > 0 else 'short'} {coin} sl {sl:.4f} tp " + " ".join(
+            f"{target:.4f}" for target in targets)
+        messages.append((START + ts, BINANCE_USDT_FUTURES, text))
+    return messages
+
+
+def main(args):
+    quiet()
+    rng = np.random.default_rng(1)
+    secs = args.days * 24 * 3600
+    coins = COINS[:args.symbols]
+    series = {coin: random_walk(rng, secs) for coin in coins}
+    backtester = Backtester("")
+    backtester._series.update((f"{coin}USDT", prices) for coin, prices in series.items())
+    messages = signals(rng, series, args.signals, secs)
+
+    start = time.perf_counter()
+    trades = backtester.run(messages)
+    elapsed = time.perf_counter() - start
+    report(f"{args.signals} signals over {args.days} days of 1s prices, {args.symbols} symbol(s)", [
+        ("secs", round(elapsed, 2)),
+        ("ms/signal", round(elapsed / args.signals * 1000, 3)),
+        ("taken", sum(t.outcome not in (Outcome.SKIPPED, Outcome.EXPIRED) for t in trades)),
+    ] + summary(trades)[-4:])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signals", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--symbols", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,70 @@
+# Time taken to close every position of a tag, one request at a time under each position's
+# lock (old) vs symbols closed concurrently with bulk cancellation, against a stub exchange
+# with injected latency.
+#
+#   python -m benchmarks.close_trades [--latency 0.05] [--positions 10] [--targets 10] [--runs 5]
+import argparse
+import asyncio
+import time
+
+from trader import FuturesTrader
+from trader.clients import OrderType
+from trader.testing import FakeExchange, add_position, create_trader
+
+from . import percentile, quiet, report
+
+
+# Replica of the old close: every child cancelled and every position closed one after the other
+class SerialTrader(FuturesTrader):
+    async def close_trades(self, tag, coin=None):
+        for order_id in self.orders.find(tag, None if coin is None else f"{coin}USDT"):
+            async with self.plocks.lock(order_id):
+                order = self.orders.get(order_id)
+                if order is None:
+                    continue
+                for oid in order["t_ord"] + [order["s_ord"]]:
+                    await self._cancel_order(oid, order["sym"])
+                await self.client.futures_create_order(
+                    symbol=order["sym"], positionSide="LONG", side="SELL", type=OrderType.MARKET,
+                    quantity=self._round_qty(order["sym"], self._open_quantity(order)))
+                self.orders.pop_position(order_id)
+
+
+async def measure(trader_cls, latency, positions, targets, runs):
+    symbols = [f"C{i}USDT" for i in range(positions)]
+    exchange = FakeExchange(latency=0)
+    trader = create_trader(exchange, symbols)
+    trader.__class__ = trader_cls
+    timings = []
+    for run in range(runs):
+        exchange.latency = 0
+        for i, symbol in enumerate(symbols):
+            add_position(trader, f"wait-{run}-{i}", symbol, targets=targets, tag="bench")
+            await trader._place_collection_orders(f"wait-{run}-{i}")
+        exchange.latency = latency
+        exchange.calls.clear()
+        start = time.perf_counter()
+        await trader.close_trades("bench")
+        timings.append(time.perf_counter() - start)
+        assert not trader.state["orders"]
+    return timings, exchange.calls
+
+
+async def main(args):
+    quiet()
+    for name, cls in (("serial (old)", SerialTrader), ("concurrent", FuturesTrader)):
+        timings, calls = await measure(cls, args.latency, args.positions, args.targets, args.runs)
+        report(name, [
+            ("requests/close-all", sum(calls.values())),
+            ("p50 (ms)", round(percentile(timings, 50) * 1000, 2)),
+            ("p99 (ms)", round(percentile(timings, 99) * 1000, 2)),
+        ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--positions", type=int, default=10)
+    parser.add_argument("--targets", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,54 @@
+# Time taken to protect a filled position with its SL and TP orders, sending one order at a
+# time (old) vs concurrent batchOrders requests, against a stub exchange with injected latency.
+#
+#   python -m benchmarks.collection_orders [--latency 0.05] [--targets 10] [--runs 20]
+import argparse
+import asyncio
+import time
+
+from trader import FuturesTrader
+from trader.testing import FakeExchange, add_position, create_trader
+
+from . import percentile, quiet, report
+
+
+# Replica of the old placement: SL and every TP order awaited one after the other
+class SerialTrader(FuturesTrader):
+    async def _create_orders(self, parent_id, orders):
+        results = {}
+        for params in orders:
+            results[params["newClientOrderId"]] = await self._create_order(parent_id, params)
+        return results
+
+
+async def measure(trader_cls, latency, targets, runs):
+    exchange = FakeExchange(latency=latency)
+    trader = create_trader(exchange, ["BTCUSDT"])
+    trader.__class__ = trader_cls
+    timings = []
+    for i in range(runs):
+        add_position(trader, f"wait-{i}", "BTCUSDT", targets=targets)
+        start = time.perf_counter()
+        await trader._place_collection_orders(f"wait-{i}")
+        timings.append(time.perf_counter() - start)
+        assert len(trader.state["orders"][f"wait-{i}"]["t_ord"]) == targets
+    return timings, exchange.calls
+
+
+async def main(args):
+    quiet()
+    for name, cls in (("serial (old)", SerialTrader), ("batched", FuturesTrader)):
+        timings, calls = await measure(cls, args.latency, args.targets, args.runs)
+        report(name, [
+            ("requests/position", round(sum(calls.values()) / args.runs, 1)),
+            ("p50 (ms)", round(percentile(timings, 50) * 1000, 2)),
+            ("p99 (ms)", round(percentile(timings, 99) * 1000, 2)),
+        ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--targets", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,77 @@
+# Acquisitions/sec through `NamedLock` vs the old one (a global lock around every lookup, a
+# debug log on each side and locks kept forever), for a stream of distinct names - tags and
+# symbols - and for tasks contending on a few.
+#
+#   python -m benchmarks.named_lock [--names 100000] [--tasks 1000] [--hot 5]
+import argparse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from trader.utils import NamedLock, logging
+
+from . import quiet, report
+
+
+# Replica of the old lock
+class GlobalNamedLock:
+    def __init__(self):
+        self._l = asyncio.Lock()
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def lock(self, name):
+        async with self._l:
+            if name not in self._locks:
+                self._locks[name] = asyncio.Lock()
+            lock = self._locks[name]
+        try:
+            await lock.acquire()
+            logging.debug("Acquiring lock for %s", name, color="magenta")
+            yield
+        finally:
+            logging.debug("Releasing lock for %s", name, color="magenta")
+            lock.release()
+
+
+async def distinct(locks, names):
+    start = time.perf_counter()
+    for i in range(names):
+        async with locks.lock(f"tag-{i}"):
+            pass
+    return names / (time.perf_counter() - start)
+
+
+async def contended(locks, tasks, hot):
+    async def _use(i):
+        async with locks.lock(f"SYM{i % hot}"):
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_use(i) for i in range(tasks)))
+    return tasks / (time.perf_counter() - start)
+
+
+async def main(args):
+    quiet()
+    for name, cls in (("old", GlobalNamedLock), ("new", NamedLock)):
+        locks = cls()
+        rows = [("distinct (acq/sec)", round(await distinct(locks, args.names))),
+                ("locks kept", len(locks)),
+                ("contended (acq/sec)", round(await contended(locks, args.tasks, args.hot)))]
+        if isinstance(locks, NamedLock):
+            rows += [(f"waits on {key}", f"{stats.contended} ({round(stats.wait, 3)} s, depth "
+                                         f"{stats.max_depth})")
+                     for key, stats in locks.contention(3)]
+        report(name, rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names", type=int, default=100000)
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--hot", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,92 @@
+# Time from subscribing to a symbol to having its price, polling every second for it (old) vs
+# awaiting the first tick with `PriceStore.wait`, against a simulated feed whose first tick
+# arrives a random delay after subscribing.
+#
+#   python -m benchmarks.price_readiness [--symbols 50] [--min-delay 0.01] [--max-delay 0.8]
+import argparse
+import asyncio
+import random
+import time
+
+from trader.clients.prices import PriceStore
+
+from . import percentile, quiet, report
+
+
+# Feeds ticks for a symbol every `interval` secs, starting a random delay after subscribing
+class SimulatedFeed:
+    def __init__(self, prices: PriceStore, min_delay: float, max_delay: float, interval=0.1):
+        self.prices = prices
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.interval = interval
+        self.first_ticks = []
+        self._tasks = []
+
+    def subscribe(self, symbol: str):
+        self._tasks.append(asyncio.ensure_future(self._ticks(symbol)))
+
+    async def _ticks(self, symbol: str):
+        delay = random.uniform(self.min_delay, self.max_delay)
+        self.first_ticks.append(delay)
+        await asyncio.sleep(delay)
+        sid = self.prices.intern(symbol)
+        while True:
+            self.prices.update(sid, random.uniform(1, 100))
+            await asyncio.sleep(self.interval)
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+# Replica of the old loop in `FuturesTrader._place_order`
+async def poll(prices: PriceStore, symbol: str):
+    for _ in range(10):
+        if prices.get(symbol) is not None:
+            break
+        await asyncio.sleep(1)
+    return prices.get(symbol)
+
+
+async def wait(prices: PriceStore, symbol: str):
+    return await prices.wait(symbol, timeout=10)
+
+
+async def measure(get_price, args):
+    prices = PriceStore()
+    feed = SimulatedFeed(prices, args.min_delay, args.max_delay)
+
+    async def _one(symbol):
+        start = time.perf_counter()
+        feed.subscribe(symbol)
+        assert await get_price(prices, symbol) is not None
+        return time.perf_counter() - start
+
+    timings = await asyncio.gather(*[_one(f"SYM{i}USDT") for i in range(args.symbols)])
+    feed.stop()
+    return timings, feed.first_ticks
+
+
+def main(args):
+    quiet()
+    for name, get_price in (("poll every second (old)", poll), ("PriceStore.wait", wait)):
+        timings, first = asyncio.run(measure(get_price, args))
+        ticks = first
+        report(name, [
+            ("p50 (ms)", round(percentile(timings, 50) * 1000, 1)),
+            ("p99 (ms)", round(percentile(timings, 99) * 1000, 1)),
+            ("max (ms)", round(max(timings) * 1000, 1)),
+        ])
+    report("first tick (in the last run)", [
+        ("p50 (ms)", round(percentile(ticks, 50) * 1000, 1)),
+        ("p99 (ms)", round(percentile(ticks, 99) * 1000, 1)),
+    ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--min-delay", type=float, default=0.01)
+    parser.add_argument("--max-delay", type=float, default=0.8)
+    main(parser.parse_args())
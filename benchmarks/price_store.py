@@ -0,0 +1,92 @@
+# Replays combined-stream frames through the old price path (stream name parsing and TTLCache
+# writes) and through `PriceFeed._on_message` with a `PriceStore`. The bundled frames are
+# synthetic (see `benchmarks.synthetic_frames`) - `--record` captures real ones to replay.
+#
+#   python -m benchmarks.price_store [--frames benchmarks/data/aggtrade_synthetic.jsonl] [--repeat 200]
+#   python -m benchmarks.price_store --record out.jsonl --symbols btcusdt ethusdt --count 5000
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from cachetools import TTLCache
+
+from trader.clients.prices import PriceFeed, PriceStore, PriceStream
+
+from . import report
+
+FRAMES_PATH = os.path.join(os.path.dirname(__file__), "data", "aggtrade_synthetic.jsonl")
+
+
+def old_path(frames, prices):
+    for msg in frames:
+        symbol = msg["stream"].split("@")[0].upper()
+        prices[symbol.upper()] = float(msg["data"]["p"])
+
+
+def new_path(frames, feed):
+    on_message = feed._on_message
+    for msg in frames:
+        on_message(msg)
+
+
+def load_frames(path):
+    with open(path) as fd:
+        return [json.loads(line) for line in fd if line.strip()]
+
+
+def bench(name, func, frames, target, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(frames, target)
+    elapsed = time.perf_counter() - start
+    count = len(frames) * repeat
+    report(name, [
+        ("frames", count),
+        ("ns/frame", round(elapsed / count * 1e9, 1)),
+        ("frames/sec", int(count / elapsed)),
+    ])
+
+
+async def record(path, symbols, stream, count):
+    from binance import AsyncClient, BinanceSocketManager
+
+    client = await AsyncClient.create()
+    manager = BinanceSocketManager(client)
+    subs = [f"{s.lower()}@{stream}" for s in symbols]
+    with open(path, "w") as fd:
+        async with manager.futures_multiplex_socket(subs) as sock:
+            for _ in range(count):
+                msg = await sock.recv()
+                if msg is not None:
+                    fd.write(json.dumps(msg) + "\n")
+    await client.close_connection()
+
+
+async def main(args):
+    frames = load_frames(args.frames)
+    symbols = {msg["stream"].split("@")[0].upper() for msg in frames}
+    bench("TTLCache (old)", old_path, frames, TTLCache(maxsize=1000, ttl=10), args.repeat)
+
+    feed = PriceFeed(None, PriceStore(), stream=PriceStream.AGG_TRADE,
+                     max_streams=len(symbols))
+    for symbol in symbols:
+        feed.subscribe(symbol)
+    feed.stop()  # replaying frames - no need for sockets
+    bench("PriceStore", new_path, frames, feed, args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", default=FRAMES_PATH)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--record")
+    parser.add_argument("--symbols", nargs="+", default=["btcusdt", "ethusdt"])
+    parser.add_argument("--stream", default=PriceStream.AGG_TRADE)
+    parser.add_argument("--count", type=int, default=5000)
+    args = parser.parse_args()
+    if args.record:
+        asyncio.run(record(args.record, args.symbols, args.stream, args.count))
+    else:
+        asyncio.run(main(args))
@@ -0,0 +1,84 @@
+# Signals/sec through price correction - the old power-by-power search and `map` over the targets,
+# the closed form in `Signal.correct`, and `correct_signals` over the whole batch (needs numpy).
+#
+#   python -m benchmarks.signal_correct [--signals 100000]
+import argparse
+import math
+import random
+import time
+
+from trader.backtest import correct_signals
+from trader.signal import Signal
+
+from . import report
+
+
+# Replica of the old correction
+class SearchSignal(Signal):
+    def correct(self, price):
+        if self.entry is None:
+            self.entry = price
+        else:
+            self.entry *= self.factor(self.entry, price)
+        self.sl *= self.factor(self.sl, price)
+        if self.percent_targets:
+            diff = self.entry - self.sl
+            self.targets = list(map(lambda i: self.entry + diff * i / 100, self.targets))
+        self.targets = list(
+            map(lambda i: round(i * self.factor(i, price), 10), self.targets))
+        self.size(price)
+
+    def factor(self, sig_p, mark_p):
+        minima = math.inf
+        factor = 1
+        for i in range(self.MIN_PRECISION * 2):
+            f = 1 / (10 ** (self.MIN_PRECISION - i))
+            dist = abs(sig_p * f - mark_p) / mark_p
+            if dist < minima:
+                minima = dist
+                factor = f
+            else:
+                break
+        return factor
+
+
+def make_signals(cls, count, seed=1):
+    # around a mark between 1e-5 and 1e5, with a share of the prices given without their zeros
+    rng = random.Random(seed)
+    signals, marks = [], []
+    for _ in range(count):
+        mark = 10 ** rng.uniform(-5, 5)
+        scale = 10 ** rng.choice([0, 0, 0, 3, -3])
+        side = rng.choice([1, -1])
+        entry = None if rng.random() < 0.5 else mark * (1 - side * 0.01) * scale
+        targets = [mark * (1 + side * pct) * scale for pct in (0.02, 0.04, 0.06)]
+        signals.append(cls("X", "USDT", mark * (1 - side * 0.03) * scale, is_long=side > 0,
+                           entry=entry, targets=targets))
+        marks.append(mark)
+    return signals, marks
+
+
+def measure(correct, cls, count):
+    signals, marks = make_signals(cls, count)
+    start = time.perf_counter()
+    correct(signals, marks)
+    return count / (time.perf_counter() - start)
+
+
+def correct_each(signals, marks):
+    for sig, mark in zip(signals, marks):
+        sig.correct(mark)
+
+
+def main(args):
+    report(f"{args.signals} signals, 3 targets each", [
+        ("search (signals/sec)", round(measure(correct_each, SearchSignal, args.signals))),
+        ("closed form (signals/sec)", round(measure(correct_each, Signal, args.signals))),
+        ("batch (signals/sec)", round(measure(correct_signals, Signal, args.signals))),
+    ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signals", type=int, default=100000)
+    main(parser.parse_args())
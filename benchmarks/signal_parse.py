@@ -0,0 +1,46 @@
+# Messages/sec through `FuturesParser.parse` vs the old pop-from-the-front parser, for signals,
+# commands and the channel's everyday chatter, which is most of what it sees.
+#
+#   python -m benchmarks.signal_parse [--repeat 20000]
+import argparse
+import time
+
+from trader.signal import CHANNELS, BINANCE_USDT_FUTURES
+from trader.test_signal import ReferenceParser
+
+from . import report
+
+MESSAGES = {
+    "signals": ["long akro sl 0.05", "l chr 0.25 sl 0.23 tp 0.27 0.29",
+                "long dydx sl 20.4 tp 75% 150%", "s atom 32.7 sl 32.73 tp 50% 75% force",
+                "s btc 41000 sl 42150.5 soft tp 40000 39500 39000 38000 risk 2"],
+    "commands": ["cancel my_tag", "change my_tag sl 25.45", "change my_tag tp 25 30 34",
+                 "change my_tag r -0.5% @ 15.7"],
+    "chatter": ["gm everyone", "BTC looking strong into the weekly open, watching 42k",
+                "Results for the week: +14.2R", "Who's in on ETH?",
+                "Reminder that the market is closed for maintenance tomorrow"],
+}
+
+
+def measure(parse, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            try:
+                parse(text)
+            except Exception:
+                pass
+    return repeat * len(texts) / (time.perf_counter() - start)
+
+
+def main(args):
+    parsers = [("old", ReferenceParser("USDT")), ("new", CHANNELS[BINANCE_USDT_FUTURES])]
+    for kind, texts in MESSAGES.items():
+        report(kind, [(f"{name} (msgs/sec)", round(measure(parser.parse, texts, args.repeat)))
+                      for name, parser in parsers])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20000)
+    main(parser.parse_args())
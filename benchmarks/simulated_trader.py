@@ -0,0 +1,100 @@
+# Signals/sec and signal-to-order latency of `markets.futures.FuturesTrader` against the local
+# exchange simulator, for bursts of signals queued at once, with prices replayed from the
+# synthetic aggTrade frames (see `benchmarks.synthetic_frames`).
+#
+#   python -m benchmarks.simulated_trader [--signals 500] [--bursts 1,10,100] [--latency 0.02]
+#                                         [--workers 8]
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from trader.clients.simulator import SimulatedExchange, load_ticks
+from trader.markets.futures import FuturesTrader
+from trader.metrics import TRACER
+from trader.scheduler import SCHEDULER_WORKERS
+from trader.signal import Signal
+from trader.storage import JournaledStorage
+
+from . import quiet, report
+
+DATA = os.path.join(os.path.dirname(__file__), "data", "aggtrade_synthetic.jsonl")
+
+
+async def _replay_forever(exchange, ticks):
+    while True:
+        await exchange.replay(ticks, speed=1)
+
+
+def _append_to(messages):
+    async def _append(msg):
+        messages.append(msg)
+
+    return _append
+
+
+def _placed():
+    total = TRACER.histograms.get("total")
+    return 0 if total is None else total.count
+
+
+async def measure(args, burst):
+    exchange = SimulatedExchange(balance=1e9, latency=args.latency, jitter=args.jitter, seed=1)
+    ticks = load_ticks(DATA)
+    symbols = sorted({symbol for _, symbol, _ in ticks})
+    with tempfile.TemporaryDirectory() as path:
+        trader = FuturesTrader(exchange, JournaledStorage(os.path.join(path, "state.json")),
+                               workers=args.workers, max_queued=args.signals)
+        with trader.storage:
+            await trader.init()
+            await exchange.replay(ticks)  # every symbol has a price
+            asyncio.ensure_future(_replay_forever(exchange, ticks))
+            failed = []
+            trader.register_message_handler(_append_to(failed))
+            trader._gather_orders()
+            TRACER.histograms.clear()
+
+            start = time.perf_counter()
+            for i in range(0, args.signals, burst):
+                queued = i + min(burst, args.signals - i)
+                for j in range(i, queued):
+                    symbol = symbols[j % len(symbols)]
+                    price = exchange.prices[symbol]
+                    # small enough for the balance to cover every position
+                    sig = Signal(symbol[:-4], "USDT", price * 0.95, targets=[price * 1.05],
+                                 leverage=10, risk_factor=0.01)
+                    sig.tag = f"{sig.coin.lower()}-{j}"
+                    sig.trace = TRACER.start(sig.tag)
+                    await trader.queue_signal(sig)
+                while _placed() + len(failed) < queued:
+                    await asyncio.sleep(0.001)
+            elapsed = time.perf_counter() - start
+            await trader.close()
+    # and the replay and the exchange's event dispatcher
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+    return elapsed, TRACER.histograms["total"], len(failed)
+
+
+async def main(args):
+    quiet()
+    for burst in map(int, args.bursts.split(",")):
+        elapsed, total, failed = await measure(args, burst)
+        report(f"bursts of {burst}", [
+            ("signals/sec", round(args.signals / elapsed, 1)),
+            ("failed", failed),
+            ("p50 (ms)", round(total.quantile(0.5) * 1000, 2)),
+            ("p99 (ms)", round(total.quantile(0.99) * 1000, 2)),
+        ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signals", type=int, default=500)
+    parser.add_argument("--bursts", default="1,10,100")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=SCHEDULER_WORKERS)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+# Durable order state updates: rewriting the whole JSON state for every update (what saving
+# `PersistentDict` on every change would take) vs the journal with group commits, and the time
+# taken to recover 100k orders from the journal alone or from a snapshot.
+#
+#   python -m benchmarks.storage [--orders 100000] [--concurrency 256] [--dir /tmp]
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from trader.storage import JournaledStorage
+
+from . import quiet, report
+
+
+def order_args(i):
+    return (f"wait-{i:08d}", "BTCUSDT", 20000.0 + i, 0.1, [21000.0, 22000.0], 19000.0, f"tag-{i}")
+
+
+def rewrite_rate(path, orders, samples=5):
+    state = {"orders": {f"wait-{i:08d}": {"sym": "BTCUSDT", "ent": 20000.0 + i, "qty": 0.1,
+                                          "tgt": [21000.0, 22000.0], "sl": 19000.0, "tag": f"tag-{i}",
+                                          "t_ord": [], "s_ord": None} for i in range(orders)}}
+    start = time.perf_counter()
+    for _ in range(samples):
+        with open(path, "w") as fd:
+            json.dump(state, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+    return samples / (time.perf_counter() - start)
+
+
+async def fill(storage, orders, concurrency):
+    start = time.perf_counter()
+    for i in range(0, orders, concurrency):
+        await asyncio.gather(*[storage.register_position(*order_args(j))
+                               for j in range(i, min(orders, i + concurrency))])
+    return orders / (time.perf_counter() - start)
+
+
+def recover(path):
+    start = time.perf_counter()
+    storage = JournaledStorage(path).__enter__()
+    asyncio.run(storage.init())
+    elapsed = time.perf_counter() - start
+    return storage, elapsed
+
+
+def main(args):
+    quiet()
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        rate = rewrite_rate(os.path.join(root, "full.json"), args.orders)
+        report(f"rewrite state on every update ({args.orders} orders)", [
+            ("updates/s", round(rate, 1)),
+        ])
+
+        path = os.path.join(root, "state.json")
+        storage = JournaledStorage(path, snapshot_every=args.orders * 2).__enter__()
+        asyncio.run(storage.init())
+        serial = asyncio.run(fill(storage, min(args.orders, 2000), 1))
+        storage.__exit__(None, None, None)
+        os.remove(path)
+
+        storage = JournaledStorage(path, snapshot_every=args.orders * 2).__enter__()
+        asyncio.run(storage.init())
+        grouped = asyncio.run(fill(storage, args.orders, args.concurrency))
+        report("journal", [
+            ("updates/s (one at a time)", round(serial, 1)),
+            (f"updates/s ({args.concurrency} at a time)", round(grouped, 1)),
+        ])
+
+        # process killed: everything is in the journal
+        recovered, from_journal = recover(path)
+        assert len(recovered.orders) == args.orders
+        recovered.__exit__(None, None, None)  # compacts into a snapshot
+        recovered, from_snapshot = recover(path)
+        assert len(recovered.orders) == args.orders
+        report(f"recovery ({args.orders} orders)", [
+            ("journal replay (ms)", round(from_journal * 1000, 1)),
+            ("snapshot (ms)", round(from_snapshot * 1000, 1)),
+        ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--dir", default=None)
+    main(parser.parse_args())
@@ -0,0 +1,62 @@
+# Generates the synthetic aggTrade frames bundled for the benchmarks, in the combined-stream
+# format: a few symbols with roughly the activity split of the busiest futures, each price on a
+# seeded random walk. They're not market data - `python -m benchmarks.price_store --record`
+# captures real frames to replay instead.
+#
+#   python -m benchmarks.synthetic_frames [--out benchmarks/data/aggtrade_synthetic.jsonl]
+#                                         [--count 3000] [--seed 1]
+import argparse
+import json
+import os
+import random
+
+FRAMES_PATH = os.path.join(os.path.dirname(__file__), "data", "aggtrade_synthetic.jsonl")
+START_MS = 1_666_000_000_000
+
+# symbol -> (share of the frames, starting price, decimals)
+SYMBOLS = {
+    "BTCUSDT": (0.41, 19253.26, 2),
+    "ETHUSDT": (0.24, 1309.70, 2),
+    "BNBUSDT": (0.08, 271.97, 2),
+    "SOLUSDT": (0.06, 31.209, 3),
+    "XRPUSDT": (0.06, 0.4710, 4),
+    "DOGEUSDT": (0.06, 0.060284, 6),
+    "ADAUSDT": (0.04, 0.3572, 4),
+    "MATICUSDT": (0.03, 0.8121, 4),
+    "DOTUSDT": (0.01, 6.1203, 4),
+    "LTCUSDT": (0.01, 52.297, 3),
+}
+STEP_STDDEV = 0.0002  # of the price, between a symbol's consecutive trades
+
+
+def generate(count, seed):
+    rand = random.Random(seed)
+    symbols = list(SYMBOLS)
+    weights = [SYMBOLS[s][0] for s in symbols]
+    prices = {s: SYMBOLS[s][1] for s in symbols}
+    ts, trade_id = START_MS, 6_000_000_000
+    for agg_id in range(3_000_000_001, 3_000_000_001 + count):
+        symbol = rand.choices(symbols, weights)[0]
+        decimals = SYMBOLS[symbol][2]
+        prices[symbol] *= 1 + rand.gauss(0, STEP_STDDEV)
+        ts += rand.randint(0, 14)
+        first, trade_id = trade_id + 1, trade_id + 1 + rand.randint(0, 3)
+        yield {"stream": f"{symbol.lower()}@aggTrade", "data": {
+            "e": "aggTrade", "E": ts + rand.randint(1, 5), "a": agg_id, "s": symbol,
+            "p": f"{prices[symbol]:.{decimals}f}", "q": f"{rand.uniform(0.001, 50):.3f}",
+            "f": first, "l": trade_id, "T": ts, "m": rand.random() < 0.5}}
+
+
+def main(args):
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as fd:
+        for frame in generate(args.count, args.seed):
+            fd.write(json.dumps(frame, separators=(",", ":")) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default=FRAMES_PATH)
+    parser.add_argument("--count", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
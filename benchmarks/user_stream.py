@@ -0,0 +1,117 @@
+# Latency from a user data frame arriving on the websocket to `_ord_fill_hdr` being called,
+# for the push-based `BinanceUserStream` vs the old buffer polling bridge.
+#
+#   python -m benchmarks.user_stream [--frames 500] [--interval 0.01]
+import argparse
+import asyncio
+import collections
+import json
+import threading
+import time
+
+import websockets
+
+from trader.clients.binance import BinanceFuturesClient, BinanceUserStream
+
+from . import percentile, quiet, report
+
+POLL_INTERVAL = 0.05
+
+
+# Frames are fed by the local websocket reader instead of a Binance connection
+class LocalUserStream(BinanceUserStream):
+    def _start(self):
+        pass
+
+
+# Replica of the old bridge: the websocket thread appends to a buffer which is polled every 50 ms
+class PollingUserStream(BinanceUserStream):
+    def start(self, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._queue = asyncio.Queue()
+        self._buffer = collections.deque()
+        threading.Thread(target=self._poll, daemon=True).start()
+
+    def feed(self, buf, *_args, **_kwargs):
+        self._buffer.append(buf)
+
+    def _poll(self):
+        while True:
+            if not self._buffer:
+                time.sleep(POLL_INTERVAL)
+                continue
+            buf = self._buffer.popleft()
+            self._loop.call_soon_threadsafe(
+                self._queue.put_nowait, (time.monotonic(), json.loads(buf)))
+
+
+def fill_frame(seq):
+    return json.dumps({
+        "e": "ORDER_TRADE_UPDATE",
+        "E": int(time.time() * 1000),
+        "o": {"i": seq, "c": f"bench-{seq}", "X": "FILLED", "ap": "1.5", "q": "10"},
+    })
+
+
+async def serve_frames(ws, count, interval):
+    for seq in range(count):
+        await ws.send(fill_frame(seq))
+        await asyncio.sleep(interval)
+
+
+def read_frames(port, stream, arrivals, done):
+    async def _reader():
+        async with websockets.connect(f"ws://127.0.0.1:{port}") as ws:
+            async for buf in ws:
+                arrivals[json.loads(buf)["o"]["i"]] = time.monotonic()
+                stream.feed(buf)
+        done.set()
+
+    asyncio.new_event_loop().run_until_complete(_reader())
+
+
+async def measure(stream_cls, count, interval):
+    arrivals, latencies = {}, []
+    finished = asyncio.Event()
+
+    async def _on_fill(event):
+        latencies.append(time.monotonic() - arrivals[event.order_id])
+        if len(latencies) == count:
+            finished.set()
+
+    client = BinanceFuturesClient("key", "secret", latency_budget=1)
+    client._ustream = stream_cls("key", "secret", latency_budget=1)
+    client._ustream.start()
+    client.register_order_fill_update(_on_fill)
+    client._subscribe_user_events()
+
+    server = await websockets.serve(
+        lambda ws, *_: serve_frames(ws, count, interval), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    done = threading.Event()
+    threading.Thread(target=read_frames, args=(port, client._ustream, arrivals, done),
+                     daemon=True).start()
+    await asyncio.wait_for(finished.wait(), timeout=count * interval + 30)
+    server.close()
+    await server.wait_closed()
+    return latencies
+
+
+async def main(count, interval):
+    quiet()
+    for name, cls in (("polling (old)", PollingUserStream), ("push", LocalUserStream)):
+        latencies = await measure(cls, count, interval)
+        report(name, [
+            ("frames", len(latencies)),
+            ("p50 (ms)", round(percentile(latencies, 50) * 1000, 3)),
+            ("p99 (ms)", round(percentile(latencies, 99) * 1000, 3)),
+            ("max (ms)", round(max(latencies) * 1000, 3)),
+        ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=0.01)
+    args = parser.parse_args()
+    asyncio.run(main(args.frames, args.interval))
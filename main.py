@@ -1,10 +1,10 @@
 import asyncio
-import json
 import logging
 import os
 import signal
 
 from trader.logger import DEFAULT_LOGGER
+from trader.storage import JournaledStorage
 from trader.telegram import TeleTrader
 
 API_ID = int(os.getenv("API_ID"))
@@ -13,32 +13,35 @@ API_KEY = os.getenv("API_KEY")
 API_SECRET = os.getenv("API_SECRET")
 SESSION_PATH = os.getenv("SESSION_PATH")
 STATE_PATH = os.getenv("STATE_PATH")
+RESULTS_CHANNEL = int(os.getenv("RESULTS_CHANNEL")) if os.getenv("RESULTS_CHANNEL") else None
+METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
 TEST = os.getenv("TEST")
 
 # fine to use this logger in async - not looking for performance
 DEFAULT_LOGGER.setLevel(logging.INFO)
 loop = asyncio.get_event_loop()
 
-state = {}
-if STATE_PATH is not None and os.path.exists(STATE_PATH):
-    with open(STATE_PATH) as fd:
-        state = json.load(fd)
 
-
-async def main():
-    client = TeleTrader(API_ID, API_HASH, session=SESSION_PATH, state=state, loop=loop)
+async def main(storage=None):
+    client = TeleTrader(API_ID, API_HASH, session=SESSION_PATH, loop=loop, metrics_port=METRICS_PORT,
+                        results_channel=RESULTS_CHANNEL, storage=storage)
     await client.init(API_KEY, API_SECRET)
     try:
         await client.run()
     except asyncio.CancelledError:
         pass
 
-try:
-    task = asyncio.ensure_future(main())
+
+def run(storage=None):
+    task = asyncio.ensure_future(main(storage))
     loop.add_signal_handler(signal.SIGINT, task.cancel)
     loop.add_signal_handler(signal.SIGTERM, task.cancel)
     loop.run_until_complete(task)
-finally:
-    if STATE_PATH is not None:
-        with open(STATE_PATH, "w") as fd:
-            json.dump(state, fd, indent=2)
+
+
+# State changes are journaled as they happen, so a crash doesn't lose them
+if STATE_PATH is None:
+    run()
+else:
+    with JournaledStorage(STATE_PATH) as storage:
+        run(storage)
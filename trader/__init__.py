@@ -1,17 +1,33 @@
 import asyncio
-import math
 import json
 import uuid
 import time
 import traceback
+from collections import defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Dict, List, Optional
 
-from cachetools import TTLCache
+from binance import BinanceSocketManager
+from binance.exceptions import BinanceAPIException
 
-from .errors import EntryCrossedException, InsufficientQuantityException, PriceUnavailableException
-from .logger import DEFAULT_LOGGER as logging
-from .signal import Signal
+from .clients import OrderType, SymbolRules
+from .clients.binance import BinanceUserStream as UserStream, UserEventType, compile_symbol_rules
+from .clients.http import Lane, PooledAsyncClient, lane
+from .clients.leverage import LeverageCache
+from .clients.prices import PriceFeed, PriceStore, PriceStream
+from .dedup import SignalIndex
+from .errors import (EntryCrossedException, InsufficientQuantityException, MinNotionalException,
+                     PriceUnavailableException, QuantityLimitException)
+from .logger import get_logger
+from .messages import Message
+from .metrics import TRACER
+from .scheduler import Priority, Scheduler
+from .signal import PRECISION_FACTORS, Signal, precision_index
+from .storage import OrderStore, PersistentDict
 from .utils import NamedLock
 
+logging = get_logger(__name__)
+
 WAIT_ORDER_EXPIRY = 24 * 60 * 60
 NEW_ORDER_TIMEOUT = 5 * 60
 ORDER_WATCH_INTERVAL = 2 * 60
@@ -19,179 +35,504 @@ ORDER_MAX_RETRIES = 10
 ORDER_RETRY_SLEEP = 5
 PRICE_SLIPPAGE = 1.5  # skip order if funds allocated exceeds estimation by this much
 MAX_TARGETS = 10
+ORDER_BATCH_SIZE = 5  # max orders in a single batchOrders request
+ORDER_BATCH_RETRIES = 2  # attempts for each order which failed in a batch
 DEFAULT_RR = 0.4
+PRICE_WAIT_TIMEOUT = 10  # secs to wait for the first price of a newly subscribed symbol
+CLOSE_CONCURRENCY = 5  # symbols closed at once when closing trades
+CANCEL_BATCH_SIZE = 10  # max orders in a single batch cancel request
+SIGNAL_WORKERS = 8  # signals and commands processed at once
+SIGNAL_QUEUE_SIZE = 100  # signals waiting to be processed, beyond which new ones are dropped
+
+
+def _corrected(price: float, mark: float) -> float:
+    # as signals' prices are corrected against the mark price
+    return price * PRECISION_FACTORS[precision_index(price, mark)]
+
+
+class OrderID:
+    WAIT = "wait-"
+    MARKET = "mrkt-"
+    TARGET = "trgt-"
+    STOP_LOSS = "stop-"
+
+    @classmethod
+    def _new(cls, prefix: str) -> str:
+        return prefix + uuid.uuid4().hex[:24]
+
+    @classmethod
+    def wait(cls):
+        return cls._new(cls.WAIT)
+
+    @classmethod
+    def market(cls):
+        return cls._new(cls.MARKET)
+
+    @classmethod
+    def target(cls):
+        return cls._new(cls.TARGET)
+
+    @classmethod
+    def stop_loss(cls):
+        return cls._new(cls.STOP_LOSS)
+
+    @classmethod
+    def is_wait(cls, order_id: str):
+        return order_id.startswith(cls.WAIT)
+
+    @classmethod
+    def is_market(cls, order_id: str):
+        return order_id.startswith(cls.MARKET)
+
+    @classmethod
+    def is_target(cls, order_id: str):
+        return order_id.startswith(cls.TARGET)
+
+    @classmethod
+    def is_stop_loss(cls, order_id: str):
+        return order_id.startswith(cls.STOP_LOSS)
+
+    @classmethod
+    def lane(cls, orders: list) -> int:
+        # request lane for placing these orders - the most urgent one among them
+        return min(Lane.STOP if cls.is_stop_loss(p["newClientOrderId"]) else
+                   Lane.TARGET if cls.is_target(p["newClientOrderId"]) else
+                   Lane.ENTRY for p in orders)
+
+
+# Outcome of closing a position. `quantity` is what was closed at market (0 if the entry wasn't
+# filled, in which case it was just cancelled).
+class CloseResult:
+    def __init__(self, order_id: str, symbol: str, quantity: float = 0, response=None, error=None):
+        self.order_id = order_id
+        self.symbol = symbol
+        self.quantity = quantity
+        self.response = response
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return (f"CloseResult({self.order_id}, {self.symbol}, quantity={self.quantity}, "
+                f"error={self.error!r})")
 
 
 class FuturesTrader:
     def __init__(self):
-        self.client: AsyncClient = None
+        self.client: PooledAsyncClient = None
         self.state: dict = None
-        self.prices: dict = {}
+        self.orders: OrderStore = None
+        self.prices = PriceStore()
+        self.leverage = LeverageCache()
         self.symbols: dict = {}
+        self.rules: Dict[str, SymbolRules] = {}
         self.price_streamer = None
         self.clocks = NamedLock()
-        self.olock = asyncio.Lock()  # lock to place only one order at a time
+        # Lock for each parent order (position), held while talking to the exchange about it.
+        # NOTE: Changes to `self.orders` are always made without awaiting in between, so
+        # they're atomic on the event loop and don't need a global lock.
+        self.plocks = NamedLock()
+        self.storage: Optional[PersistentDict] = None  # journals order changes, if given
         self.slock = asyncio.Lock()  # lock for stream subscriptions
-        self.order_queue = asyncio.Queue()
-        # cache to disallow orders with same symbol, entry and first TP for 12 hours
-        self.sig_cache = TTLCache(maxsize=1000, ttl=12 * 3600)
+        self.close_slots = asyncio.Semaphore(CLOSE_CONCURRENCY)
+        self.scheduler = Scheduler(SIGNAL_WORKERS, SIGNAL_QUEUE_SIZE)
+        self.seen = SignalIndex()  # recent signals, to turn away reposts
         self.balance = 0
         self.results_handler = None
         self.ocount = 0
 
-    async def init(self, api_key, api_secret, state={}, test=False, loop=None):
-        self.state = state
-        self.client = await AsyncClient.create(
+    async def init(self, api_key, api_secret, state={}, test=False, loop=None, storage=None):
+        # with `storage`, the state is the one it persists (and `state` is ignored)
+        self.storage = storage
+        self.state = state if storage is None else storage.state
+        self.client = await PooledAsyncClient.create(
             api_key=api_key, api_secret=api_secret, testnet=test, loop=loop)
+        await self.client.warm_up()
+        self.client.keep_alive()
         self.manager = BinanceSocketManager(self.client, loop=loop)
+        self.price_streamer = PriceFeed(self.manager, self.prices, stream=PriceStream.AGG_TRADE)
+        self.price_streamer.start()
         self.user_stream = UserStream(api_key, api_secret, test=test)
         if not self.state.get("streams"):
             self.state["streams"] = []
         if not self.state.get("orders"):
             self.state["orders"] = {}
+        if self.storage is None:
+            self.orders = OrderStore(self.state["orders"])
+        else:
+            await self.storage.init()
+            self.orders = self.storage.orders
+        if not self.state.get("seen"):
+            self.state["seen"] = {}
+        self.seen = SignalIndex(self.state["seen"], track_changes=True)
         await self._gather_orders()
         await self._watch_orders()
         await self._subscribe_futures_user()
         resp = await self.client.futures_exchange_info()
         for info in resp["symbols"]:
             self.symbols[info["symbol"]] = info
+            self.rules[info["symbol"]] = compile_symbol_rules(info)
+        self.leverage.seed(await self.client.futures_symbol_config())
         resp = await self.client.futures_account_balance()
         for item in resp:
             if item["asset"] == "USDT":
                 self.balance = float(item["balance"])
         logging.info(f"Account balance: {self.balance} USDT", on="blue")
 
-    async def queue_signal(self, signal: Signal):
-        await self.order_queue.put(signal)
+    async def queue_signal(self, signal: Signal) -> bool:
+        if self.symbols.get(f"{signal.coin}USDT") is None:
+            logging.info(f"Unknown symbol {signal.coin} in signal", color="yellow")
+            TRACER.discard(signal.trace)
+            return False
+        if self.seen.check(signal):
+            logging.info(f"Ignoring repeated signal for {signal.coin}: {signal}", color="yellow")
+            TRACER.discard(signal.trace)
+            return False
+        fingerprint = self.seen.fingerprint(signal)
+        await self._save_seen()
+
+        if signal.tag:
+            signal.tag += f"-{self.ocount}"
+        else:
+            signal.tag = f"{signal.coin.lower()}-{self.ocount}"
+        self.ocount += 1
+
+        # Signals which don't end up with an order are forgotten, so that a repost can take
+        # their place
+        async def _process():
+            if not await self._process_signal(signal):
+                self.seen.discard(fingerprint)
+                await self._save_seen()
+
+        def _dropped(reason: str):
+            TRACER.discard(signal.trace)
+            self.seen.discard(fingerprint)
+            logging.info(f"Dropped signal {signal.tag} for {signal.coin} ({reason})", color="yellow")
+
+        # A coin only has one order at a time, so a newer signal for it replaces a waiting one
+        return self.scheduler.submit(signal.coin, _process, merge_key=signal.coin, on_drop=_dropped)
+
+    async def _save_seen(self):
+        changed = self.seen.take_changed()
+        if changed and self.storage is not None:
+            await self.storage.save_state("seen", changed)
+
+    def queue_close(self, tag, coin=None) -> bool:
+        # after whatever's queued for the coin, but ahead of other coins' new trades
+        return self.scheduler.submit(coin, lambda: self.close_trades(tag, coin), Priority.COMMAND)
+
+    def queue_amend(self, tag, coin=None, sl=None, targets=None, is_percent=False) -> bool:
+        # like closing - after whatever's queued for the coin, so an edited signal's own order
+        # has been placed by the time it's amended
+        return self.scheduler.submit(
+            coin, lambda: self.amend_trades(tag, coin, sl, targets, is_percent), Priority.COMMAND)
+
+    async def close(self):
+        await self.scheduler.close()
 
-    async def close_trades(self, tag, coin=None):
+    async def close_trades(self, tag, coin=None) -> List[CloseResult]:
         if coin is None:
             logging.info(f"Attempting to close all trades tagged {tag}", color="yellow")
         else:
             logging.info(f"Attempting to close {coin} trades tagged {tag}", color="yellow")
-        async with self.olock:
-            removed = []
-            for order_id, order in self.state["orders"].items():
-                otag = order.get("tag")
-                if not otag:
-                    continue
-                otag = otag.lower()
-                if otag.split("-")[0] != tag.lower() and otag != tag.lower():
-                    continue
-                if coin is not None and order["sym"] != f"{coin}USDT":
-                    continue
-                children = [] + order["t_ord"]
-                if order.get("s_ord"):
-                    children.append(order["s_ord"])
-                removed.append(order_id)
-                removed += children
-                for oid in children:
-                    await self._cancel_order(oid, order["sym"])
-                quantity = 0
-                for tid, q in zip(order["t_ord"], order["t_q"]):
-                    if not self.state["orders"].get(tid, {}).get("filled"):
-                        quantity += q
-                try:
-                    if quantity > 0:
-                        resp = await self.client.futures_create_order(
-                            symbol=order["sym"],
-                            positionSide="LONG" if order["side"] == "BUY" else "SHORT",
-                            side="SELL" if order["side"] == "BUY" else "BUY",
-                            type=OrderType.MARKET,
-                            quantity=self._round_qty(order["sym"], quantity),
-                        )
-                    else:
-                        resp = await self.client.futures_cancel_order(
-                            symbol=order["sym"],
-                            origClientOrderId=order_id,
-                        )
-                    logging.info(f"Closed position for order {order}, resp: {resp}", color="yellow")
-                except Exception as err:
-                    logging.error(f"Failed to close position for order {order}, err: {err}")
-            for oid in removed:
-                self.state["orders"].pop(oid, None)
-            if not removed:
-                logging.info(f"Didn't find any matching positions for {tag} to close", color="yellow")
+        matches = defaultdict(list)
+        for order_id in self.orders.find(tag, None if coin is None else f"{coin}USDT"):
+            matches[self.orders[order_id]["sym"]].append(order_id)
 
-    async def _gather_orders(self):
-        async def _gatherer():
-            logging.info("Waiting for orders to be queued...")
-            while True:
-                signal = await self.order_queue.get()
-                if self.symbols.get(f"{signal.coin}USDT") is None:
-                    logging.info(f"Unknown symbol {signal.coin} in signal", color="yellow")
+        # symbols are closed concurrently (a few at a time), positions of a symbol together
+        closed = await asyncio.gather(*[self._close_symbol(symbol, order_ids)
+                                        for symbol, order_ids in matches.items()])
+        results = [res for group in closed for res in group]
+        if not results:
+            logging.info(f"Didn't find any matching positions for {tag} to close", color="yellow")
+        return results
+
+    async def _close_symbol(self, symbol: str, order_ids: List[str]) -> List[CloseResult]:
+        async with self.close_slots, AsyncExitStack() as stack:
+            # in a fixed order, so that overlapping closes can't deadlock
+            for order_id in sorted(order_ids):
+                await stack.enter_async_context(self._position(order_id))
+            orders = {oid: self.orders[oid] for oid in order_ids if oid in self.orders}
+            if not orders:  # closed in the meantime
+                return []
+            with lane(Lane.STOP):
+                await self._cancel_position_orders(symbol, orders)
+                results = await asyncio.gather(*[self._close_position(oid, order)
+                                                 for oid, order in orders.items()])
+            return list(results)
+
+    def _open_quantity(self, order: dict) -> float:
+        quantity = 0
+        for tid, q in zip(order["t_ord"], order["t_q"]):
+            if not self.orders.get(tid, {}).get("filled"):
+                quantity += q
+        return quantity
+
+    async def _cancel_position_orders(self, symbol: str, orders: Dict[str, dict]):
+        # Everything open on the symbol goes with a single request when all of its positions
+        # are being closed - otherwise the positions' own orders are cancelled in batches.
+        if set(self.orders.positions(symbol)) <= orders.keys():
+            try:
+                resp = await self.client.futures_cancel_all_open_orders(symbol=symbol)
+                logging.info(f"Cancelled open orders for {symbol}: {resp}")
+                return
+            except Exception as err:
+                logging.error(f"Failed to cancel open orders for {symbol}, err: {err}")
+        oids = []
+        for order_id, order in orders.items():
+            oids += [oid for oid in order["t_ord"] if not self.orders.get(oid, {}).get("filled")]
+            if order.get("s_ord"):
+                oids.append(order["s_ord"])
+            if not self._open_quantity(order):  # entry not filled yet
+                oids.append(order_id)
+        batches = [oids[i:i + CANCEL_BATCH_SIZE] for i in range(0, len(oids), CANCEL_BATCH_SIZE)]
+        await asyncio.gather(*[self._cancel_batch(symbol, batch) for batch in batches])
+
+    async def _cancel_batch(self, symbol: str, oids: List[str]) -> List[str]:
+        try:
+            resp = await self.client.futures_cancel_orders(
+                symbol=symbol, origClientOrderIdList=json.dumps(oids, separators=(",", ":")))
+        except Exception as err:
+            logging.error(f"Failed to cancel orders {oids}: {err}")
+            return []
+        cancelled = []
+        for oid, res in zip(oids, resp):
+            if "code" in res:
+                logging.warning(f"Failed to cancel order {oid}: {res}")
+            else:
+                logging.info(lambda: f"Cancelled order {oid}: {res}")
+                cancelled.append(oid)
+        return cancelled
+
+    async def _close_position(self, order_id: str, order: dict) -> CloseResult:
+        # NOTE: The position's open orders are expected to be cancelled already
+        quantity = self._open_quantity(order)
+        result = CloseResult(order_id, order["sym"])
+        try:
+            if quantity > 0:
+                result.quantity = self._round_qty(order["sym"], quantity)
+                result.response = await self.client.futures_create_order(
+                    symbol=order["sym"],
+                    positionSide="LONG" if order["side"] == "BUY" else "SHORT",
+                    side="SELL" if order["side"] == "BUY" else "BUY",
+                    type=OrderType.MARKET,
+                    quantity=result.quantity,
+                )
+            logging.info(f"Closed position for order {order}, resp: {result.response}", color="yellow")
+        except Exception as err:
+            result.error = err
+            logging.error(f"Failed to close position for order {order}, err: {err}")
+        self.orders.pop_position(order_id)
+        return result
+
+    async def amend_trades(self, tag, coin=None, sl=None, targets=None, is_percent=False) -> List[str]:
+        # Moves the SL and replaces the TPs which changed for the matching positions, leaving
+        # everything else on the exchange alone. Prices are given as in signals (uncorrected).
+        amended = []
+        for order_id in sorted(self.orders.find(tag, None if coin is None else f"{coin}USDT")):
+            async with self._position(order_id):
+                odata = self.orders.get(order_id)
+                if odata is None:  # closed in the meantime
                     continue
+                if await self._amend_position(order_id, odata, sl, targets, is_percent):
+                    amended.append(order_id)
+        if not amended:
+            logging.info(f"Didn't find anything to amend for {tag}", color="yellow")
+        return amended
 
-                if signal.tag:
-                    signal.tag += f"-{self.ocount}"
-                else:
-                    signal.tag = f"{signal.coin.lower()}-{self.ocount}"
-                self.ocount += 1
-
-                async def _process(signal):
-                    if signal.is_partial:
-                        await self._place_partial_order(signal)
-                        return
-
-                    # Process one order at a time for each symbol
-                    async with self.clocks.lock(signal.coin):
-                        registered = await self._register_order_for_signal(signal)
-                        if not registered:
-                            logging.info(f"Ignoring signal from {signal.tag} because order exists "
-                                         f"for {signal.coin}", color="yellow")
-                            return
-                        for i in range(ORDER_MAX_RETRIES):
-                            try:
-                                await self._place_order(signal)
-                                return
-                            except PriceUnavailableException:
-                                logging.info(f"Price unavailable for {signal.coin}", color="red")
-                            except EntryCrossedException as err:
-                                logging.info(f"Price went too fast ({err.price}) for signal {signal}", color="yellow")
-                            except InsufficientQuantityException as err:
-                                logging.info(
-                                    f"Allocated ${round(err.alloc_funds, 2)} for {err.alloc_q} {signal.coin} "
-                                    f"but requires ${round(err.est_funds, 2)} for {err.est_q} {signal.coin}",
-                                    color="red")
-                            except Exception as err:
-                                logging.error(f"Failed to place order: {traceback.format_exc()} {err}")
-                                break  # unknown error - don't block future signals
-                            if i < ORDER_MAX_RETRIES - 1:
-                                await asyncio.sleep(ORDER_RETRY_SLEEP)
-                        await self._unregister_order(signal)
-                        await self.results_handler(Trade.skipped(
-                            signal.tag, "BUY" if signal.is_long else "SELL", signal.coin))
+    async def _amend_position(self, order_id: str, odata: dict, sl=None, targets=None,
+                              is_percent=False) -> bool:
+        symbol, entry = odata["sym"], odata["ent"]
+        if sl:
+            sl = self._round_price(symbol, _corrected(sl, entry))
+            if sl == self._round_price(symbol, odata["sl"]):
+                sl = None
+            elif (sl >= entry) if odata["side"] == "BUY" else (sl <= entry):
+                logging.warning(f"Ignoring SL {sl} on the wrong side of entry for {order_id}")
+                sl = None
+        if targets:
+            if is_percent:
+                diff = entry - (sl or odata["sl"])
+                targets = [entry + diff * i / 100 for i in targets]
+            else:
+                targets = [_corrected(i, entry) for i in targets]
+            targets = [self._round_price(symbol, i) for i in targets[:MAX_TARGETS]]
+            if targets == [self._round_price(symbol, i) for i in odata["tgt"][:MAX_TARGETS]]:
+                targets = None
+        if not sl and not targets:
+            return False
+
+        if odata.get("s_ord") is None and not odata["t_ord"]:
+            # entry isn't filled yet, so its TP/SL orders are placed with these
+            logging.info(f"Amending {order_id} before its entry filled (sl: {sl}, targets: {targets})")
+            if targets:
+                odata["tgt"] = targets
+        else:
+            if sl and any(self.orders.get(tid, {}).get("filled") for tid in odata["t_ord"]):
+                logging.info(f"Not moving SL for {order_id} as it's at entry after taking profits")
+                sl = None
+            if sl:
+                await self._replace_sl_order(order_id, sl)
+            if targets:
+                targets = await self._replace_targets(order_id, odata, targets)
+        if sl:
+            odata["sl"] = sl
+        if not sl and not targets:
+            return False
+        await self.results_handler(Message.amended(odata["tag"], symbol, sl, targets))
+        return True
+
+    async def _replace_targets(self, order_id: str, odata: dict, targets: List[float]) -> List[float]:
+        # With as many TPs as before, only the ones whose price changed are replaced - otherwise
+        # the unfilled ones make way for the new targets beyond those already filled, sharing
+        # their quantity. Returns the prices of the TPs placed.
+        symbol = odata["sym"]
+        slots = [[price, tid, q] for price, tid, q in zip(odata["tgt"], odata["t_ord"], odata["t_q"])]
+        pending = [i for i, (_, tid, _) in enumerate(slots) if not self.orders.get(tid, {}).get("filled")]
+        in_place = len(targets) == len(odata["t_ord"]) == len(odata["tgt"][:MAX_TARGETS])
+        if in_place:
+            pending = [i for i in pending if targets[i] != self._round_price(symbol, slots[i][0])]
+        cancelled = set(await self._cancel_batch(symbol, [slots[i][1] for i in pending])) if pending else set()
+        replaced = [i for i in pending if slots[i][1] in cancelled]
+        for i in replaced:
+            self.orders.pop(slots[i][1], None)
+        if in_place:
+            placing = [(i, targets[i], slots[i][2]) for i in replaced]
+        else:
+            prices = targets[len(slots) - len(replaced):]
+            quantity = sum(slots[i][2] for i in replaced)
+            placing = [(None, price, self._round_qty(symbol, quantity / len(prices))) for price in prices]
+        for i in replaced:
+            slots[i] = None
 
-                asyncio.ensure_future(_process(signal))
+        orders = [self._target_order_params(odata, price, q) for _, price, q in placing]
+        for params in orders:
+            self.orders[params["newClientOrderId"]] = {
+                "parent": order_id,
+                "filled": False,
+            }
+        results = await self._create_orders(order_id, orders) if orders else {}
+        placed = []
+        for (i, price, q), params in zip(placing, orders):
+            oid = params["newClientOrderId"]
+            if results.get(oid) is None:
+                self.orders.pop(oid, None)
+                continue
+            placed.append(price)
+            if i is None:
+                slots.append([price, oid, params["quantity"]])
+            else:
+                slots[i] = [price, oid, params["quantity"]]
+        slots = [slot for slot in slots if slot is not None]
+        odata["tgt"] = [price for price, _, _ in slots]
+        odata["t_ord"] = [tid for _, tid, _ in slots]
+        odata["t_q"] = [q for _, _, q in slots]
+        return placed
+
+    @asynccontextmanager
+    async def _position(self, order_id: str):
+        # Holds the position's lock, and saves its orders (and any removed) before releasing it
+        async with self.plocks.lock(order_id):
+            try:
+                yield
+            finally:
+                await self._save(order_id, *self.orders.children(order_id))
 
-        asyncio.ensure_future(_gatherer())
+    async def _save(self, *order_ids: str):
+        if self.storage is not None:
+            await self.storage.save(*order_ids)
+
+    async def _gather_orders(self):
+        logging.info("Waiting for orders to be queued...")
+        self.scheduler.start()
+
+    async def _process_signal(self, signal: Signal) -> bool:
+        # whether an order was placed for it
+        TRACER.mark(signal.trace, "dequeue")
+        if signal.is_partial:
+            TRACER.discard(signal.trace)
+            await self._place_partial_order(signal)
+            return False
+
+        # Process one order at a time for each symbol
+        async with self.clocks.lock(signal.coin):
+            TRACER.mark(signal.trace, "lock")
+            registered = await self._register_order_for_signal(signal)
+            if not registered:
+                TRACER.discard(signal.trace)
+                logging.info(f"Ignoring signal from {signal.tag} because order exists "
+                             f"for {signal.coin}", color="yellow")
+                return False
+            for i in range(ORDER_MAX_RETRIES):
+                try:
+                    placed = await self._place_order(signal)
+                    if not placed:
+                        await self._unregister_order(signal)
+                    return placed
+                except PriceUnavailableException:
+                    logging.info(f"Price unavailable for {signal.coin}", color="red")
+                except EntryCrossedException as err:
+                    logging.info(f"Price went too fast ({err.price}) for signal {signal}", color="yellow")
+                except InsufficientQuantityException as err:
+                    logging.info(
+                        f"Allocated ${round(err.alloc_funds, 2)} for {err.alloc_q} {signal.coin} "
+                        f"but requires ${round(err.est_funds, 2)} for {err.est_q} {signal.coin}",
+                        color="red")
+                except (MinNotionalException, QuantityLimitException) as err:
+                    logging.info(f"Order for signal {signal} breaks trading rules: {vars(err)}",
+                                 color="red")
+                    break  # retrying won't change the rules
+                except Exception as err:
+                    logging.error(f"Failed to place order: {traceback.format_exc()} {err}")
+                    break  # unknown error - don't block future signals
+                if i < ORDER_MAX_RETRIES - 1:
+                    await asyncio.sleep(ORDER_RETRY_SLEEP)
+            TRACER.discard(signal.trace)
+            await self._unregister_order(signal)
+            await self.results_handler(Message.error(
+                signal.tag, f"Skipped {'BUY' if signal.is_long else 'SELL'} {signal.coin}"))
+            return False
 
     async def _place_partial_order(self, signal: Signal):
-        self._change_leverage(signal)
+        await self._change_leverage(signal)
         # TODO
 
-    async def _place_order(self, signal: Signal):
+    async def _change_leverage(self, signal: Signal):
+        await self.leverage.ensure(f"{signal.coin}USDT", signal.leverage, self._request_leverage)
+
+    async def _request_leverage(self, symbol: str, leverage: int) -> dict:
+        return await self.client.futures_change_leverage(symbol=symbol, leverage=leverage)
+
+    async def _subscribe_futures(self, coin: str):
+        if self.price_streamer is not None:
+            self.price_streamer.subscribe(f"{coin}USDT")
+
+    async def _place_order(self, signal: Signal) -> bool:
+        symbol = f"{signal.coin}USDT"
         await self._subscribe_futures(signal.coin)
-        for _ in range(10):
-            if self.prices.get(signal.coin) is not None:
-                break
+        if symbol not in self.prices:
             logging.info(f"Waiting for {signal.coin} price to be available")
-            await asyncio.sleep(1)
-        if self.prices.get(signal.coin) is None:
+        # resumes with the first tick instead of polling for it
+        price = await self.prices.wait(symbol, timeout=PRICE_WAIT_TIMEOUT)
+        if price is None:
             raise PriceUnavailableException()
+        TRACER.mark(signal.trace, "price")
 
-        price = self.prices[signal.coin]
         signal.correct(price)
         side = "BUY" if signal.is_long else "SELL"
         if signal.risk_reward < self.state["config"].get("rr", DEFAULT_RR):
-            await self.results_handler(Trade.low_rr(signal.tag, side, signal.coin, signal.risk_reward))
-            return
+            TRACER.discard(signal.trace)
+            await self.results_handler(Message.error(
+                signal.tag, f"Skipped {side} {signal.coin} due to low RR ({round(signal.risk_reward, 2)})"))
+            return False
 
-        self._change_leverage(signal)
+        await self._change_leverage(signal)
+        TRACER.mark(signal.trace, "leverage")
         alloc_funds = self.balance * signal.fraction
         quantity = alloc_funds / (price / signal.leverage)
         logging.info(f"Corrected signal: {signal}", color="cyan")
-        symbol = f"{signal.coin}USDT"
         qty = self._round_qty(symbol, quantity)
         est_funds = qty * signal.entry / signal.leverage
         if (est_funds / alloc_funds) > PRICE_SLIPPAGE:
@@ -222,11 +563,15 @@ class FuturesTrader:
         else:
             params["newClientOrderId"] = order_id = OrderID.market()
             logging.info(f"Placing market order for {signal.coin} (price @ {price}, entry @ {signal.entry}")
+        # at the price it's sized with, and with the market limits if it's a market order
+        self.rules[symbol].validate(price, qty, is_market=params["type"] == OrderType.MARKET)
 
-        async with self.olock:  # Lock only for interacting with orders
+        # NOTE: Fill events for this order wait for its lock before looking it up, so they'll find it in state
+        async with self._position(order_id):
             try:
                 resp = await self.client.futures_create_order(**params)
-                self.state["orders"][order_id] = {
+                TRACER.finish(signal.trace, "order")
+                self.orders[order_id] = {
                     "id": resp["orderId"],
                     "qty": float(resp["origQty"]),
                     "sym": symbol,
@@ -242,8 +587,9 @@ class FuturesTrader:
                     "t_ord": [],
                     "t_q": [],
                 }
-                logging.info(f"Created order {order_id} for signal: {signal}, "
-                             f"params: {json.dumps(params)}, resp: {resp}")
+                logging.info(lambda: f"Created order {order_id} for signal: {signal}, "
+                                     f"params: {json.dumps(params)}, resp: {resp}")
+                return True
             except Exception as err:
                 logging.error(f"Failed to create order for signal {signal}: {err}, "
                               f"params: {json.dumps(params)}")
@@ -251,63 +597,135 @@ class FuturesTrader:
                     if err.code == -2021:
                         raise EntryCrossedException(price)
                     elif err.code == -2019:
-                        await self.results_handler(Trade.no_margin(signal))
+                        await self.results_handler(Message.no_margin(signal.asset))
+                return False
 
-    async def _place_collection_orders(self, order_id):
-        await self._place_sl_order(order_id)
-        async with self.olock:
-            odata = self.state["orders"][order_id]
-            await self.results_handler(Trade.entry(
+    async def _place_collection_orders(self, order_id, entry=None):
+        async with self._position(order_id):
+            odata = self.orders.get(order_id)
+            if odata is None:
+                logging.warning(f"Order {order_id} is missing in state (or was closed) before placing TP/SL orders")
+                return
+            if entry is not None:
+                odata["ent"] = entry
+            await self.results_handler(Message.entry(
                 odata["tag"], odata["sym"], odata["ent"], odata["qty"],
-                odata["lev"], odata["side"], odata["sl"], odata["rr"]))
+                odata["side"], odata["sl"], odata["rr"]))
+            orders = []
+            if odata.get("s_ord") is None:
+                orders.append(self._sl_order_params(odata))
             if odata.get("t_ord"):
                 logging.warning(f"TP order(s) already exist for parent {order_id}")
-                return
+            else:
+                targets = odata["tgt"][:MAX_TARGETS]
+                for tgt in targets:
+                    # NOTE: Leaving 20% for moon/gulag, and not closing position (as it'll affect other orders)
+                    quantity = self._round_qty(odata["sym"], (odata["qty"] * 0.8) / len(targets))
+                    orders.append(self._target_order_params(odata, tgt, quantity))
 
-            targets = odata["tgt"][:MAX_TARGETS]
-            remaining = odata["qty"]
-            for i, tgt in enumerate(targets):
-                quantity = (odata["qty"] * 0.8) / len(targets)
-                # NOTE: Leaving 20% for moon/gulag
-                # if i == len(targets) - 1:
-                #     quantity = remaining
-                quantity = self._round_qty(odata["sym"], quantity)
-                # NOTE: Don't close position (as it'll affect other orders)
-                tgt_order_id = await self._create_target_order(
-                    order_id, odata["sym"], odata["side"], tgt, quantity)
-                if tgt_order_id is None:
-                    continue
-                odata["t_ord"].append(tgt_order_id)
-                odata["t_q"].append(quantity)
-                self.state["orders"][tgt_order_id] = {
+            # Children are known before they're sent, so that their fill events can find the
+            # parent (and wait for its lock) even if they arrive before the responses.
+            for params in orders:
+                self.orders[params["newClientOrderId"]] = {
                     "parent": order_id,
                     "filled": False,
                 }
-                remaining -= quantity
+            results = await self._create_orders(order_id, orders)
+            for params in orders:
+                oid = params["newClientOrderId"]
+                if results.get(oid) is None:
+                    self.orders.pop(oid, None)
+                elif OrderID.is_stop_loss(oid):
+                    odata["s_ord"] = oid
+                else:
+                    odata["t_ord"].append(oid)
+                    odata["t_q"].append(params["quantity"])
 
-    async def _create_target_order(self, order_id, symbol, side, tgt_price, rounded_qty):
-        tgt_order_id = OrderID.target()
-        params = {
-            "symbol": symbol,
+    def _target_order_params(self, odata: dict, tgt_price: float, rounded_qty: float):
+        return {
+            "symbol": odata["sym"],
             "type": OrderType.LIMIT,
             "timeInForce": "GTC",
-            "positionSide": "LONG" if side == "BUY" else "SHORT",
-            "side": "SELL" if side == "BUY" else "BUY",
-            "newClientOrderId": tgt_order_id,
-            "price": self._round_price(symbol, tgt_price),
+            "positionSide": "LONG" if odata["side"] == "BUY" else "SHORT",
+            "side": "SELL" if odata["side"] == "BUY" else "BUY",
+            "newClientOrderId": OrderID.target(),
+            "price": self._round_price(odata["sym"], tgt_price),
             "quantity": rounded_qty,
         }
+
+    def _sl_order_params(self, odata: dict, new_price=None, quantity=None):
+        symbol = odata["sym"]
+        return {
+            "symbol": symbol,
+            "positionSide": "LONG" if odata["side"] == "BUY" else "SHORT",
+            "side": "SELL" if odata["side"] == "BUY" else "BUY",
+            "type": OrderType.STOP_MARKET,
+            "newClientOrderId": OrderID.stop_loss(),
+            "stopPrice": self._round_price(symbol, new_price if new_price is not None else odata["sl"]),
+            "quantity": self._round_qty(symbol, (quantity if quantity is not None else odata["qty"])),
+        }
+
+    async def _create_orders(self, parent_id: str, orders: list) -> dict:
+        # Send all batches at once and retry the orders which failed on their own.
+        # Returns the response for each client order ID (or None if it couldn't be placed).
+        batches = [orders[i:i + ORDER_BATCH_SIZE] for i in range(0, len(orders), ORDER_BATCH_SIZE)]
+        responses = await asyncio.gather(*[self._create_batch(batch) for batch in batches])
+        results, failed = {}, []
+        for batch, resp in zip(batches, responses):
+            for params, res in zip(batch, resp):
+                oid = params["newClientOrderId"]
+                if res.get("clientOrderId") == oid:
+                    results[oid] = res
+                    logging.info(lambda: f"Created order {oid} for parent {parent_id}, "
+                                         f"resp: {res}, params: {json.dumps(params)}")
+                else:
+                    failed.append((params, res.get("code")))
+        responses = await asyncio.gather(
+            *[self._create_order(parent_id, params, code) for params, code in failed])
+        for (params, _), res in zip(failed, responses):
+            results[params["newClientOrderId"]] = res
+        return results
+
+    async def _create_batch(self, batch: list) -> list:
+        with lane(OrderID.lane(batch)):
+            return await self._send_batch(batch)
+
+    async def _send_batch(self, batch: list) -> list:
+        if len(batch) == 1:  # not worth the batch endpoint's extra weight
+            try:
+                return [await self.client.futures_create_order(**batch[0])]
+            except Exception as err:
+                return [{"code": getattr(err, "code", None), "msg": str(err)}]
         try:
-            resp = await self.client.futures_create_order(**params)
-            logging.info(f"Created limit order {tgt_order_id} for parent {order_id}, "
-                         f"resp: {resp}, params: {json.dumps(params)}")
-            return tgt_order_id
+            resp = await self.client.futures_place_batch_order(batchOrders=[dict(p) for p in batch])
         except Exception as err:
-            logging.error(f"Failed to create target order for parent {order_id}: {err}, "
-                          f"params: {json.dumps(params)}")
+            resp = []
+            logging.error(f"Failed to create batch of {len(batch)} order(s): {err}")
+        # NOTE: Responses are in the same order as the requests, with errors in place of orders
+        return list(resp) + [{"code": None, "msg": "missing"}] * (len(batch) - len(resp))
+
+    async def _create_order(self, parent_id: str, params: dict, code=None):
+        for _ in range(ORDER_BATCH_RETRIES):
+            if code == -2021 and params["type"] == OrderType.STOP_MARKET:  # price is around SL now
+                logging.info(f"Placing market order for parent {parent_id} "
+                             "after attempt to create SL order", color="yellow")
+                params.pop("stopPrice")
+                params["type"] = OrderType.MARKET
+            try:
+                with lane(OrderID.lane([params])):
+                    resp = await self.client.futures_create_order(**params)
+                logging.info(lambda: f"Created order {params['newClientOrderId']} for parent "
+                                     f"{parent_id}, resp: {resp}, params: {json.dumps(params)}")
+                return resp
+            except Exception as err:
+                logging.error(f"Failed to create order for parent {parent_id}: {err}, "
+                              f"params: {json.dumps(params)}")
+                code = err.code if isinstance(err, BinanceAPIException) else None
 
     async def _handle_event(self, msg: dict):
-        if msg["e"] == UserEventType.AccountUpdate:
+        if msg["e"] == UserEventType.AccountConfigUpdate:
+            self.leverage.on_account_config(msg)
+        elif msg["e"] == UserEventType.AccountUpdate:
             for info in msg["a"]["B"]:
                 if info["a"] == "USDT":
                     self.balance = float(info["cw"])
@@ -315,101 +733,106 @@ class FuturesTrader:
         elif msg["e"] == UserEventType.OrderTradeUpdate:
             info = msg["o"]
             order_id = info["c"]
-            async with self.olock:
-                o = self.state["orders"].get(order_id)
-                if o is None:
-                    logging.warning(f"Received order {order_id} but missing in state")
-                    return
+            if info["X"] == "FILLED" and (OrderID.is_wait(order_id) or OrderID.is_market(order_id)):
+                # NOTE: The fill can beat the order's REST response, so it's looked up in state
+                # under the position's lock (held while the order's being created)
+                entry = float(info["ap"])
+                logging.info(f"Placing TP/SL orders for fulfilled order {order_id} (entry: {entry})", color="green")
+                await self._place_collection_orders(order_id, entry)
+                return
+            o = self.orders.get(order_id)
+            if o is None:
+                logging.warning(f"Received order {order_id} but missing in state")
+                return
             if info["X"] == "FILLED":
-                if OrderID.is_wait(order_id) or OrderID.is_market(order_id):
-                    entry = float(info["ap"])
-                    logging.info(f"Placing TP/SL orders for fulfilled order {order_id} (entry: {entry})", color="green")
-                    async with self.olock:
-                        self.state["orders"][order_id]["ent"] = entry
-                    await self._place_collection_orders(order_id)
-                elif OrderID.is_stop_loss(order_id):
-                    async with self.olock:
+                if OrderID.is_stop_loss(order_id):
+                    async with self._position(o["parent"]):
+                        parent = self.orders.get(o["parent"])
+                        if parent is None or parent.get("s_ord") != order_id:
+                            logging.warning(f"SL order {order_id} no longer belongs to a position")
+                            return
                         logging.info(f"Order {order_id} hit stop loss. Removing TP orders...", color="red")
-                        sl = self.state["orders"].pop(order_id)
-                        parent = self.state["orders"].pop(sl["parent"])
+                        self.orders.pop_position(o["parent"])
                         for oid in parent["t_ord"]:
-                            self.state["orders"].pop(oid, None)  # It might not exist
                             await self._cancel_order(oid, parent["sym"])
                         await self.results_handler(
-                            Trade.target(parent["tag"], parent["sym"], parent["ent"], parent["qty"],
-                                         parent["lev"], float(info["ap"]), float(info["q"]),
-                                         is_long=parent["side"] == "BUY", is_sl=True))
+                            Message.target(parent["tag"], parent["sym"], parent["ent"], parent["qty"],
+                                           float(info["ap"]), float(info["q"]),
+                                           is_long=parent["side"] == "BUY", is_sl=True))
                 elif OrderID.is_target(order_id):
                     logging.info(f"TP order {order_id} hit.", color="green")
                     await self._move_stop_loss(order_id)
 
     async def _move_stop_loss(self, tp_id: str):
-        async with self.olock:
-            tp = self.state["orders"][tp_id]
+        tp = self.orders[tp_id]
+        close = False
+        async with self._position(tp["parent"]):
+            parent = self.orders.get(tp["parent"])
+            if parent is None:
+                logging.warning(f"TP order {tp_id} no longer belongs to a position")
+                return
             tp["filled"] = True
-            parent = self.state["orders"][tp["parent"]]
             targets = parent["t_ord"]
             if tp_id not in targets:
                 if parent.get("s_ord") is None:
                     logging.warning(f"SL doesn't exist for order {parent}")
                     return
                 logging.warning(f"Couldn't find TP order {tp_id} in parent {parent}, closing trade", color="red")
-                await self.close_trades(parent["tag"], parent["sym"].replace("USDT", ""))
-                return
-
-            idx = targets.index(tp_id)
-            await self.results_handler(
-                Trade.target(parent["tag"], parent["sym"], parent["ent"], parent["qty"],
-                             parent["lev"], parent["tgt"][idx], parent["t_q"][idx],
-                             is_long=parent["side"] == "BUY"))
-
-            new_price = parent["ent"]  # SL to entry
-            quantity = parent["qty"] - sum(parent["t_q"])  # allocated for moon
-            if tp_id == targets[-1]:
-                logging.info(f"All TP orders hit for parent {parent}")
-                for oid in parent["t_ord"]:
-                    self.state["orders"].pop(oid, None)  # It might not exist
+                close = True
             else:
-                quantity += sum(parent["t_q"][(idx + 1):])
+                idx = targets.index(tp_id)
+                await self.results_handler(
+                    Message.target(parent["tag"], parent["sym"], parent["ent"], parent["qty"],
+                                   parent["tgt"][idx], parent["t_q"][idx],
+                                   is_long=parent["side"] == "BUY"))
+
+                new_price = parent["ent"]  # SL to entry
+                quantity = parent["qty"] - sum(parent["t_q"])  # allocated for moon
+                # NOTE: TP fills can be handled out of order, so go by what's actually filled
+                pending = [q for tid, q in zip(targets, parent["t_q"])
+                           if not self.orders.get(tid, {}).get("filled")]
+                if not pending:
+                    logging.info(f"All TP orders hit for parent {parent}")
+                    for oid in parent["t_ord"]:
+                        self.orders.pop(oid, None)  # It might not exist
+                else:
+                    quantity += sum(pending)
+                await self._replace_sl_order(tp["parent"], new_price, quantity)
 
-        await self._place_sl_order(tp["parent"], new_price, quantity)
+        if close:  # outside the lock, as closing takes it for each position
+            await self.close_trades(parent["tag"], parent["sym"].replace("USDT", ""))
 
     async def _place_sl_order(self, parent_id: str, new_price=None, quantity=None):
-        async with self.olock:
-            odata = self.state["orders"][parent_id]
-            symbol = odata["sym"]
-            sl_order_id = OrderID.stop_loss()
-            if odata.get("s_ord") is not None:
-                logging.info(f"Moving SL order for {parent_id} to new price {new_price}")
-                await self._cancel_order(odata["s_ord"], symbol)
-            params = {
-                "symbol": symbol,
-                "positionSide": "LONG" if odata["side"] == "BUY" else "SHORT",
-                "side": "SELL" if odata["side"] == "BUY" else "BUY",
-                "type": OrderType.STOP_MARKET,
-                "newClientOrderId": sl_order_id,
-                "stopPrice": self._round_price(symbol, new_price if new_price is not None else odata["sl"]),
-                "quantity": self._round_qty(symbol, (quantity if quantity is not None else odata["qty"])),
-            }
-            for _ in range(2):
-                try:
-                    resp = await self.client.futures_create_order(**params)
-                    odata["s_ord"] = sl_order_id
-                    self.state["orders"][sl_order_id] = {
-                        "parent": parent_id,
-                        "filled": False,
-                    }
-                    logging.info(f"Created SL order {sl_order_id} for parent {parent_id}, "
-                                 f"resp: {resp}, params: {json.dumps(params)}")
-                    break
-                except Exception as err:
-                    logging.error(f"Failed to create SL order for parent {parent_id}: {err}, "
-                                  f"params: {json.dumps(params)}")
-                    if isinstance(err, BinanceAPIException) and err.code == -2021:  # price is around SL now
-                        logging.info(f"Placing market order for parent {parent_id} "
-                                     "after attempt to create SL order", color="yellow")
-                        params.pop("stopPrice")
-                        params["type"] = OrderType.MARKET
+        async with self._position(parent_id):
+            await self._replace_sl_order(parent_id, new_price, quantity)
+
+    async def _replace_sl_order(self, parent_id: str, new_price=None, quantity=None):
+        odata = self.orders.get(parent_id)
+        if odata is None:
+            return
+        old_sl = odata.get("s_ord")
+        if old_sl is not None:
+            logging.info(f"Moving SL order for {parent_id} to new price {new_price}")
+            with lane(Lane.STOP):
+                await self._cancel_order(old_sl, odata["sym"])
+            self.orders.pop(old_sl, None)
+            odata["s_ord"] = None
+        params = self._sl_order_params(odata, new_price, quantity)
+        sl_order_id = params["newClientOrderId"]
+        self.orders[sl_order_id] = {
+            "parent": parent_id,
+            "filled": False,
+        }
+        if await self._create_order(parent_id, params) is None:
+            self.orders.pop(sl_order_id, None)
+        else:
+            odata["s_ord"] = sl_order_id
+
+    def _round_price(self, symbol: str, price: float) -> float:
+        return self.rules[symbol].round_price(price)
+
+    def _round_qty(self, symbol: str, qty: float) -> float:
+        return self.rules[symbol].round_qty(qty)
 
     async def _cancel_order(self, oid: str, symbol: str):
         try:
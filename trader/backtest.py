@@ -0,0 +1,339 @@
+# Backtest of the signal strategy against historical prices: signals are parsed from an exported
+# Telegram history (the desktop app's JSON export) and evaluated against Binance's public kline
+# or aggTrade dumps, with the live rules - the RR filter, 80% of the position split over the
+# targets, and SL moved to entry once a target's hit.
+#
+#   python -m trader.backtest result.json data/ [--rr 0.4] [--trades]
+#
+# NOTE: Needs numpy, which the live trader doesn't - it's in requirements-dev.txt
+# (`pip install -r requirements-dev.txt`) rather than in the image's requirements.txt.
+import argparse
+import bisect
+import glob
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import DEFAULT_RR, MAX_TARGETS, WAIT_ORDER_EXPIRY
+from .errors import CloseTradeException
+from .logger import get_logger
+from .signal import PRECISION_CROSSOVER, PRECISION_FACTORS, Signal
+
+logging = get_logger(__name__)
+
+BACKTEST_TP_SPLIT = 0.8  # of the position, over the targets (the rest rides with the SL)
+BACKTEST_CHUNK = 4096  # first search window for a level, growing 4x until it's touched
+
+HistoryMessage = Tuple[float, int, str]  # (secs, chat ID, text)
+
+
+def load_history(path: str, chat_id: Optional[int] = None) -> List[HistoryMessage]:
+    with open(path) as f:
+        export = json.load(f)
+    if chat_id is None:
+        chat_id = -(10 ** 12 + export["id"])  # exports drop the channel prefix
+    messages = []
+    for msg in export["messages"]:
+        if msg.get("type") != "message":
+            continue
+        text = msg["text"]
+        if isinstance(text, list):  # formatted text comes in parts
+            text = "".join(part if isinstance(part, str) else part["text"] for part in text)
+        if "date_unixtime" in msg:
+            ts = float(msg["date_unixtime"])
+        else:
+            ts = datetime.fromisoformat(msg["date"]).timestamp()
+        messages.append((ts, chat_id, text))
+    messages.sort(key=lambda m: m[0])
+    return messages
+
+
+# Prices of a symbol as arrays - the high and low of each bar (or the trade price for both, for
+# aggTrades) and its close, by the bar's open time in secs
+class PriceSeries:
+    def __init__(self, times: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray):
+        self.times = times
+        self.high = high
+        self.low = low
+        self.close = close
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def load(cls, paths: List[str]) -> "PriceSeries":
+        parts = [_load_csv(path) for path in sorted(paths)]
+        times, high, low, close = (np.concatenate(cols) for cols in zip(*parts))
+        order = np.argsort(times, kind="stable")
+        if not np.array_equal(order, np.arange(len(order))):
+            times, high, low, close = times[order], high[order], low[order], close[order]
+        return cls(times, high, low, close)
+
+    def index(self, ts: float) -> int:
+        # bar holding `ts` (-1 if it's before the data)
+        return int(np.searchsorted(self.times, ts, side="right")) - 1
+
+    def first_touch(self, level: float, start: int, end: int, above: bool) -> int:
+        # first bar in [start, end) reaching `level` from below (or from above), `end` if none.
+        # Searches a small window first, as most levels are reached quickly.
+        values = self.high if above else self.low
+        size = BACKTEST_CHUNK
+        while start < end:
+            stop = min(start + size, end)
+            chunk = values[start:stop]
+            hits = chunk >= level if above else chunk <= level
+            idx = int(hits.argmax())
+            if hits[idx]:
+                return start + idx
+            start = stop
+            size *= 4
+        return end
+
+
+def _load_csv(path: str) -> tuple:
+    # Binance's dumps, with or without a header - aggTrades have 7 columns (price and time in
+    # the 2nd and 6th), klines 12 (open time, high, low and close in the 1st, 3rd, 4th and 5th)
+    with open(path) as f:
+        first = f.readline()
+    skip = 0 if first[:1].isdigit() else 1
+    if first.count(",") == 6:
+        data = np.loadtxt(path, delimiter=",", usecols=(5, 1), skiprows=skip, ndmin=2)
+        return data[:, 0] / 1000, data[:, 1], data[:, 1], data[:, 1]
+    data = np.loadtxt(path, delimiter=",", usecols=(0, 2, 3, 4), skiprows=skip, ndmin=2)
+    return data[:, 0] / 1000, data[:, 1], data[:, 2], data[:, 3]
+
+
+def correct_prices(prices, marks) -> np.ndarray:
+    # `precision_index` over whole arrays - each price scaled by the power of ten which brings it
+    # closest to its mark
+    prices = np.asarray(prices, dtype=float)
+    marks = np.asarray(marks, dtype=float)
+    factors = np.array(PRECISION_FACTORS)
+    last = len(factors) - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        guess = np.floor(np.log10(marks / prices) + PRECISION_CROSSOVER) + Signal.MIN_PRECISION
+    guess = np.clip(np.nan_to_num(guess, nan=0, posinf=last, neginf=0), 0, last).astype(np.intp)
+    candidates = np.clip(guess[:, None] + np.arange(-1, 2), 0, last)
+    dist = np.abs(prices[:, None] * factors[candidates] - marks[:, None]) / marks[:, None]
+    best = candidates[np.arange(len(prices)), dist.argmin(axis=1)]
+    smallest = (prices <= 0) | (np.abs(prices * factors[1] - marks) == marks)
+    return prices * factors[np.where(smallest, 0, best)]
+
+
+def correct_signals(signals: List[Signal], marks: List[float]):
+    # `Signal.correct` for many signals, with their entries, SLs and targets corrected an array at
+    # a time. Targets may differ from `correct`'s in the last bit, from rounding in binary.
+    if not signals:
+        return
+    marks = np.asarray(marks, dtype=float)
+    given = np.array([sig.entry is not None for sig in signals])
+    entries = correct_prices([sig.entry if sig.entry is not None else 0.0 for sig in signals], marks)
+    entries = np.where(given, entries, marks)
+    sls = correct_prices([sig.sl for sig in signals], marks)
+
+    counts = [len(sig.targets) for sig in signals]
+    owners = np.repeat(np.arange(len(signals)), counts)
+    targets = np.array([target for sig in signals for target in sig.targets], dtype=float)
+    percent = np.array([sig.percent_targets for sig in signals], dtype=bool)[owners]
+    targets = np.where(percent, entries[owners] + (entries - sls)[owners] * targets / 100, targets)
+    targets = np.round(correct_prices(targets, marks[owners]), 10)
+
+    offsets = np.cumsum([0] + counts)
+    for k, sig in enumerate(signals):
+        sig.entry = float(entries[k])
+        sig.sl = float(sls[k])
+        sig.targets = targets[offsets[k]:offsets[k + 1]].tolist()
+        sig.size(float(marks[k]))
+
+
+class Outcome:
+    SKIPPED = "skipped"  # RR below the minimum, or no data
+    EXPIRED = "expired"  # entry not reached in time
+    STOPPED = "stopped"  # SL hit (possibly after targets, at entry)
+    TARGETS = "targets"  # every target hit, the rest stopped at entry
+    CLOSED = "closed"  # closed by a message
+    OPEN = "open"  # still open when the data ends
+
+
+class Trade:
+    def __init__(self, signal: Signal, ts: float):
+        self.signal = signal
+        self.ts = ts
+        self.outcome = Outcome.SKIPPED
+        self.entry = None
+        self.filled_at = None  # secs
+        self.closed_at = None  # secs
+        self.targets_hit = 0
+        self.r = 0.0  # profit in multiples of the risk taken (the loss at SL)
+
+    def __repr__(self):
+        return (f"Trade({self.signal.symbol} {'LONG' if self.signal.is_long else 'SHORT'} "
+                f"@ {self.entry}, {self.outcome}, targets: {self.targets_hit}, r: {round(self.r, 2)})")
+
+
+def risk_reward(entry: float, sl: float, targets: List[float]) -> float:
+    # reward to the first target over the risk to SL
+    if not targets or entry == sl:
+        return 0.0
+    return abs(targets[0] - entry) / abs(entry - sl)
+
+
+class Backtester:
+    def __init__(self, data_dir: str, rr: float = DEFAULT_RR, tp_split: float = BACKTEST_TP_SPLIT,
+                 expiry: float = WAIT_ORDER_EXPIRY):
+        self.data_dir = data_dir
+        self.rr = rr
+        self.tp_split = tp_split
+        self.expiry = expiry
+        self._series: Dict[str, Optional[PriceSeries]] = {}
+
+    def series(self, symbol: str) -> Optional[PriceSeries]:
+        # "BTCUSDT-1s-2023-01-01.csv" and the like, anywhere under the data directory
+        if symbol not in self._series:
+            paths = glob.glob(os.path.join(self.data_dir, "**", f"{symbol}-*.csv"), recursive=True)
+            self._series[symbol] = PriceSeries.load(paths) if paths else None
+            if paths:
+                logging.info(f"Loaded {len(self._series[symbol])} price(s) for {symbol}")
+        return self._series[symbol]
+
+    def run(self, messages: List[HistoryMessage]) -> List[Trade]:
+        signals, closes = [], {}
+        for ts, chat_id, text in messages:
+            try:
+                sig = Signal.parse(chat_id, text)
+            except CloseTradeException as err:
+                closes.setdefault(err.tag, []).append(ts)
+                continue
+            except Exception:
+                continue
+            if sig is not None and sig.sl:
+                signals.append((ts, sig))
+        trades, started = [], []
+        for ts, sig in signals:
+            trade = Trade(sig, ts)
+            trades.append(trade)
+            times = closes.get(sig.tag.lower(), ())
+            idx = bisect.bisect_right(times, ts)
+            start = self._start(sig, ts)
+            if start is not None:
+                started.append((trade, *start, times[idx] if idx < len(times) else None))
+        # every signal corrected against its price at once
+        is_market = [trade.signal.entry is None for trade, *_ in started]
+        correct_signals([trade.signal for trade, *_ in started],
+                        [series.close[i] for _, series, i, _ in started])
+        for (trade, series, i, closed_at), market in zip(started, is_market):
+            self._simulate(trade, series, i, market, closed_at)
+        return trades
+
+    def _start(self, sig: Signal, ts: float) -> Optional[Tuple[PriceSeries, int]]:
+        # prices and the bar the signal came in, if there's data after it
+        series = self.series(sig.symbol)
+        if series is None:
+            return None
+        i = series.index(ts)
+        if i < 0 or i + 1 >= len(series):
+            return None
+        return series, i
+
+    def evaluate(self, sig: Signal, ts: float, closed_at: Optional[float] = None) -> Trade:
+        trade = Trade(sig, ts)
+        start = self._start(sig, ts)
+        if start is not None:
+            series, i = start
+            is_market = sig.entry is None
+            sig.correct(float(series.close[i]))
+            self._simulate(trade, series, i, is_market, closed_at)
+        return trade
+
+    def _simulate(self, trade: Trade, series: PriceSeries, i: int, is_market: bool,
+                  closed_at: Optional[float]):
+        sig, ts = trade.signal, trade.ts
+        price = float(series.close[i])
+        targets = sorted(sig.targets, reverse=sig.is_short)[:MAX_TARGETS]
+        if risk_reward(sig.entry, sig.sl, targets) < self.rr:
+            return
+        end = len(series) if closed_at is None else max(series.index(closed_at) + 1, i + 1)
+
+        # entry - at market, or once the price comes to it
+        up = sig.is_long  # the direction of profits
+        if is_market:
+            fill = i
+        else:
+            expiry = min(end, series.index(ts + self.expiry) + 1)
+            fill = series.first_touch(sig.entry, i + 1, expiry, above=price < sig.entry)
+            if fill == expiry:
+                trade.outcome = Outcome.CLOSED if expiry == end and closed_at else Outcome.EXPIRED
+                return
+        entry = trade.entry = sig.entry
+        trade.filled_at = ts if is_market else float(series.times[fill])
+        risk = abs(entry - sig.sl)
+
+        # targets one after the other, each racing the SL (which moves to entry after the first).
+        # NOTE: A bar reaching both is counted as a SL hit, as its order within the bar is unknown,
+        # and the SL moved to entry is only checked from the bar after the target's.
+        qty = self.tp_split / len(targets) if targets else 0.0
+        left, sl, r = 1.0, sig.sl, 0.0
+        pos = stop_pos = i + 1 if is_market else fill
+        for target in targets:
+            hit = series.first_touch(target, pos, end, above=up)
+            stop = series.first_touch(sl, stop_pos, min(hit + 1, end), above=not up)
+            if stop <= hit and stop < end:
+                break
+            if hit == end:
+                break
+            r += qty * abs(target - entry) / risk
+            left -= qty
+            trade.targets_hit += 1
+            sl, pos, stop_pos = entry, hit, hit + 1
+        stop = series.first_touch(sl, stop_pos, end, above=not up)
+        if stop < end:
+            trade.outcome = Outcome.TARGETS if trade.targets_hit == len(targets) else Outcome.STOPPED
+            exit_price, exit_idx = sl, stop
+        else:
+            trade.outcome = Outcome.OPEN if closed_at is None else Outcome.CLOSED
+            exit_idx = end - 1
+            exit_price = float(series.close[exit_idx])
+        r += left * (exit_price - entry) / risk * (1 if up else -1)
+        trade.r = r
+        trade.closed_at = float(series.times[exit_idx])
+
+
+def summary(trades: List[Trade]) -> List[tuple]:
+    taken = [t for t in trades if t.outcome not in (Outcome.SKIPPED, Outcome.EXPIRED)]
+    r = np.array([t.r for t in taken])
+    equity = np.cumsum(r)
+    drawdown = float((np.maximum.accumulate(np.maximum(equity, 0)) - equity).max()) if len(r) else 0.0
+    return [
+        ("signals", len(trades)),
+        ("skipped", sum(t.outcome == Outcome.SKIPPED for t in trades)),
+        ("expired", sum(t.outcome == Outcome.EXPIRED for t in trades)),
+        ("trades", len(taken)),
+        ("win rate", round(float((r > 0).mean()), 3) if len(r) else 0.0),
+        ("total R", round(float(r.sum()), 2)),
+        ("avg R", round(float(r.mean()), 3) if len(r) else 0.0),
+        ("max drawdown R", round(drawdown, 2)),
+        ("return (% of balance)", round(float(r.sum()) * Signal.DEFAULT_RISK * 100, 2)),
+    ]
+
+
+def main(args):
+    messages = load_history(args.history, chat_id=args.chat)
+    trades = Backtester(args.data, rr=args.rr).run(messages)
+    if args.trades:
+        for trade in trades:
+            print(trade)
+    for key, value in summary(trades):
+        print(f"{key:<24} {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("history", help="result.json of an exported channel history")
+    parser.add_argument("data", help="directory with kline/aggTrade CSVs from data.binance.vision")
+    parser.add_argument("--chat", type=int, help="channel ID, if not the export's own")
+    parser.add_argument("--rr", type=float, default=DEFAULT_RR)
+    parser.add_argument("--trades", action="store_true", help="print every trade")
+    main(parser.parse_args())
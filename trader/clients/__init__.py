@@ -1,5 +1,9 @@
+import math
+from decimal import Decimal
 from typing import Awaitable, Callable
 
+from ..errors import MinNotionalException, QuantityLimitException
+
 
 class OrderType:
     LIMIT = "LIMIT"
@@ -62,6 +66,47 @@ class OrderCancelEvent:
         self.order_id = order_id
 
 
+def decimal_places(step: str) -> int:
+    return max(0, -Decimal(step).normalize().as_tuple().exponent)
+
+
+# Trading rules for a symbol, compiled once from exchange info so that rounding and validation
+# don't have to go through the raw filters for every order.
+class SymbolRules:
+    __slots__ = ("symbol", "tick_size", "step_size", "price_digits", "qty_digits",
+                 "min_qty", "max_qty", "max_market_qty", "min_notional")
+
+    def __init__(self, symbol, tick_size="0", step_size="0", min_qty=0, max_qty=math.inf,
+                 max_market_qty=math.inf, min_notional=0):
+        self.symbol = symbol
+        self.tick_size = float(tick_size)
+        self.step_size = float(step_size)
+        # digits are taken from the string repr, as 0.1 + 0.2 and friends won't round trip
+        self.price_digits = decimal_places(tick_size)
+        self.qty_digits = decimal_places(step_size)
+        self.min_qty = float(min_qty)
+        self.max_qty = float(max_qty)
+        self.max_market_qty = float(max_market_qty)
+        self.min_notional = float(min_notional)
+
+    def round_price(self, price: float) -> float:
+        if not self.tick_size:
+            return price
+        return round(round(price / self.tick_size) * self.tick_size, self.price_digits)
+
+    def round_qty(self, qty: float) -> float:
+        if not self.step_size:
+            return qty
+        return round(round(qty / self.step_size) * self.step_size, self.qty_digits)
+
+    def validate(self, price: float, qty: float, is_market=False):
+        max_qty = min(self.max_qty, self.max_market_qty) if is_market else self.max_qty
+        if qty < self.min_qty or qty > max_qty:
+            raise QuantityLimitException(qty, self.min_qty, max_qty)
+        if price * qty < self.min_notional:
+            raise MinNotionalException(price * qty, self.min_notional)
+
+
 class FuturesExchangeClient:
     async def init(self, api_key, api_secret, loop=None):
         raise NotImplementedError
@@ -75,6 +120,7 @@ class FuturesExchangeClient:
         raise NotImplementedError
 
     async def change_leverage(self, symbol: str, leverage: int) -> None:
+        # NOTE: Expected to skip the exchange if the symbol already has this leverage
         raise NotImplementedError
 
     def normalize_price(self, symbol: str, price: float) -> float:
@@ -83,6 +129,10 @@ class FuturesExchangeClient:
     def normalize_quantity(self, symbol: str, quantity: float) -> float:
         raise NotImplementedError
 
+    # Raises if the order would be rejected by the exchange's trading rules for the symbol
+    def validate_order(self, symbol: str, price: float, quantity: float, is_market=False) -> None:
+        raise NotImplementedError
+
     def register_account_balance_update(
             self, callback: Callable[[float], Awaitable[None]]) -> None:
         raise NotImplementedError
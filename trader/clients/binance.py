@@ -1,22 +1,44 @@
 import asyncio
 import json
-import math
 import threading
 import time
 from contextlib import asynccontextmanager
+from typing import Dict
 
-import janus
-from binance import AsyncClient, BinanceSocketManager
+from binance import BinanceSocketManager
 from binance.exceptions import BinanceAPIException
-from cachetools import TTLCache
 from unicorn_binance_websocket_api.unicorn_binance_websocket_api_manager import \
     BinanceWebSocketApiManager
 
 from . import (FuturesExchangeClient, Order, OrderCancelEvent,
-               OrderFillEvent, OrderRequest, OrderType)
+               OrderFillEvent, OrderRequest, OrderType, SymbolRules)
+from .http import PooledAsyncClient
+from .leverage import LeverageCache
+from .prices import PriceFeed, PriceStore, PriceStream
 from ..errors import (EntryCrossedException, InsufficientMarginException,
                       PriceUnavailableException)
-from ..logger import DEFAULT_LOGGER as logging
+from ..logger import get_logger
+
+logging = get_logger(__name__)
+
+USER_STREAM_LATENCY_BUDGET = 0.005  # warn if user events wait longer than this (in secs)
+RULES_REFRESH_INTERVAL = 6 * 60 * 60
+
+
+def compile_symbol_rules(info: dict) -> SymbolRules:
+    kwargs = {}
+    for f in info["filters"]:
+        if f["filterType"] == "PRICE_FILTER":
+            kwargs["tick_size"] = f["tickSize"]
+        elif f["filterType"] == "LOT_SIZE":
+            kwargs["step_size"] = f["stepSize"]
+            kwargs["min_qty"] = f["minQty"]
+            kwargs["max_qty"] = f["maxQty"]
+        elif f["filterType"] == "MARKET_LOT_SIZE":
+            kwargs["max_market_qty"] = f["maxQty"]
+        elif f["filterType"] == "MIN_NOTIONAL":
+            kwargs["min_notional"] = f.get("notional", f.get("minNotional", 0))
+    return SymbolRules(info["symbol"], **kwargs)
 
 
 class UserEventType:
@@ -25,49 +47,69 @@ class UserEventType:
     OrderTradeUpdate = "ORDER_TRADE_UPDATE"
 
 
+# Bridge for the futures user data stream (which runs in its own thread). Frames are pushed
+# into the event loop as soon as they arrive, so the consumer wakes up right away.
 class BinanceUserStream:
-    def __init__(self, api_key, api_secret, test=False):
+    def __init__(self, api_key, api_secret, test=False, latency_budget=USER_STREAM_LATENCY_BUDGET):
         self.test = test
         self.key = api_key
         self.secret = api_secret
-        self._queue = janus.Queue()
+        self.latency_budget = latency_budget
+        self.lagged = 0
+        self._loop = None
+        self._queue = None
+
+    def start(self, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._queue = asyncio.Queue()
         threading.Thread(target=self._start, daemon=True).start()
 
     @asynccontextmanager
     async def message(self):
+        received, msg = await self._queue.get()
+        lag = time.monotonic() - received
+        if lag > self.latency_budget:
+            self.lagged += 1
+            logging.warning(f"User stream message waited {round(lag * 1000, 2)} ms "
+                            f"(budget: {round(self.latency_budget * 1000, 2)} ms)")
         try:
-            msg = await self._queue.async_q.get()
             yield msg
         finally:
-            self._queue.async_q.task_done()
+            self._queue.task_done()
+
+    def feed(self, buf, *_args, **_kwargs):
+        # NOTE: Called from the websocket thread - decode here to keep the loop free
+        received = time.monotonic()
+        try:
+            msg = json.loads(buf)
+        except Exception as err:
+            logging.error(f"Failed to decode message {buf}: {err}")
+            return
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (received, msg))
 
     def _start(self):
         self.exchange = "binance.com-futures" + ("-testnet" if self.test else "")
-        self.manager = BinanceWebSocketApiManager(exchange=self.exchange)
+        self.manager = BinanceWebSocketApiManager(
+            exchange=self.exchange, process_stream_data=self.feed)
         self.manager.create_stream(
             "arr", "!userData", api_key=self.key, api_secret=self.secret)
-
         logging.info("Spawning listener for futures user data")
-        while True:
-            buf = self.manager.pop_stream_data_from_stream_buffer()
-            if not buf:
-                time.sleep(0.05)
-                continue
-            try:
-                msg = json.loads(buf)
-                self._queue.sync_q.put(msg)
-            except Exception as err:
-                logging.error(f"Failed to decode message {buf}: {err}")
 
 
 class BinanceFuturesClient(FuturesExchangeClient):
-    def __init__(self, api_key, api_secret):
+    def __init__(self, api_key, api_secret, latency_budget=USER_STREAM_LATENCY_BUDGET,
+                 price_stream=PriceStream.AGG_TRADE, bulk_price_fallback=False):
         self.api_key = api_key
         self.api_secret = api_secret
+        self.latency_budget = latency_budget
+        self.price_stream = price_stream
+        self.bulk_price_fallback = bulk_price_fallback
         self.balance = 0
         self.symbols: dict = {}
-        self._inner: AsyncClient = None
+        self.rules: Dict[str, SymbolRules] = {}
+        self._inner: PooledAsyncClient = None
         self._ustream = None
+        self._feed: PriceFeed = None
 
         async def _empty(*_args):
             pass
@@ -78,25 +120,52 @@ class BinanceFuturesClient(FuturesExchangeClient):
         self._ord_cancel_hdr = _empty
 
         # Ticker price stream subscription
-        self.prices = TTLCache(maxsize=1000, ttl=10)  # 10 secs timeout for ticker prices
+        self.prices = PriceStore()
+        # In-flight REST price requests shared by concurrent callers
+        self._price_requests: Dict[str, asyncio.Future] = {}
+        self.leverage = LeverageCache()
 
     async def init(self, test=False, loop=None):
-        self._ustream = BinanceUserStream(self.api_key, self.api_secret, test=test)
-        self._inner = await AsyncClient.create(
+        self._ustream = BinanceUserStream(
+            self.api_key, self.api_secret, test=test, latency_budget=self.latency_budget)
+        self._ustream.start(loop=loop)
+        self._inner = await PooledAsyncClient.create(
             api_key=self.api_key, api_secret=self.api_secret, testnet=test, loop=loop)
+        await self._inner.warm_up()
+        self._inner.keep_alive()
         self._manager = BinanceSocketManager(self._inner, loop=loop)
         self._subscribe_user_events()
-        resp = await self._inner.futures_exchange_info()
-        for info in resp["symbols"]:
-            if info["contractType"] == "PERPETUAL":
-                self.symbols[info["symbol"]] = info
-        self._subscribe_futures_symbol_prices()
+        await self._load_symbols()
+        asyncio.ensure_future(self._refresh_symbols())
+        self.leverage.seed(await self._inner.futures_symbol_config())
+        self._feed = PriceFeed(self._manager, self.prices, stream=self.price_stream)
+        self._feed.start()
         resp = await self._inner.futures_account_balance()
         for item in resp:
             if item["asset"] == "USDT":
                 self.balance = float(item["balance"])
 
+    async def _load_symbols(self):
+        resp = await self._inner.futures_exchange_info()
+        self._inner.governor.configure(resp.get("rateLimits", ()))
+        symbols, rules = {}, {}
+        for info in resp["symbols"]:
+            if info["contractType"] == "PERPETUAL":
+                symbols[info["symbol"]] = info
+                rules[info["symbol"]] = compile_symbol_rules(info)
+        self.symbols, self.rules = symbols, rules
+
+    async def _refresh_symbols(self):
+        while True:
+            await asyncio.sleep(RULES_REFRESH_INTERVAL)
+            try:
+                await self._load_symbols()
+                logging.info(f"Refreshed trading rules for {len(self.rules)} symbol(s)")
+            except Exception as err:
+                logging.error(f"Failed to refresh trading rules: {err}")
+
     async def create_order(self, req: OrderRequest):
+        self._feed.subscribe(req.symbol)
         try:
             params = {
                 "symbol": req.symbol,
@@ -123,35 +192,65 @@ class BinanceFuturesClient(FuturesExchangeClient):
 
     async def get_symbol_price(self, symbol):
         symbol = symbol.upper()
+        self._feed.subscribe(symbol)
         price = self.prices.get(symbol)
         if price is None:
-            try:
-                resp = None
-                logging.warn(f"Live price not found for {symbol}")
-                resp = await self._inner.futures_symbol_ticker(symbol=symbol)
-                price = float(resp["price"])
-            except Exception as err:
-                logging.error(f"Failed to get price for {symbol}: {err} (resp: {resp})")
+            logging.warning(f"Live price not found for {symbol}")
+            price = await self._fetch_price(symbol)
         if price is None:
             raise PriceUnavailableException()
         return price
 
+    async def _fetch_price(self, symbol: str):
+        # NOTE: Callers asking for the same symbol (or for any symbol in bulk mode) while a
+        # request is in flight wait for that request instead of sending their own.
+        key = "" if self.bulk_price_fallback else symbol
+        req = self._price_requests.get(key)
+        if req is None:
+            if self.bulk_price_fallback:
+                req = asyncio.ensure_future(self._request_all_prices())
+            else:
+                req = asyncio.ensure_future(self._request_price(symbol))
+            self._price_requests[key] = req
+            req.add_done_callback(lambda _: self._price_requests.pop(key, None))
+        # shielded so that a cancelled caller doesn't cancel the request for everyone else
+        await asyncio.shield(req)
+        return self.prices.get(symbol)
+
+    async def _request_price(self, symbol: str):
+        resp = None
+        try:
+            resp = await self._inner.futures_symbol_ticker(symbol=symbol)
+            self.prices[symbol] = float(resp["price"])
+        except Exception as err:
+            logging.error(f"Failed to get price for {symbol}: {err} (resp: {resp})")
+
+    async def _request_all_prices(self):
+        try:
+            resp = await self._inner.futures_symbol_ticker()
+            for item in resp:
+                self.prices[item["symbol"]] = float(item["price"])
+        except Exception as err:
+            logging.error(f"Failed to get prices for all symbols: {err}")
+
     async def change_leverage(self, symbol: str, leverage: int):
-        await self.client.futures_change_leverage(symbol=symbol, leverage=leverage)
+        await self.leverage.ensure(symbol, leverage, self._change_leverage)
+
+    async def _change_leverage(self, symbol: str, leverage: int) -> dict:
+        return await self._inner.futures_change_leverage(symbol=symbol, leverage=leverage)
 
     def normalize_price(self, symbol, price):
-        info = self.symbols[symbol]
-        for f in info["filters"]:
-            if f["filterType"] == "PRICE_FILTER":
-                return round(price, int(round(math.log(1 / float(f["tickSize"]), 10), 0)))
-        return price
+        rules = self.rules.get(symbol)
+        return price if rules is None else rules.round_price(price)
 
     def normalize_quantity(self, symbol, qty):
-        info = self.symbols[symbol]
-        for f in info["filters"]:
-            if f["filterType"] == "LOT_SIZE":
-                return round(qty, int(round(math.log(1 / float(f["minQty"]), 10), 0)))
-        return qty
+        rules = self.rules.get(symbol)
+        return qty if rules is None else rules.round_qty(qty)
+
+    def validate_order(self, symbol, price, quantity, is_market=False):
+        rules = self.rules.get(symbol)
+        if rules is not None:
+            rules.validate(price, quantity, is_market=is_market)
 
     def register_account_balance_update(self, call):
         self._bal_upd_hdr = call
@@ -175,7 +274,7 @@ class BinanceFuturesClient(FuturesExchangeClient):
                             data = msg["o"]
                         elif event == UserEventType.AccountConfigUpdate:
                             data = msg.get("ac", msg.get("ai"))
-                        logging.debug(f"{event}: {data}")
+                        logging.debug(lambda: f"{event}: {data}")
                         await self._handle_event(msg)
                     except Exception as err:
                         logging.exception(f"Failed to handle event {msg}: {err}")
@@ -188,6 +287,8 @@ class BinanceFuturesClient(FuturesExchangeClient):
                 if info["a"] == "USDT":
                     self.balance = float(info["cw"])
                     await self._bal_upd_hdr(self.balance)
+        elif msg["e"] == UserEventType.AccountConfigUpdate:
+            self.leverage.on_account_config(msg)
         elif msg["e"] == UserEventType.OrderTradeUpdate:
             info = msg["o"]
             order_id, price, quantity = info["i"], float(info["ap"]), float(info["q"])
@@ -195,24 +296,3 @@ class BinanceFuturesClient(FuturesExchangeClient):
                 await self._ord_fill_hdr(OrderFillEvent(order_id, price, quantity))
             if info["X"] == "CANCELED":
                 await self._ord_cancel_hdr(OrderCancelEvent(order_id))
-
-    def _subscribe_futures_symbol_prices(self):
-        symbols = list(self.symbols.keys())
-
-        async def _streamer():
-            subs = list(map(lambda s: f"{s.lower()}@aggTrade", symbols))
-            logging.info(f"Spawning listener for {len(symbols)} symbol(s): {symbols}",
-                         color="magenta")
-            async with self._manager.futures_multiplex_socket(subs) as stream:
-                while True:
-                    msg = await stream.recv()
-                    if msg is None:
-                        logging.warning("Received 'null' in price stream", color="red")
-                        continue
-                    try:
-                        symbol = msg["stream"].split("@")[0].upper()
-                        self.prices[symbol.upper()] = float(msg["data"]["p"])
-                    except Exception as err:
-                        logging.error(f"Failed to get price for {msg['stream']}: {err}")
-
-        asyncio.ensure_future(_streamer())
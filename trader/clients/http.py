@@ -0,0 +1,258 @@
+import asyncio
+import contextvars
+import heapq
+import ssl
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import aiohttp
+from binance import AsyncClient
+
+from ..logger import get_logger
+
+logging = get_logger(__name__)
+
+REST_POOL_SIZE = 8  # connections kept to the REST API
+REST_WARM_CONNECTIONS = 2  # connections opened at startup and kept alive with pings
+REST_KEEPALIVE_TIMEOUT = 5 * 60  # secs an idle pooled connection is kept open
+REST_PING_INTERVAL = 60  # secs between keep-alive pings (Binance drops idle connections later)
+REST_DNS_CACHE_TTL = 10 * 60
+REQUEST_WEIGHT_LIMIT = 2400  # per minute (limits are replaced by the ones in exchange info)
+ORDER_LIMIT_10S = 300
+ORDER_LIMIT_1M = 1200
+RATE_LIMIT_HEADROOM = 0.9  # pace requests to stay under this fraction of each limit
+
+# Request weights of the futures endpoints in use (anything else counts as 1)
+ENDPOINT_WEIGHTS = {
+    "/fapi/v1/batchOrders": 5,
+    "/fapi/v1/exchangeInfo": 1,
+    "/fapi/v3/balance": 5,
+    "/fapi/v3/positionRisk": 5,
+    "/fapi/v2/account": 5,
+    "/fapi/v1/openOrders": 1,
+    "/fapi/v1/symbolConfig": 5,
+}
+
+
+def request_weight(method: str, uri: str) -> int:
+    url = urlsplit(uri)
+    if url.path in ("/fapi/v1/ticker/price", "/fapi/v2/ticker/price"):
+        return 1 if "symbol=" in url.query else 2
+    if url.path == "/fapi/v1/openOrders" and "symbol=" not in url.query:
+        return 40
+    return ENDPOINT_WEIGHTS.get(url.path, 1)
+
+
+class Lane:
+    # lower goes first
+    STOP = 0  # SL and closing orders
+    ENTRY = 1
+    TARGET = 2
+    INFO = 3
+
+
+# Lane for requests sent from the current context (defaults to `Lane.INFO` for GET requests
+# and `Lane.ENTRY` for the rest)
+REQUEST_LANE: contextvars.ContextVar = contextvars.ContextVar("request_lane", default=None)
+# Orders placed by the request being sent from the current context
+_REQUEST_ORDERS: contextvars.ContextVar = contextvars.ContextVar("request_orders", default=0)
+
+
+@contextmanager
+def lane(priority: int):
+    token = REQUEST_LANE.set(priority)
+    try:
+        yield
+    finally:
+        REQUEST_LANE.reset(token)
+
+
+# Usage of a limit in fixed, clock-aligned windows (which is how Binance counts them)
+class RateWindow:
+    def __init__(self, limit: int, secs: int, header: str):
+        self.limit = limit
+        self.secs = secs
+        self.header = header
+        self.used = 0
+        self._window = 0
+
+    def roll(self, now: float):
+        window = int(now // self.secs)
+        if window != self._window:
+            self._window = window
+            self.used = 0
+
+    def delay(self, amount: int, now: float, headroom: float) -> float:
+        self.roll(now)
+        if not amount or self.used + amount <= self.limit * headroom:
+            return 0
+        return (self._window + 1) * self.secs - now
+
+
+# Accounts request weight (per minute) and orders (per 10s and per minute) against Binance's
+# limits. Each response reports the usage for the IP/account, which replaces the local count
+# whenever it's higher (other clients might be using them as well).
+# Requests which don't fit under the headroom are queued in their lane and sent in lane order
+# once there's room - nothing's sent out of order past a waiting request in a higher lane.
+# A 429/418 blocks everything until its Retry-After.
+class RateGovernor:
+    def __init__(self, weight_limit=REQUEST_WEIGHT_LIMIT, orders_10s=ORDER_LIMIT_10S,
+                 orders_1m=ORDER_LIMIT_1M, headroom=RATE_LIMIT_HEADROOM, clock=time.time):
+        self.weight = RateWindow(weight_limit, 60, "X-MBX-USED-WEIGHT-1M")
+        self.orders = [RateWindow(orders_10s, 10, "X-MBX-ORDER-COUNT-10S"),
+                       RateWindow(orders_1m, 60, "X-MBX-ORDER-COUNT-1M")]
+        self.headroom = headroom
+        self.waits = 0  # number of requests which had to be queued
+        self._clock = clock
+        self._blocked_until = 0.0
+        self._queue = []  # heap of (lane, seq, weight, orders, future)
+        self._seq = 0
+        self._timer = None
+
+    def configure(self, rate_limits):
+        # `rateLimits` from exchange info
+        units = {"SECOND": 1, "MINUTE": 60, "DAY": 24 * 60 * 60}
+        windows = {("REQUEST_WEIGHT", 60): self.weight,
+                   ("ORDERS", 10): self.orders[0], ("ORDERS", 60): self.orders[1]}
+        for limit in rate_limits:
+            secs = units.get(limit["interval"], 0) * limit.get("intervalNum", 1)
+            window = windows.get((limit["rateLimitType"], secs))
+            if window is not None:
+                window.limit = limit["limit"]
+
+    def delay(self, weight: int, orders: int = 0) -> float:
+        # secs to wait before a request can be sent (0 if it can go now)
+        now = self._clock()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        return max(self.weight.delay(weight, now, self.headroom),
+                   *[w.delay(orders, now, self.headroom) for w in self.orders])
+
+    def _take(self, weight: int, orders: int):
+        now = self._clock()
+        for window, amount in ((self.weight, weight), *[(w, orders) for w in self.orders]):
+            window.roll(now)
+            window.used += amount
+
+    async def acquire(self, weight: int, orders: int = 0, lane: int = Lane.INFO):
+        if not self._queue and self.delay(weight, orders) <= 0:
+            self._take(weight, orders)
+            return
+        self.waits += 1
+        fut = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._queue, (lane, self._seq, weight, orders, fut))
+        self._seq += 1
+        self._dispatch()
+        await fut
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            _, _, weight, orders, fut = self._queue[0]
+            if fut.done():  # cancelled while waiting
+                heapq.heappop(self._queue)
+                continue
+            delay = self.delay(weight, orders)
+            if delay > 0:
+                logging.warning(f"Pacing {len(self._queue)} request(s) for {round(delay, 2)}s "
+                                f"with weight {self.weight.used}/{self.weight.limit}", color="yellow")
+                self._timer = asyncio.get_event_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self._take(weight, orders)
+            fut.set_result(None)
+
+    def observe(self, status: int, headers):
+        now = self._clock()
+        for window in (self.weight, *self.orders):
+            window.roll(now)
+            used = headers.get(window.header)
+            if used is not None:
+                window.used = max(window.used, int(used))
+        if status in (418, 429):
+            retry = float(headers.get("Retry-After", 60))
+            self._blocked_until = max(self._blocked_until, now + retry)
+            logging.error(f"Rate limited by the exchange (status {status}) for {retry}s")
+
+
+def _ssl_context() -> ssl.SSLContext:
+    # loaded once and shared by every connection in the pool
+    return ssl.create_default_context()
+
+
+# `AsyncClient` with a sized connection pool (and DNS cache) kept warm with pings, so that
+# the first order after a quiet period doesn't pay for TCP and TLS setup, and with requests
+# shaped by a `RateGovernor`.
+# NOTE: `AsyncClient.create` constructs the client with positional arguments, so the pool is
+# configured through class attributes.
+class PooledAsyncClient(AsyncClient):
+    pool_size = REST_POOL_SIZE
+    warm_connections = REST_WARM_CONNECTIONS
+    ping_interval = REST_PING_INTERVAL
+    ssl_context = None  # default verified context if unset
+
+    def __init__(self, *args, **kwargs):
+        self.governor = RateGovernor()
+        self._keepalive = None
+        super().__init__(*args, **kwargs)
+
+    def _init_session(self) -> aiohttp.ClientSession:
+        params = dict(self._session_params)
+        if "connector" not in params:  # a connector passed in `session_params` replaces the pool
+            params["connector"] = aiohttp.TCPConnector(
+                limit=self.pool_size, limit_per_host=self.pool_size,
+                keepalive_timeout=REST_KEEPALIVE_TIMEOUT,
+                use_dns_cache=True, ttl_dns_cache=REST_DNS_CACHE_TTL,
+                ssl=_ssl_context() if self.ssl_context is None else self.ssl_context)
+        return aiohttp.ClientSession(loop=self.loop, headers=self._get_headers(), **params)
+
+    async def _request(self, method, uri: str, signed: bool, force_params: bool = False, **kwargs):
+        priority = REQUEST_LANE.get()
+        if priority is None:
+            priority = Lane.INFO if method == "get" else Lane.ENTRY
+        await self.governor.acquire(request_weight(method, uri), _REQUEST_ORDERS.get(), priority)
+        return await super()._request(method, uri, signed, force_params, **kwargs)
+
+    async def _handle_response(self, response: aiohttp.ClientResponse):
+        self.governor.observe(response.status, response.headers)
+        return await super()._handle_response(response)
+
+    async def futures_create_order(self, **params):
+        token = _REQUEST_ORDERS.set(1)
+        try:
+            return await super().futures_create_order(**params)
+        finally:
+            _REQUEST_ORDERS.reset(token)
+
+    async def futures_place_batch_order(self, **params):
+        token = _REQUEST_ORDERS.set(len(params["batchOrders"]))
+        try:
+            return await super().futures_place_batch_order(**params)
+        finally:
+            _REQUEST_ORDERS.reset(token)
+
+    async def warm_up(self):
+        # concurrent, so that each ping gets (and leaves behind) its own connection
+        results = await asyncio.gather(
+            *[self.futures_ping() for _ in range(self.warm_connections)], return_exceptions=True)
+        failed = [res for res in results if isinstance(res, Exception)]
+        if failed:
+            logging.warning(f"Failed to warm up {len(failed)} REST connection(s): {failed[0]}")
+
+    def keep_alive(self):
+        async def _pinger():
+            while True:
+                await asyncio.sleep(self.ping_interval)
+                await self.warm_up()
+
+        if self._keepalive is None:
+            self._keepalive = asyncio.ensure_future(_pinger())
+
+    async def close_connection(self):
+        if self._keepalive is not None:
+            self._keepalive.cancel()
+            self._keepalive = None
+        await super().close_connection()
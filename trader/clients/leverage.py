@@ -0,0 +1,59 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from ..logger import get_logger
+
+logging = get_logger(__name__)
+
+
+# Leverage of each symbol, as last known from the exchange. Seeded from the symbol config
+# endpoint at startup and kept current from user events, so that leverage is only changed on
+# the exchange when a signal asks for something different.
+class LeverageCache:
+    def __init__(self):
+        self._leverage: Dict[str, int] = {}
+        # in-flight changes, so that concurrent signals for a symbol share one request
+        self._changes: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    def leverage(self, symbol: str) -> Optional[int]:
+        return self._leverage.get(symbol)
+
+    def seed(self, configs: list):
+        # `configs` is the symbol config response (/fapi/v1/symbolConfig, one entry per symbol).
+        # NOTE: Position risk doesn't have leverage since v3. Symbols missing it are left out, and
+        # they're cached with the first change.
+        for conf in configs:
+            if conf.get("leverage") is not None:
+                self._leverage[conf["symbol"]] = int(conf["leverage"])
+        logging.info(f"Loaded leverage for {len(self._leverage)} symbol(s)")
+
+    def on_account_config(self, msg: dict):
+        # ACCOUNT_CONFIG_UPDATE - "ac" has the symbol's new leverage ("ai" is for multi-assets mode)
+        info = msg.get("ac")
+        if info is not None:
+            self._leverage[info["s"]] = int(info["l"])
+
+    async def ensure(self, symbol: str, leverage: int,
+                     change: Callable[[str, int], Awaitable[dict]]):
+        # NOTE: Callers wait for the change (if any), so that orders aren't placed with the
+        # old leverage - if the change fails, it's raised for them to give up on the order.
+        if self._leverage.get(symbol) == leverage:
+            return
+        key = (symbol, leverage)
+        req = self._changes.get(key)
+        if req is None:
+            req = asyncio.ensure_future(self._change(symbol, leverage, change))
+            self._changes[key] = req
+            req.add_done_callback(lambda _: self._changes.pop(key, None))
+        # shielded so that a cancelled caller doesn't cancel the change for everyone else
+        await asyncio.shield(req)
+
+    async def _change(self, symbol: str, leverage: int,
+                      change: Callable[[str, int], Awaitable[dict]]):
+        try:
+            resp = await change(symbol, leverage)
+        except Exception as err:
+            logging.error(f"Failed to change leverage for {symbol} to {leverage}: {err}")
+            raise
+        self._leverage[symbol] = int(resp["leverage"])
+        logging.info(f"Changed leverage for {symbol} to {resp['leverage']}")
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from ..logger import get_logger
+
+logging = get_logger(__name__)
+
+PRICE_FEED_CONNECTIONS = 4
+PRICE_FEED_MAX_STREAMS = 50  # per connection (Binance allows up to 200)
+PRICE_FEED_IDLE_TIMEOUT = 30 * 60  # drop symbols which haven't been asked for in this long
+PRICE_FEED_SYNC_DELAY = 0.25  # coalesce subscription changes (Binance allows 10 requests/sec per connection)
+PRICE_MAX_AGE = 10  # secs after which a price is considered stale
+
+
+class PriceStream:
+    AGG_TRADE = "aggTrade"  # the default - entries are decided on the last traded price
+    MARK_PRICE = "markPrice@1s"  # opt-in, far fewer ticks but a different (and lagging) price
+    BOOK_TICKER = "bookTicker"
+
+
+# Latest price for each symbol. Symbols are interned to slot IDs, and each slot holds the price
+# and the time it was updated next to each other, so an update is a couple of array stores.
+# Staleness is checked when reading rather than by evicting entries.
+# Callers can also `wait` for a symbol's price, which resumes them with the first update.
+class PriceStore:
+    def __init__(self, max_age=PRICE_MAX_AGE):
+        self.max_age = max_age
+        self._ids: Dict[str, int] = {}
+        self._slots = array("d")
+        self._waiters: Dict[int, List[asyncio.Future]] = {}  # slot ID -> futures awaiting a price
+
+    def __contains__(self, symbol: str):
+        return self.get(symbol) is not None
+
+    def __getitem__(self, symbol: str) -> float:
+        price = self.get(symbol)
+        if price is None:
+            raise KeyError(symbol)
+        return price
+
+    def __setitem__(self, symbol: str, price: float):
+        self.update(self.intern(symbol), price)
+
+    def intern(self, symbol: str) -> int:
+        sid = self._ids.get(symbol)
+        if sid is None:
+            sid = self._ids[symbol] = len(self._ids)
+            self._slots.extend((0.0, -float("inf")))
+        return sid
+
+    def update(self, sid: int, price: float, ts: Optional[float] = None):
+        idx = sid << 1
+        self._slots[idx] = price
+        self._slots[idx + 1] = time.monotonic() if ts is None else ts
+        if self._waiters:
+            for fut in self._waiters.pop(sid, ()):
+                if not fut.done():
+                    fut.set_result(price)
+
+    def get(self, symbol: str, default=None, max_age: Optional[float] = None):
+        sid = self._ids.get(symbol)
+        if sid is None:
+            return default
+        idx = sid << 1
+        age = time.monotonic() - self._slots[idx + 1]
+        if age > (self.max_age if max_age is None else max_age):
+            return default
+        return self._slots[idx]
+
+    async def wait(self, symbol: str, timeout: Optional[float] = None) -> Optional[float]:
+        # current price if there's one, otherwise the next update (or None if there's none in time)
+        price = self.get(symbol)
+        if price is not None:
+            return price
+        sid = self.intern(symbol)
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.setdefault(sid, []).append(fut)
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(sid)
+            if waiters is not None and fut in waiters:
+                waiters.remove(fut)
+                if not waiters:
+                    self._waiters.pop(sid)
+
+
+def _trade_price(data: dict) -> float:
+    return float(data["p"])
+
+
+def _book_price(data: dict) -> float:
+    return (float(data["b"]) + float(data["a"])) / 2
+
+
+PRICE_EXTRACTORS = {
+    PriceStream.AGG_TRADE: _trade_price,
+    PriceStream.MARK_PRICE: _trade_price,
+    PriceStream.BOOK_TICKER: _book_price,
+}
+
+
+class _Shard:
+    def __init__(self, idx: int):
+        self.idx = idx
+        self.symbols = set()
+        self.task: Optional[asyncio.Future] = None
+        self.sync: Optional[asyncio.Handle] = None
+        self.socket = None  # the shard's open stream, if it's connected
+        self.ws = None  # the connection its subscriptions were last synced with
+        self.live = set()  # stream names subscribed to on that connection
+
+
+# Price streams for the symbols we actually need. Symbols are subscribed when they're first
+# asked for, dropped once they go idle and spread across a few connections so that a busy
+# symbol doesn't delay ticks for the rest.
+# A shard connects when it gets its first symbol and closes once it has none left. In between,
+# subscription changes are sent as SUBSCRIBE/UNSUBSCRIBE requests over the open connection so
+# the other symbols on it keep ticking.
+class PriceFeed:
+    def __init__(self, manager, prices: PriceStore, stream=PriceStream.AGG_TRADE,
+                 connections=PRICE_FEED_CONNECTIONS, max_streams=PRICE_FEED_MAX_STREAMS,
+                 idle_timeout=PRICE_FEED_IDLE_TIMEOUT):
+        self.prices = prices
+        self.stream = stream
+        self.max_streams = max_streams
+        self.idle_timeout = idle_timeout
+        self._manager = manager
+        self._shards = [_Shard(i) for i in range(connections)]
+        self._owners: Dict[str, _Shard] = {}
+        self._last_used: Dict[str, float] = {}
+        self._stream_ids: Dict[str, int] = {}
+        self._extract = PRICE_EXTRACTORS[stream]
+        self._janitor = None
+        self._request_id = 0
+
+    @property
+    def symbols(self) -> List[str]:
+        return list(self._owners.keys())
+
+    def start(self):
+        self._janitor = asyncio.ensure_future(self._prune())
+
+    def stop(self):
+        if self._janitor is not None:
+            self._janitor.cancel()
+        for shard in self._shards:
+            if shard.sync is not None:
+                shard.sync.cancel()
+            if shard.task is not None:
+                shard.task.cancel()
+
+    def subscribe(self, symbol: str) -> bool:
+        self._last_used[symbol] = time.monotonic()
+        if symbol in self._owners:
+            return True
+        shard = min(self._shards, key=lambda s: len(s.symbols))
+        if len(shard.symbols) >= self.max_streams:
+            logging.warning(f"Price feed is full, not subscribing to {symbol}", color="red")
+            return False
+        shard.symbols.add(symbol)
+        self._owners[symbol] = shard
+        self._stream_ids[self._stream_name(symbol)] = self.prices.intern(symbol)
+        self._schedule_sync(shard)
+        return True
+
+    def unsubscribe(self, symbol: str):
+        self._last_used.pop(symbol, None)
+        shard = self._owners.pop(symbol, None)
+        if shard is None:
+            return
+        shard.symbols.discard(symbol)
+        self._stream_ids.pop(self._stream_name(symbol), None)
+        self._schedule_sync(shard)
+
+    def _stream_name(self, symbol: str) -> str:
+        return f"{symbol.lower()}@{self.stream}"
+
+    def _schedule_sync(self, shard: _Shard):
+        if shard.sync is None:
+            shard.sync = asyncio.get_event_loop().call_later(PRICE_FEED_SYNC_DELAY, self._sync, shard)
+
+    def _sync(self, shard: _Shard):
+        shard.sync = None
+        if not shard.symbols:
+            if shard.task is not None:
+                logging.info(f"Closing price listener #{shard.idx}, it has no symbols left", color="magenta")
+                shard.task.cancel()
+                shard.task = None
+        elif shard.task is None:
+            shard.task = asyncio.ensure_future(self._stream(shard))
+        elif shard.socket is not None:
+            asyncio.ensure_future(self._resubscribe(shard))
+        # otherwise it's still connecting and syncs once it's connected
+
+    def _restart(self, shard: _Shard):
+        if shard.task is not None:
+            shard.task.cancel()
+        shard.task = asyncio.ensure_future(self._stream(shard))
+
+    async def _stream(self, shard: _Shard):
+        while True:
+            subs = sorted(self._stream_name(s) for s in shard.symbols)
+            logging.info(f"Spawning price listener #{shard.idx} for {len(subs)} stream(s): {subs}",
+                         color="magenta")
+            try:
+                async with self._manager.futures_multiplex_socket(subs) as stream:
+                    shard.socket, shard.ws, shard.live = stream, stream.ws, set(subs)
+                    await self._update(shard)  # catch up with changes made while connecting
+                    while True:
+                        msg = await stream.recv()
+                        if stream.ws is not shard.ws and stream.ws is not None:
+                            # reconnected to the original URL, so only the initial streams are live
+                            shard.ws, shard.live = stream.ws, set(subs)
+                            await self._update(shard)
+                        if msg is None:
+                            logging.warning("Received 'null' in price stream", color="red")
+                            continue
+                        self._on_message(msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logging.error(f"Price listener #{shard.idx} failed, reconnecting: {err}")
+                await asyncio.sleep(1)
+            finally:
+                shard.socket = shard.ws = None
+
+    async def _resubscribe(self, shard: _Shard):
+        try:
+            await self._update(shard)
+        except Exception as err:
+            logging.error(f"Failed to update price listener #{shard.idx}, reconnecting: {err}")
+            self._restart(shard)
+
+    async def _update(self, shard: _Shard):
+        # send the difference between what the connection streams and what the shard wants
+        ws = shard.ws
+        if ws is None:
+            return
+        wanted = {self._stream_name(s) for s in shard.symbols}
+        removed, added = sorted(shard.live - wanted), sorted(wanted - shard.live)
+        shard.live = wanted
+        if removed:
+            await self._send(ws, "UNSUBSCRIBE", removed)
+        if added:
+            await self._send(ws, "SUBSCRIBE", added)
+
+    async def _send(self, ws, method: str, params: List[str]):
+        self._request_id += 1
+        logging.info(f"{method} {params} (request {self._request_id})")
+        await ws.send(json.dumps({"method": method, "params": params, "id": self._request_id}))
+
+    def _on_message(self, msg: dict):
+        name = msg.get("stream")
+        if name is None:  # a reply to (UN)SUBSCRIBE
+            if msg.get("error"):
+                logging.error(f"Price feed request {msg.get('id')} failed: {msg['error']}")
+            return
+        try:
+            sid = self._stream_ids.get(name)
+            if sid is not None:  # might've been unsubscribed just before the request went out
+                self.prices.update(sid, self._extract(msg["data"]))
+        except Exception as err:
+            logging.error(f"Failed to get price for {name}: {err}")
+
+    def drop_idle(self, now=None):
+        now = time.monotonic() if now is None else now
+        for symbol, used in list(self._last_used.items()):
+            if now - used > self.idle_timeout:
+                logging.info(f"Unsubscribing idle symbol {symbol} from price feed")
+                self.unsubscribe(symbol)
+
+    async def _prune(self):
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            self.drop_idle()
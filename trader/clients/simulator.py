@@ -0,0 +1,323 @@
+import asyncio
+import collections
+import csv
+import heapq
+import itertools
+import json
+import math
+import random
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..errors import EntryCrossedException, InsufficientMarginException, PriceUnavailableException
+from ..logger import get_logger
+from . import (FuturesExchangeClient, Order, OrderCancelEvent, OrderFillEvent, OrderPositionSide,
+               OrderRequest, OrderSide, OrderType, SymbolRules)
+from .leverage import LeverageCache
+from .prices import PriceStore
+
+logging = get_logger(__name__)
+
+SIM_DEFAULT_LEVERAGE = 20  # leverage of symbols which haven't been changed
+SIM_TAKER_FEE = 0.0004
+SIM_MAKER_FEE = 0.0002
+SIM_REPLAY_YIELD_EVERY = 100  # ticks replayed between yields to the loop at full speed
+
+Tick = Tuple[float, str, float]  # (secs, symbol, price)
+
+
+def _price_messages(path: str) -> Iterator[Tick]:
+    # raw or combined stream messages - aggTrade, markPrice or bookTicker
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            msg = json.loads(line)
+            data = msg.get("data", msg)
+            if "p" in data:
+                price = float(data["p"])
+            else:
+                price = (float(data["b"]) + float(data["a"])) / 2
+            yield data.get("T", data.get("E", 0)) / 1000, data["s"], price
+
+
+def _price_rows(path: str, symbol: str) -> Iterator[Tick]:
+    # Binance's public data dumps - aggTrades (price and time in the 2nd and 6th columns) or
+    # klines (open time and close in the 1st and 5th), with or without a header
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or not row[0].lstrip("-").isdigit():
+                continue
+            if len(row) == 7:
+                yield int(row[5]) / 1000, symbol, float(row[1])
+            else:
+                yield int(row[0]) / 1000, symbol, float(row[4])
+
+
+def load_ticks(path: str, symbol: Optional[str] = None) -> List[Tick]:
+    # CSV files hold a single symbol, which has to be given
+    if path.endswith(".csv"):
+        if symbol is None:
+            raise ValueError(f"Symbol is required for {path}")
+        return list(_price_rows(path, symbol.upper()))
+    return list(_price_messages(path))
+
+
+class _Position:
+    __slots__ = ("qty", "entry", "margin")
+
+    def __init__(self):
+        self.qty = 0.0
+        self.entry = 0.0
+        self.margin = 0.0
+
+
+# Resting orders of a symbol. Limit orders are kept in price-time priority and stop orders by
+# their trigger, so a tick only looks at the orders it crosses. Cancelled orders are dropped
+# lazily when they reach the top.
+class _Book:
+    def __init__(self):
+        self.bids = []  # (-price, seq, order)
+        self.asks = []  # (price, seq, order)
+        self.buy_stops = []  # (stop, seq, order) - triggered at or above
+        self.sell_stops = []  # (-stop, seq, order) - triggered at or below
+
+    def add(self, order: dict):
+        is_buy = order["side"] == OrderSide.BUY
+        if order["type"] in (OrderType.STOP, OrderType.STOP_MARKET) and not order.get("triggered"):
+            if is_buy:
+                heapq.heappush(self.buy_stops, (order["stopPrice"], order["orderId"], order))
+            else:
+                heapq.heappush(self.sell_stops, (-order["stopPrice"], order["orderId"], order))
+        elif is_buy:
+            heapq.heappush(self.bids, (-order["price"], order["orderId"], order))
+        else:
+            heapq.heappush(self.asks, (order["price"], order["orderId"], order))
+
+    @staticmethod
+    def _pop_crossed(heap: list, key: float) -> Iterator[dict]:
+        while heap and (heap[0][2]["status"] != "NEW" or heap[0][0] <= key):
+            order = heapq.heappop(heap)[2]
+            if order["status"] == "NEW":
+                yield order
+
+    def triggered(self, price: float) -> Iterator[dict]:
+        yield from self._pop_crossed(self.buy_stops, price)
+        yield from self._pop_crossed(self.sell_stops, -price)
+
+    def crossed(self, price: float) -> Iterator[dict]:
+        yield from self._pop_crossed(self.bids, -price)
+        yield from self._pop_crossed(self.asks, price)
+
+
+# In-process futures exchange for load and latency tests, with no network. Orders go through a
+# matching engine driven by price ticks (set directly or replayed from files), requests take
+# `latency` (+ up to `jitter`) secs, and fills, cancellations and balance changes reach the
+# registered handlers in order, `event_latency` secs after they happen - like the user stream.
+class SimulatedExchange(FuturesExchangeClient):
+    def __init__(self, balance=1000.0, latency=0.0, jitter=0.0, event_latency=0.0,
+                 rules: Optional[Dict[str, SymbolRules]] = None, seed=None):
+        self.balance = balance
+        self.latency = latency
+        self.jitter = jitter
+        self.event_latency = event_latency
+        self.rules: Dict[str, SymbolRules] = dict(rules or {})
+        self.prices = PriceStore(max_age=math.inf)
+        self.leverage = LeverageCache()
+        self.orders: Dict[int, dict] = {}
+        self.calls = collections.Counter()
+        self._books: Dict[str, _Book] = collections.defaultdict(_Book)
+        self._positions: Dict[Tuple[str, str], _Position] = collections.defaultdict(_Position)
+        self._reserved = 0.0  # margin held by resting orders
+        self._ids = itertools.count(1)
+        self._rng = random.Random(seed)
+        self._events: asyncio.Queue = None
+        self._dispatcher = None
+
+        async def _empty(*_args):
+            pass
+
+        # event handlers
+        self._bal_upd_hdr = _empty
+        self._ord_fill_hdr = _empty
+        self._ord_cancel_hdr = _empty
+
+    async def init(self, api_key=None, api_secret=None, loop=None):
+        self._events = asyncio.Queue()
+        self._dispatcher = asyncio.ensure_future(self._dispatch_events())
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    @property
+    def available(self) -> float:
+        used = sum(pos.margin for pos in self._positions.values())
+        return self.balance - used - self._reserved
+
+    async def _delay(self):
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def tick(self, symbol: str, price: float):
+        self.prices.update(self.prices.intern(symbol), price)
+        book = self._books.get(symbol)
+        if book is None:
+            return
+        for order in list(book.triggered(price)):
+            order["triggered"] = True
+            if order["type"] == OrderType.STOP_MARKET:
+                self._fill(order, price)
+            else:
+                book.add(order)  # as a limit order, which might fill right away
+        for order in list(book.crossed(price)):
+            self._fill(order, order["price"], maker=True)
+
+    async def replay(self, ticks: Iterable[Tick], speed: float = math.inf):
+        # `speed` is a multiple of the ticks' own pace - by default they're fed as fast as the
+        # trader keeps up with them
+        loop = asyncio.get_event_loop()
+        start = first = None
+        for count, (ts, symbol, price) in enumerate(ticks):
+            if math.isinf(speed):
+                if count % SIM_REPLAY_YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+            else:
+                if start is None:
+                    start, first = loop.time(), ts
+                delay = start + (ts - first) / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.tick(symbol, price)
+
+    def _margin(self, order: dict, price: float) -> float:
+        if self._reduces(order):
+            return 0.0
+        leverage = self.leverage.leverage(order["symbol"]) or SIM_DEFAULT_LEVERAGE
+        return order["origQty"] * price / leverage
+
+    @staticmethod
+    def _reduces(order: dict) -> bool:
+        return (order["side"] == OrderSide.SELL) == (order["positionSide"] == OrderPositionSide.LONG)
+
+    def _fill(self, order: dict, price: float, maker=False):
+        self._reserved -= order.pop("reserved", 0.0)
+        order["status"] = "FILLED"
+        order["avgPrice"] = price
+        qty = order["origQty"]
+        is_long = order["positionSide"] == OrderPositionSide.LONG
+        pos = self._positions[(order["symbol"], order["positionSide"])]
+        if self._reduces(order):
+            qty = min(qty, pos.qty)
+            pnl = (price - pos.entry) * qty * (1 if is_long else -1)
+            if pos.qty:
+                pos.margin -= pos.margin * qty / pos.qty
+            pos.qty -= qty
+            self.balance += pnl
+        else:
+            pos.entry = (pos.entry * pos.qty + price * qty) / (pos.qty + qty)
+            pos.qty += qty
+            pos.margin += self._margin(order, price)
+        self.balance -= qty * price * (SIM_MAKER_FEE if maker else SIM_TAKER_FEE)
+        self._emit(self._ord_fill_hdr, OrderFillEvent(order["orderId"], order["symbol"], price))
+        self._emit(self._bal_upd_hdr, self.balance)
+
+    def _emit(self, handler, event):
+        if self._events is not None:
+            self._events.put_nowait((time.monotonic() + self.event_latency, handler, event))
+
+    async def _dispatch_events(self):
+        while True:
+            due, handler, event = await self._events.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await handler(event)
+            except Exception as err:
+                logging.exception(f"Failed to handle event {event}: {err}")
+
+    async def create_order(self, req: OrderRequest) -> Order:
+        self.calls["create"] += 1
+        await self._delay()
+        price = self.prices.get(req.symbol)
+        if price is None:
+            raise PriceUnavailableException()
+        order = {
+            "orderId": next(self._ids),
+            "symbol": req.symbol,
+            "side": req.side,
+            "positionSide": req.position_side,
+            "type": req.otype,
+            "origQty": req.quantity,
+            "price": req.price if req.otype == OrderType.LIMIT else getattr(req, "limit_price", None),
+            "stopPrice": req.stop_price,
+            "avgPrice": 0.0,
+            "status": "NEW",
+        }
+        is_buy = req.side == OrderSide.BUY
+        if req.otype in (OrderType.STOP, OrderType.STOP_MARKET):
+            if (price >= req.stop_price) if is_buy else (price <= req.stop_price):
+                raise EntryCrossedException(req.stop_price)  # would trigger immediately
+        margin = self._margin(order, order["price"] or price)
+        if margin > self.available:
+            raise InsufficientMarginException()
+
+        if req.otype == OrderType.MARKET or (
+                req.otype == OrderType.LIMIT and (price <= req.price if is_buy else price >= req.price)):
+            self._fill(order, price)
+        else:
+            order["reserved"] = margin
+            self._reserved += margin
+            self._books[req.symbol].add(order)
+        self.orders[order["orderId"]] = order
+        return Order(order["orderId"], dict(order))
+
+    async def cancel_order(self, symbol: str, order_id: int) -> dict:
+        self.calls["cancel"] += 1
+        await self._delay()
+        order = self.orders.get(order_id)
+        if order is None or order["symbol"] != symbol or order["status"] != "NEW":
+            raise ValueError(f"Unknown order {order_id} for {symbol}")
+        order["status"] = "CANCELED"
+        self._reserved -= order.pop("reserved", 0.0)
+        self._emit(self._ord_cancel_hdr, OrderCancelEvent(order_id))
+        return dict(order)
+
+    async def get_symbol_price(self, symbol: str) -> float:
+        price = self.prices.get(symbol.upper())
+        if price is None:
+            raise PriceUnavailableException()
+        return price
+
+    async def change_leverage(self, symbol: str, leverage: int):
+        await self.leverage.ensure(symbol, leverage, self._change_leverage)
+
+    async def _change_leverage(self, symbol: str, leverage: int) -> dict:
+        self.calls["leverage"] += 1
+        await self._delay()
+        return {"symbol": symbol, "leverage": leverage}
+
+    def normalize_price(self, symbol, price):
+        rules = self.rules.get(symbol)
+        return price if rules is None else rules.round_price(price)
+
+    def normalize_quantity(self, symbol, qty):
+        rules = self.rules.get(symbol)
+        return qty if rules is None else rules.round_qty(qty)
+
+    def validate_order(self, symbol, price, quantity, is_market=False):
+        rules = self.rules.get(symbol)
+        if rules is not None:
+            rules.validate(price, quantity, is_market=is_market)
+
+    def register_account_balance_update(self, call):
+        self._bal_upd_hdr = call
+
+    def register_order_fill_update(self, call):
+        self._ord_fill_hdr = call
+
+    def register_order_cancel_update(self, call):
+        self._ord_cancel_hdr = call
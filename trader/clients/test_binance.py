@@ -0,0 +1,223 @@
+import asyncio
+import unittest
+
+from ..errors import MinNotionalException, PriceUnavailableException, QuantityLimitException
+from .binance import BinanceFuturesClient, compile_symbol_rules
+from .prices import PriceFeed
+
+
+class StubClient:
+    def __init__(self, prices, delay=0.01):
+        self.prices = prices
+        self.delay = delay
+        self.calls = []
+
+    async def futures_symbol_ticker(self, symbol=None):
+        self.calls.append(symbol)
+        await asyncio.sleep(self.delay)
+        if symbol is None:
+            return [{"symbol": s, "price": str(p)} for s, p in self.prices.items()]
+        if symbol not in self.prices:
+            raise Exception("Invalid symbol")
+        return {"symbol": symbol, "price": str(self.prices[symbol])}
+
+
+def create_client(prices, **kwargs):
+    client = BinanceFuturesClient("key", "secret", **kwargs)
+    client._inner = StubClient(prices)
+    client._feed = PriceFeed(None, client.prices)
+    return client
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestPriceFallback(unittest.TestCase):
+    def test_coalesces_concurrent_requests(self):
+        async def _test():
+            client = create_client({"BTCUSDT": 20000, "ETHUSDT": 1500})
+            prices = await asyncio.gather(
+                *[client.get_symbol_price("BTCUSDT") for _ in range(20)],
+                *[client.get_symbol_price("ethusdt") for _ in range(20)])
+            self.assertEqual(prices, [20000] * 20 + [1500] * 20)
+            self.assertEqual(sorted(client._inner.calls), ["BTCUSDT", "ETHUSDT"])
+            # served from the price store after that
+            self.assertEqual(await client.get_symbol_price("BTCUSDT"), 20000)
+            self.assertEqual(len(client._inner.calls), 2)
+            client._feed.stop()
+
+        run(_test())
+
+    def test_bulk_fallback(self):
+        async def _test():
+            client = create_client({"BTCUSDT": 20000, "ETHUSDT": 1500, "XRPUSDT": 0.45},
+                                   bulk_price_fallback=True)
+            prices = await asyncio.gather(
+                *[client.get_symbol_price(s) for s in ("BTCUSDT", "ETHUSDT") * 10])
+            self.assertEqual(prices, [20000, 1500] * 10)
+            self.assertEqual(client._inner.calls, [None])
+            self.assertEqual(await client.get_symbol_price("XRPUSDT"), 0.45)
+            self.assertEqual(client._inner.calls, [None])
+            client._feed.stop()
+
+        run(_test())
+
+    def test_failure_is_shared(self):
+        async def _test():
+            client = create_client({})
+            results = await asyncio.gather(
+                *[client.get_symbol_price("BTCUSDT") for _ in range(5)],
+                return_exceptions=True)
+            for res in results:
+                self.assertIsInstance(res, PriceUnavailableException)
+            self.assertEqual(client._inner.calls, ["BTCUSDT"])
+            # next attempt goes out again
+            with self.assertRaises(PriceUnavailableException):
+                await client.get_symbol_price("BTCUSDT")
+            self.assertEqual(client._inner.calls, ["BTCUSDT", "BTCUSDT"])
+            client._feed.stop()
+
+        run(_test())
+
+    def test_cancelled_caller_does_not_cancel_request(self):
+        async def _test():
+            client = create_client({"BTCUSDT": 20000})
+            first = asyncio.ensure_future(client.get_symbol_price("BTCUSDT"))
+            second = asyncio.ensure_future(client.get_symbol_price("BTCUSDT"))
+            await asyncio.sleep(0)
+            first.cancel()
+            self.assertEqual(await second, 20000)
+            self.assertEqual(client._inner.calls, ["BTCUSDT"])
+            client._feed.stop()
+
+        run(_test())
+
+
+def symbol_info(symbol, tick_size, step_size, min_notional="5"):
+    return {
+        "symbol": symbol,
+        "contractType": "PERPETUAL",
+        "filters": [
+            {"filterType": "PRICE_FILTER", "minPrice": tick_size, "maxPrice": "1000000",
+             "tickSize": tick_size},
+            {"filterType": "LOT_SIZE", "minQty": step_size, "maxQty": "1000",
+             "stepSize": step_size},
+            {"filterType": "MARKET_LOT_SIZE", "minQty": step_size, "maxQty": "120",
+             "stepSize": step_size},
+            {"filterType": "MIN_NOTIONAL", "notional": min_notional},
+        ],
+    }
+
+
+class TestSymbolRules(unittest.TestCase):
+    def test_compile(self):
+        rules = compile_symbol_rules(symbol_info("BTCUSDT", "0.10", "0.001"))
+        self.assertEqual(rules.tick_size, 0.1)
+        self.assertEqual(rules.price_digits, 1)
+        self.assertEqual(rules.qty_digits, 3)
+        self.assertEqual(rules.max_qty, 1000)
+        self.assertEqual(rules.max_market_qty, 120)
+        self.assertEqual(rules.min_notional, 5)
+
+    def test_round_to_decimal_ticks(self):
+        rules = compile_symbol_rules(symbol_info("XRPUSDT", "0.0001", "0.1"))
+        self.assertEqual(rules.round_price(0.456789), 0.4568)
+        self.assertEqual(rules.round_qty(123.456), 123.5)
+
+    def test_round_to_odd_ticks(self):
+        rules = compile_symbol_rules(symbol_info("BTCDOMUSDT", "0.5", "5"))
+        self.assertEqual(rules.round_price(10.3), 10.5)
+        self.assertEqual(rules.round_price(10.2), 10.0)
+        self.assertEqual(rules.round_qty(123), 125)
+        self.assertEqual(rules.round_qty(122), 120)
+
+    def test_validate(self):
+        rules = compile_symbol_rules(symbol_info("ETHUSDT", "0.01", "0.001"))
+        rules.validate(1500, 0.004)
+        with self.assertRaises(MinNotionalException):
+            rules.validate(1500, 0.003)
+        with self.assertRaises(QuantityLimitException):
+            rules.validate(1500, 121, is_market=True)
+        rules.validate(1500, 121)
+
+
+class StubLeverageClient:
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.calls = []
+
+    async def futures_symbol_config(self):
+        return [
+            {"symbol": "BTCUSDT", "marginType": "CROSSED", "isAutoAddMargin": "false", "leverage": 20,
+             "maxNotionalValue": "1000000"},
+            {"symbol": "ETHUSDT", "marginType": "ISOLATED", "isAutoAddMargin": "false", "leverage": 10,
+             "maxNotionalValue": "1000000"},
+        ]
+
+    async def futures_position_information(self):
+        # /fapi/v3/positionRisk, which has no leverage
+        return [{"symbol": "BTCUSDT", "positionSide": "BOTH", "positionAmt": "0.010", "entryPrice": "20000.0",
+                 "markPrice": "20010.0", "unRealizedProfit": "0.1", "isolatedMargin": "0",
+                 "initialMargin": "10.0", "notional": "200.1", "marginAsset": "USDT", "updateTime": 0}]
+
+    async def futures_change_leverage(self, symbol, leverage):
+        self.calls.append((symbol, leverage))
+        await asyncio.sleep(self.delay)
+        if leverage > 125:
+            raise Exception("Leverage is too large")
+        return {"symbol": symbol, "leverage": leverage, "maxNotionalValue": "1000000"}
+
+
+class TestLeverageCache(unittest.TestCase):
+    def _client(self):
+        client = BinanceFuturesClient("key", "secret")
+        client._inner = StubLeverageClient()
+        return client
+
+    def test_changes_only_when_needed(self):
+        async def _test():
+            client = self._client()
+            client.leverage.seed(await client._inner.futures_symbol_config())
+            self.assertEqual(client.leverage.leverage("BTCUSDT"), 20)
+
+            await client.change_leverage("BTCUSDT", 20)
+            self.assertEqual(client._inner.calls, [])
+            # concurrent signals share one change, and wait for it
+            await asyncio.gather(*[client.change_leverage("ETHUSDT", 25) for _ in range(5)])
+            self.assertEqual(client._inner.calls, [("ETHUSDT", 25)])
+            self.assertEqual(client.leverage.leverage("ETHUSDT"), 25)
+            await client.change_leverage("ETHUSDT", 25)
+            self.assertEqual(len(client._inner.calls), 1)
+
+            # failures reach every waiting caller, so that none of them places its order
+            results = await asyncio.gather(*[client.change_leverage("ETHUSDT", 200) for _ in range(2)],
+                                           return_exceptions=True)
+            self.assertEqual([str(res) for res in results], ["Leverage is too large"] * 2)
+            self.assertEqual(client._inner.calls[-1], ("ETHUSDT", 200))
+            self.assertEqual(len(client._inner.calls), 2)
+            self.assertEqual(client.leverage.leverage("ETHUSDT"), 25)
+
+        run(_test())
+
+    def test_user_events(self):
+        async def _test():
+            client = self._client()
+            await client._handle_event({"e": "ACCOUNT_CONFIG_UPDATE", "ac": {"s": "XRPUSDT", "l": 15}})
+            await client._handle_event({"e": "ACCOUNT_CONFIG_UPDATE", "ai": {"j": True}})
+            self.assertEqual(client.leverage.leverage("XRPUSDT"), 15)
+            await client.change_leverage("XRPUSDT", 15)
+            self.assertEqual(client._inner.calls, [])
+
+        run(_test())
+
+    def test_seeds_without_leverage(self):
+        async def _test():
+            client = self._client()
+            client.leverage.seed(await client._inner.futures_position_information())  # nothing to seed from
+            self.assertIsNone(client.leverage.leverage("BTCUSDT"))
+            await client.change_leverage("BTCUSDT", 20)  # cached with the first change
+            await client.change_leverage("BTCUSDT", 20)
+            self.assertEqual(client._inner.calls, [("BTCUSDT", 20)])
+
+        run(_test())
@@ -0,0 +1,248 @@
+import asyncio
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import time
+import unittest
+
+from aiohttp import web
+
+from .http import Lane, PooledAsyncClient, RateGovernor, lane, request_weight
+
+
+class FakeClock:
+    def __init__(self, now=600.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateGovernor(unittest.TestCase):
+    def test_endpoint_weights(self):
+        base = "https://fapi.binance.com"
+        self.assertEqual(request_weight("get", f"{base}/fapi/v1/ticker/price?symbol=BTCUSDT"), 1)
+        self.assertEqual(request_weight("get", f"{base}/fapi/v1/ticker/price"), 2)
+        self.assertEqual(request_weight("post", f"{base}/fapi/v1/batchOrders"), 5)
+        self.assertEqual(request_weight("post", f"{base}/fapi/v1/order"), 1)
+        # the versions python-binance calls
+        self.assertEqual(request_weight("get", f"{base}/fapi/v3/positionRisk?timestamp=1"), 5)
+        self.assertEqual(request_weight("get", f"{base}/fapi/v3/balance?timestamp=1"), 5)
+        self.assertEqual(request_weight("get", f"{base}/fapi/v1/symbolConfig?timestamp=1"), 5)
+
+    def test_paces_under_limit(self):
+        clock = FakeClock(600.0)
+        governor = RateGovernor(weight_limit=100, headroom=0.9, clock=clock)
+        self.assertEqual(governor.delay(90), 0)
+        governor.weight.used = 85
+        self.assertEqual(governor.delay(5), 0)
+        self.assertEqual(governor.delay(6), 60)  # until the next minute
+        clock.now = 659.5
+        self.assertEqual(governor.delay(6), 0.5)
+        clock.now = 660.0
+        self.assertEqual(governor.delay(6), 0)
+        self.assertEqual(governor.weight.used, 0)
+
+    def test_paces_orders(self):
+        clock = FakeClock(605.0)
+        governor = RateGovernor(orders_10s=10, orders_1m=20, headroom=1, clock=clock)
+        governor._take(1, 10)
+        self.assertEqual(governor.delay(1), 0)  # not an order
+        self.assertEqual(governor.delay(1, 1), 5)  # until the next 10s
+        clock.now = 610
+        governor._take(1, 10)
+        self.assertEqual(governor.delay(1, 1), 50)  # until the next minute
+
+    def test_follows_exchange(self):
+        clock = FakeClock(600.0)
+        governor = RateGovernor(weight_limit=100, clock=clock)
+        governor.weight.used = 10
+        governor.observe(200, {"X-MBX-USED-WEIGHT-1M": "50", "X-MBX-ORDER-COUNT-10S": "3"})
+        self.assertEqual(governor.weight.used, 50)
+        self.assertEqual(governor.orders[0].used, 3)
+        governor.observe(200, {"X-MBX-USED-WEIGHT-1M": "20"})
+        self.assertEqual(governor.weight.used, 50)
+        governor.observe(429, {"Retry-After": "30"})
+        self.assertEqual(governor.delay(1), 30)
+        clock.now = 631
+        self.assertEqual(governor.delay(1), 0)
+
+    def test_configure(self):
+        governor = RateGovernor()
+        governor.configure([
+            {"rateLimitType": "REQUEST_WEIGHT", "interval": "MINUTE", "intervalNum": 1, "limit": 1200},
+            {"rateLimitType": "ORDERS", "interval": "MINUTE", "intervalNum": 1, "limit": 600},
+            {"rateLimitType": "ORDERS", "interval": "SECOND", "intervalNum": 10, "limit": 100},
+        ])
+        self.assertEqual(governor.weight.limit, 1200)
+        self.assertEqual([w.limit for w in governor.orders], [100, 600])
+
+    def test_lane_order(self):
+        async def _test():
+            clock = FakeClock(600.0)
+            governor = RateGovernor(weight_limit=10, headroom=1, clock=clock)
+            governor._take(10, 0)
+            sent = []
+
+            async def _request(name, priority):
+                await governor.acquire(1, lane=priority)
+                sent.append(name)
+
+            tasks = [asyncio.ensure_future(_request(name, priority)) for name, priority in [
+                ("info", Lane.INFO), ("tp", Lane.TARGET), ("entry", Lane.ENTRY), ("sl", Lane.STOP)]]
+            await asyncio.sleep(0)
+            self.assertEqual(sent, [])
+            self.assertEqual(governor.waits, 4)
+            clock.now = 660.0
+            governor._dispatch()
+            await asyncio.gather(*tasks)
+            self.assertEqual(sent, ["sl", "entry", "tp", "info"])
+
+        asyncio.run(_test())
+
+
+class TestPooledSession(unittest.TestCase):
+    def test_session_params(self):
+        async def _test():
+            client = PooledAsyncClient("key", "secret", session_params={"trust_env": True})
+            try:
+                self.assertTrue(client.session.trust_env)
+                self.assertEqual(client.session.connector.limit, PooledAsyncClient.pool_size)
+            finally:
+                await client.close_connection()
+
+        asyncio.run(_test())
+
+
+class StubServer:
+    def __init__(self):
+        self.transports = []  # one per connection
+        self.requests = 0
+
+    async def ping(self, request: web.Request):
+        self.requests += 1
+        if all(t is not request.transport for t in self.transports):
+            self.transports.append(request.transport)
+        await asyncio.sleep(0.01)
+        return web.json_response({}, headers={"X-MBX-USED-WEIGHT-1M": str(self.requests)})
+
+
+def make_cert(path: str):
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-keyout", os.path.join(path, "key.pem"),
+                    "-out", os.path.join(path, "cert.pem")], check=True, capture_output=True)
+
+
+@unittest.skipUnless(shutil.which("openssl"), "needs openssl to create a certificate")
+class TestPooledAsyncClient(unittest.TestCase):
+    def test_reuses_warm_connections(self):
+        with tempfile.TemporaryDirectory() as path:
+            make_cert(path)
+            server_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            server_ctx.load_cert_chain(os.path.join(path, "cert.pem"), os.path.join(path, "key.pem"))
+            client_ctx = ssl.create_default_context(cafile=os.path.join(path, "cert.pem"))
+            client_ctx.check_hostname = False
+
+            async def _test():
+                stub = StubServer()
+                app = web.Application()
+                app.router.add_get("/fapi/v1/ping", stub.ping)
+                runner = web.AppRunner(app)
+                await runner.setup()
+                site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=server_ctx)
+                await site.start()
+                port = site._server.sockets[0].getsockname()[1]
+
+                class Client(PooledAsyncClient):
+                    ssl_context = client_ctx
+                    warm_connections = 3
+
+                client = Client("key", "secret")
+                client.FUTURES_URL = f"https://127.0.0.1:{port}/fapi"
+                try:
+                    await client.warm_up()
+                    self.assertEqual(len(stub.transports), 3)
+                    # later requests (up to the warm count at once) don't open connections
+                    for _ in range(5):
+                        await asyncio.gather(*[client.futures_ping() for _ in range(3)])
+                    self.assertEqual(len(stub.transports), 3)
+                    self.assertEqual(client.governor.weight.used, stub.requests)
+                finally:
+                    await client.close_connection()
+                    await runner.cleanup()
+
+            asyncio.run(_test())
+
+
+# Exchange which counts request weight in (shortened) windows and answers 429 past its limit
+class LimitedExchange:
+    def __init__(self, limit: int, secs: float):
+        self.limit = limit
+        self.secs = secs
+        self.used = 0
+        self.rejected = 0
+        self.received = []  # request tags in arrival order
+        self._window = 0
+
+    async def handle(self, request: web.Request):
+        window = int(time.time() // self.secs)
+        if window != self._window:
+            self._window, self.used = window, 0
+        self.used += 1
+        params = {**request.query, **(await request.post())}
+        self.received.append(params.get("newClientOrderId", "info"))
+        headers = {"X-MBX-USED-WEIGHT-1M": str(self.used)}
+        if self.used > self.limit:
+            self.rejected += 1
+            return web.json_response({"code": -1003, "msg": "Too many requests"}, status=429,
+                                     headers={**headers, "Retry-After": "1"})
+        return web.json_response({"symbol": "BTCUSDT", "price": "1", **params}, headers=headers)
+
+
+class TestRateGovernorSimulation(unittest.TestCase):
+    def test_stop_lane_first_under_limits(self):
+        async def _test():
+            exchange = LimitedExchange(limit=10, secs=0.25)
+            app = web.Application()
+            app.router.add_get("/fapi/{version}/ticker/price", exchange.handle)
+            app.router.add_post("/fapi/v1/order", exchange.handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+
+            client = PooledAsyncClient("key", "secret")
+            client.FUTURES_URL = f"http://127.0.0.1:{port}/fapi"
+            client.governor.weight.limit = exchange.limit
+            client.governor.weight.secs = exchange.secs
+
+            async def _order(order_id, priority):
+                with lane(priority):
+                    await client.futures_create_order(
+                        symbol="BTCUSDT", side="SELL", type="MARKET", quantity=1,
+                        reduceOnly=True, newClientOrderId=order_id)
+
+            try:
+                # a close-all while the client is already at its limit, busy with prices and targets
+                await asyncio.sleep(exchange.secs - time.time() % exchange.secs)
+                client.governor._take(9, 0)
+                tasks = [client.futures_symbol_ticker(symbol="BTCUSDT") for _ in range(20)]
+                tasks += [_order(f"tp-{i}", Lane.TARGET) for i in range(10)]
+                tasks += [_order(f"sl-{i}", Lane.STOP) for i in range(5)]
+                await asyncio.gather(*tasks)
+            finally:
+                await client.close_connection()
+                await runner.cleanup()
+
+            self.assertEqual(exchange.rejected, 0)
+            self.assertEqual(len(exchange.received), 35)
+            # everything was queued, and the next window went to the SLs (and then targets)
+            first = exchange.received[:9]
+            self.assertEqual(sorted(tag for tag in first if tag.startswith("sl-")),
+                             [f"sl-{i}" for i in range(5)])
+            self.assertNotIn("info", first)
+
+        asyncio.run(_test())
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import time
+import unittest
+
+from .prices import PRICE_FEED_SYNC_DELAY, PriceFeed, PriceStore, PriceStream
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, msg):
+        msg = json.loads(msg)
+        self.sent.append((msg["method"], msg["params"]))
+
+
+class FakeSocket:
+    def __init__(self, streams):
+        self.streams = streams
+        self.queue = asyncio.Queue()
+        self.ws = FakeConnection()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_args):
+        pass
+
+    async def recv(self):
+        return await self.queue.get()
+
+
+class FakeSocketManager:
+    def __init__(self):
+        self.sockets = []
+
+    def futures_multiplex_socket(self, streams):
+        sock = FakeSocket(streams)
+        self.sockets.append(sock)
+        return sock
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestPriceStore(unittest.TestCase):
+    def test_latest_value(self):
+        prices = PriceStore(max_age=10)
+        sid = prices.intern("BTCUSDT")
+        self.assertEqual(prices.intern("BTCUSDT"), sid)
+        self.assertIsNone(prices.get("BTCUSDT"))
+        prices.update(sid, 20000)
+        prices["ETHUSDT"] = 1500
+        prices.update(sid, 20010)
+        self.assertEqual(prices.get("BTCUSDT"), 20010)
+        self.assertEqual(prices["ETHUSDT"], 1500)
+        self.assertIsNone(prices.get("XRPUSDT"))
+
+    def test_stale_on_read(self):
+        prices = PriceStore(max_age=10)
+        prices.update(prices.intern("BTCUSDT"), 20000, ts=time.monotonic() - 11)
+        self.assertIsNone(prices.get("BTCUSDT"))
+        self.assertNotIn("BTCUSDT", prices)
+        self.assertEqual(prices.get("BTCUSDT", max_age=20), 20000)
+
+    def test_wait(self):
+        async def _test():
+            prices = PriceStore()
+            prices["ETHUSDT"] = 1500
+            self.assertEqual(await prices.wait("ETHUSDT", timeout=0), 1500)
+
+            waiters = [asyncio.ensure_future(prices.wait("BTCUSDT", timeout=1)) for _ in range(2)]
+            await asyncio.sleep(0)
+            start = time.monotonic()
+            asyncio.get_event_loop().call_later(0.01, prices.update, prices.intern("BTCUSDT"), 20000)
+            self.assertEqual(await asyncio.gather(*waiters), [20000, 20000])
+            self.assertLess(time.monotonic() - start, 0.5)
+
+            self.assertIsNone(await prices.wait("XRPUSDT", timeout=0.01))
+            self.assertEqual(prices._waiters, {})
+
+        run(_test())
+
+
+class TestPriceFeed(unittest.TestCase):
+    def test_shards_symbols_with_cap(self):
+        async def _test():
+            manager = FakeSocketManager()
+            feed = PriceFeed(manager, PriceStore(), stream=PriceStream.AGG_TRADE,
+                             connections=2, max_streams=2)
+            for sym in ("BTCUSDT", "ETHUSDT", "XRPUSDT", "BTCUSDT", "ADAUSDT"):
+                self.assertTrue(feed.subscribe(sym))
+            self.assertFalse(feed.subscribe("DOTUSDT"))
+            await asyncio.sleep(PRICE_FEED_SYNC_DELAY * 2)
+            # one connection per shard, opened once for all the coalesced subscriptions
+            self.assertEqual(len(manager.sockets), 2)
+            streams = sorted(s for sock in manager.sockets for s in sock.streams)
+            self.assertEqual(streams, ["adausdt@aggTrade", "btcusdt@aggTrade",
+                                       "ethusdt@aggTrade", "xrpusdt@aggTrade"])
+            feed.stop()
+
+        run(_test())
+
+    def test_updates_prices(self):
+        async def _test():
+            manager = FakeSocketManager()
+            prices = PriceStore()
+            feed = PriceFeed(manager, prices, stream=PriceStream.BOOK_TICKER)
+            feed.subscribe("BTCUSDT")
+            await asyncio.sleep(PRICE_FEED_SYNC_DELAY * 2)
+            await manager.sockets[0].queue.put(
+                {"stream": "btcusdt@bookTicker", "data": {"b": "20000", "a": "20001"}})
+            await asyncio.sleep(0)
+            self.assertEqual(prices["BTCUSDT"], 20000.5)
+            feed.stop()
+
+        run(_test())
+
+    def test_drops_idle_symbols(self):
+        async def _test():
+            manager = FakeSocketManager()
+            feed = PriceFeed(manager, PriceStore(), idle_timeout=60)
+            feed.subscribe("BTCUSDT")
+            feed.subscribe("ETHUSDT")
+            feed._last_used["BTCUSDT"] -= 120
+            feed.drop_idle()
+            self.assertEqual(feed.symbols, ["ETHUSDT"])
+            await asyncio.sleep(PRICE_FEED_SYNC_DELAY * 2)
+            self.assertEqual(manager.sockets[-1].streams, ["ethusdt@aggTrade"])
+
+            feed.unsubscribe("ETHUSDT")
+            await asyncio.sleep(PRICE_FEED_SYNC_DELAY * 2)
+            self.assertIsNone(feed._shards[0].task)  # closed once it's empty
+            feed.stop()
+
+        run(_test())
+
+    def test_changes_subscriptions_in_place(self):
+        async def _test():
+            manager = FakeSocketManager()
+            prices = PriceStore()
+            feed = PriceFeed(manager, prices, connections=1)
+            feed.subscribe("BTCUSDT")
+            await asyncio.sleep(PRICE_FEED_SYNC_DELAY * 2)
+            sock = manager.sockets[0]
+
+            feed.subscribe("ETHUSDT")
+            feed.subscribe("XRPUSDT")
+            feed.unsubscribe("BTCUSDT")
+            await asyncio.sleep(PRICE_FEED_SYNC_DELAY * 2)
+            self.assertEqual(len(manager.sockets), 1)  # no reconnect
+            self.assertEqual(sock.ws.sent, [("UNSUBSCRIBE", ["btcusdt@aggTrade"]),
+                                            ("SUBSCRIBE", ["ethusdt@aggTrade", "xrpusdt@aggTrade"])])
+
+            await sock.queue.put({"result": None, "id": 1})
+            await sock.queue.put({"stream": "btcusdt@aggTrade", "data": {"p": "20000"}})
+            await sock.queue.put({"stream": "ethusdt@aggTrade", "data": {"p": "1500"}})
+            await asyncio.sleep(0.01)
+            self.assertNotIn("BTCUSDT", prices)
+            self.assertEqual(prices["ETHUSDT"], 1500)
+
+            # the socket reconnected by itself to its original streams
+            sock.ws = FakeConnection()
+            await sock.queue.put({"stream": "ethusdt@aggTrade", "data": {"p": "1501"}})
+            await asyncio.sleep(0.01)
+            self.assertEqual(sock.ws.sent, [("UNSUBSCRIBE", ["btcusdt@aggTrade"]),
+                                            ("SUBSCRIBE", ["ethusdt@aggTrade", "xrpusdt@aggTrade"])])
+            self.assertEqual(len(manager.sockets), 1)
+            feed.stop()
+
+        run(_test())
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from ..errors import EntryCrossedException, InsufficientMarginException, QuantityLimitException
+from ..markets.futures import FuturesTrader
+from ..signal import Signal
+from ..storage import PersistentDict
+from . import OrderPositionSide, OrderRequest, OrderSide, SymbolRules
+from .simulator import SIM_MAKER_FEE, SIM_TAKER_FEE, SimulatedExchange, load_ticks
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Events:
+    def __init__(self, exchange: SimulatedExchange):
+        self.fills = []
+        self.cancels = []
+        self.balances = []
+        exchange.register_order_fill_update(self._on_fill)
+        exchange.register_order_cancel_update(self._on_cancel)
+        exchange.register_account_balance_update(self._on_balance)
+
+    async def _on_fill(self, event):
+        self.fills.append((event.order_id, event.symbol, event.price))
+
+    async def _on_cancel(self, event):
+        self.cancels.append(event.order_id)
+
+    async def _on_balance(self, balance):
+        self.balances.append(balance)
+
+
+def request(side=OrderSide.BUY, qty=1.0, position=OrderPositionSide.LONG, symbol="BTCUSDT"):
+    return OrderRequest(symbol, side, qty, position)
+
+
+class TestSimulatedExchange(unittest.TestCase):
+    def test_market_order(self):
+        async def _test():
+            exchange = SimulatedExchange(balance=1000)
+            events = Events(exchange)
+            await exchange.init()
+            exchange.tick("BTCUSDT", 100.0)
+            order = await exchange.create_order(request())
+            self.assertEqual(order.response["status"], "FILLED")
+            self.assertEqual(exchange.available, 1000 - 100 * SIM_TAKER_FEE - 100 / 20)
+            await asyncio.sleep(0)
+            self.assertEqual(events.fills, [(order.order_id, "BTCUSDT", 100.0)])
+            self.assertEqual(events.balances, [1000 - 100 * SIM_TAKER_FEE])
+            await exchange.close()
+
+        run(_test())
+
+    def test_limit_order_rests_until_crossed(self):
+        async def _test():
+            exchange = SimulatedExchange(balance=1000)
+            events = Events(exchange)
+            await exchange.init()
+            exchange.tick("BTCUSDT", 100.0)
+            req = request()
+            req.limit(95.0)
+            order = await exchange.create_order(req)
+            self.assertEqual(order.response["status"], "NEW")
+            exchange.tick("BTCUSDT", 96.0)
+            await asyncio.sleep(0)
+            self.assertEqual(events.fills, [])
+            exchange.tick("BTCUSDT", 94.0)
+            await asyncio.sleep(0)
+            self.assertEqual(events.fills, [(order.order_id, "BTCUSDT", 95.0)])  # at its price
+
+            # closed by a stop which triggers on the way down
+            req = request(OrderSide.SELL)
+            req.stop_limit(93.0, 92.0)
+            stop = await exchange.create_order(req)
+            exchange.tick("BTCUSDT", 96.0)
+            exchange.tick("BTCUSDT", 92.5)
+            await asyncio.sleep(0)
+            self.assertEqual(events.fills[-1], (stop.order_id, "BTCUSDT", 92.0))
+            self.assertAlmostEqual(exchange.balance, 1000 - 3 - (95 + 92) * SIM_MAKER_FEE)
+            self.assertAlmostEqual(exchange.available, exchange.balance)
+            await exchange.close()
+
+        run(_test())
+
+    def test_rejects_orders(self):
+        async def _test():
+            exchange = SimulatedExchange(balance=10, rules={"BTCUSDT": SymbolRules("BTCUSDT", min_qty=1)})
+            await exchange.init()
+            exchange.tick("BTCUSDT", 100.0)
+            req = request(OrderSide.SELL)
+            req.stop_limit(101.0, 100.0)  # would trigger immediately
+            with self.assertRaises(EntryCrossedException):
+                await exchange.create_order(req)
+            with self.assertRaises(InsufficientMarginException):
+                await exchange.create_order(request(qty=3))
+            with self.assertRaises(QuantityLimitException):
+                exchange.validate_order("BTCUSDT", 100.0, 0.5)
+            await exchange.close()
+
+        run(_test())
+
+    def test_cancel(self):
+        async def _test():
+            exchange = SimulatedExchange(balance=1000, event_latency=0.01)
+            events = Events(exchange)
+            await exchange.init()
+            exchange.tick("BTCUSDT", 100.0)
+            req = request()
+            req.limit(90.0)
+            order = await exchange.create_order(req)
+            self.assertLess(exchange.available, 1000)
+            await exchange.cancel_order("BTCUSDT", order.order_id)
+            self.assertEqual(exchange.available, 1000)
+            exchange.tick("BTCUSDT", 80.0)
+            self.assertEqual(events.cancels, [])  # not delivered yet
+            await asyncio.sleep(0.02)
+            self.assertEqual(events.cancels, [order.order_id])
+            self.assertEqual(events.fills, [])
+            await exchange.close()
+
+        run(_test())
+
+    def test_replay(self):
+        async def _test():
+            with tempfile.TemporaryDirectory() as path:
+                with open(os.path.join(path, "trades.csv"), "w") as f:
+                    f.write("agg_trade_id,price,quantity,first_trade_id,last_trade_id,"
+                            "transact_time,is_buyer_maker\n")
+                    for i, price in enumerate([100, 99, 97, 98]):
+                        f.write(f"{i},{price},1,{i},{i},{1000 + i * 10},false\n")
+                ticks = load_ticks(os.path.join(path, "trades.csv"), "btcusdt")
+            self.assertEqual(ticks[1], (1.01, "BTCUSDT", 99.0))
+
+            exchange = SimulatedExchange()
+            events = Events(exchange)
+            await exchange.init()
+            exchange.tick("BTCUSDT", 101.0)
+            req = request()
+            req.limit(98.0)
+            order = await exchange.create_order(req)
+            loop = asyncio.get_event_loop()
+            start = loop.time()
+            await exchange.replay(ticks, speed=1)
+            self.assertGreaterEqual(loop.time() - start, 0.03)
+            await asyncio.sleep(0)
+            self.assertEqual(events.fills, [(order.order_id, "BTCUSDT", 98.0)])
+            self.assertEqual(exchange.prices["BTCUSDT"], 98.0)
+            await exchange.close()
+
+        run(_test())
+
+    def test_trader(self):
+        async def _test():
+            exchange = SimulatedExchange(balance=1000, latency=0.001, jitter=0.002, seed=1)
+            with tempfile.TemporaryDirectory() as path:
+                with open(os.path.join(path, "state.json"), "w") as f:
+                    f.write("{}")
+                trader = FuturesTrader(exchange, PersistentDict(os.path.join(path, "state.json")))
+                with trader.storage:
+                    await trader.init()
+                    exchange.tick("BTCUSDT", 100.0)
+                    sig = Signal("BTC", "USDT", 95.0, targets=[105.0, 110.0], leverage=10)
+                    await trader._place_order(sig)
+                    self.assertEqual(exchange.calls, {"create": 1, "leverage": 1})
+                    self.assertEqual(exchange.leverage.leverage("BTCUSDT"), 10)
+                    order = next(iter(exchange.orders.values()))
+                    self.assertEqual(order["status"], "FILLED")
+                    self.assertAlmostEqual(order["origQty"], 1000 * sig.fraction * 10 / 100)
+            await exchange.close()
+
+        run(_test())
@@ -0,0 +1,148 @@
+import itertools
+import math
+import time
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from .logger import get_logger
+from .signal import Signal
+
+logging = get_logger(__name__)
+
+DEDUP_TTL = 12 * 60 * 60  # secs a signal blocks its repeats
+DEDUP_BUCKETS = 12  # time buckets the TTL is split in, expired a bucket at a time
+DEDUP_MAX_KEYS = 1000
+DEDUP_TOLERANCE = 0.002  # relative difference within which prices are the same
+
+
+class Field:
+    SYMBOL = "symbol"
+    SIDE = "side"
+    ENTRY = "entry"  # market signals all share one
+    TARGET = "target"  # the first one
+    SL = "sl"
+
+
+DEDUP_FIELDS = (Field.SYMBOL, Field.SIDE, Field.ENTRY, Field.TARGET)
+
+
+def _first_target(signal: Signal) -> Optional[float]:
+    if not signal.targets:
+        return None
+    return min(signal.targets) if signal.is_long else max(signal.targets)
+
+
+# Signals seen recently, by a fingerprint of the given fields, to turn away reposts of a call.
+# Prices are compared on a log scale with buckets half of `tolerance` wide, and a price also
+# matches the neighbouring buckets - so prices match if they're within `tolerance / 2` of each
+# other, may match up to `tolerance`, and never match beyond it. Fingerprints map to the time
+# bucket they were last seen in, and whole time buckets expire together - at most `max_keys`
+# are kept, the oldest going first.
+# NOTE: This wraps the given dict (instead of copying it), so that the persisted state still
+# sees every change. With `track_changes`, fingerprints added or removed are remembered until
+# taken, for them to be journaled.
+class SignalIndex:
+    def __init__(self, seen: Optional[Dict[str, int]] = None, fields: Sequence[str] = DEDUP_FIELDS,
+                 tolerance: float = DEDUP_TOLERANCE, ttl: float = DEDUP_TTL,
+                 max_keys: int = DEDUP_MAX_KEYS, track_changes=False):
+        self.fields = tuple(fields)
+        self.tolerance = tolerance
+        self.width = ttl / DEDUP_BUCKETS  # secs per time bucket
+        self.max_keys = max_keys
+        self.hits = 0
+        self.misses = 0
+        self._seen = {} if seen is None else seen  # fingerprint -> time bucket
+        self._log_step = math.log1p(tolerance) / 2
+        self._changed = set() if track_changes else None
+        self._buckets: Dict[int, set] = {}  # time bucket -> fingerprints, oldest first
+        for key, bucket in sorted(self._seen.items(), key=lambda item: item[1]):
+            self._buckets.setdefault(bucket, set()).add(key)
+
+    def __len__(self):
+        return len(self._seen)
+
+    def _price(self, price: Optional[float]) -> List[str]:
+        if not price:
+            return ["-"]
+        bucket = math.floor(math.log(price) / self._log_step)
+        return [str(bucket), str(bucket - 1), str(bucket + 1)]
+
+    def _parts(self, signal: Signal, field: str) -> List[str]:
+        if field == Field.SYMBOL:
+            return [signal.symbol]
+        if field == Field.SIDE:
+            return ["L" if signal.is_long else "S"]
+        if field == Field.ENTRY:
+            return self._price(signal.entry)
+        if field == Field.TARGET:
+            return self._price(_first_target(signal))
+        if field == Field.SL:
+            return self._price(signal.sl)
+        raise ValueError(f"Unknown field {field}")
+
+    def fingerprints(self, signal: Signal) -> Iterator[str]:
+        # its own first, then the ones within tolerance of it
+        parts = [self._parts(signal, field) for field in self.fields]
+        return ("|".join(combo) for combo in itertools.product(*parts))
+
+    def fingerprint(self, signal: Signal) -> str:
+        return next(self.fingerprints(signal))
+
+    def check(self, signal: Signal, now: Optional[float] = None) -> bool:
+        # whether it repeats a recent signal - if not, it's recorded
+        bucket = int((time.time() if now is None else now) // self.width)
+        self._expire(bucket)
+        oldest = bucket - DEDUP_BUCKETS + 1
+        for key in self.fingerprints(signal):
+            if self._seen.get(key, oldest - 1) >= oldest:
+                self.hits += 1
+                return True
+        self.misses += 1
+        self._add(self.fingerprint(signal), bucket)
+        return False
+
+    def forget(self, signal: Signal):
+        # e.g. when it never made it to an order, so a repost isn't turned away
+        self.discard(self.fingerprint(signal))
+
+    def discard(self, key: str):
+        # by the fingerprint it was checked with (its prices may have been corrected since)
+        bucket = self._seen.pop(key, None)
+        if bucket is not None:
+            self._buckets[bucket].discard(key)
+            self._change(key)
+
+    def take_changed(self) -> List[str]:
+        if not self._changed:
+            return []
+        changed, self._changed = list(self._changed), set()
+        return changed
+
+    def _change(self, key: str):
+        if self._changed is not None:
+            self._changed.add(key)
+
+    def _add(self, key: str, bucket: int):
+        old = self._seen.get(key)
+        if old is not None:
+            self._buckets[old].discard(key)
+        self._seen[key] = bucket
+        self._buckets.setdefault(bucket, set()).add(key)
+        self._change(key)
+        while len(self._seen) > self.max_keys:
+            oldest = next(iter(self._buckets))
+            keys = self._buckets[oldest]
+            if keys:
+                key = keys.pop()
+                del self._seen[key]
+                self._change(key)
+            else:
+                del self._buckets[oldest]
+
+    def _expire(self, bucket: int):
+        while self._buckets:
+            oldest = next(iter(self._buckets))
+            if oldest > bucket - DEDUP_BUCKETS:
+                break
+            for key in self._buckets.pop(oldest):
+                del self._seen[key]
+                self._change(key)
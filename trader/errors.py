@@ -20,6 +20,19 @@ class InsufficientQuantityException(Exception):
         self.est_funds = est_funds
 
 
+class MinNotionalException(Exception):
+    def __init__(self, notional, min_notional):
+        self.notional = notional
+        self.min_notional = min_notional
+
+
+class QuantityLimitException(Exception):
+    def __init__(self, quantity, min_qty, max_qty):
+        self.quantity = quantity
+        self.min_qty = min_qty
+        self.max_qty = max_qty
+
+
 # ----- Command-related exceptions ----
 
 class CloseTradeException(Exception):
@@ -1,18 +1,30 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+
 import termcolor
 
 
 class ColoredAdapter(logging.LoggerAdapter):
+    # Messages can be callables (returning the message), which are only called if the level's
+    # enabled - for hot paths which would otherwise build large messages just to drop them.
+    # Colors are passed along with the record and applied by the formatter.
     def process(self, msg, kwargs):
-        kv = {}
+        extra = dict(kwargs.get("extra") or {})
         color = kwargs.pop("color", None)
         if color:
-            kv["color"] = color
+            extra["color"] = color
         on_color = kwargs.pop("on", None)
         if on_color:
-            kv["on_color"] = "on_" + on_color
-        if kv:
-            msg = termcolor.colored(msg, **kv)
+            extra["on_color"] = "on_" + on_color
+        if extra:
+            kwargs["extra"] = extra
+        if callable(msg):
+            msg = msg()
         return msg, kwargs
 
 
@@ -25,16 +37,81 @@ class ColoredFormatter(logging.Formatter):
         logging.CRITICAL: (["red"], {"attrs": ["bold"]})
     }
 
+    def __init__(self):
+        super().__init__()
+        self._formatters = {
+            level: logging.Formatter(termcolor.colored("%(levelname)s: %(message)s", *args, **kwargs))
+            for level, (args, kwargs) in self.COLORS.items()
+        }
+
+    def format(self, record: logging.LogRecord):
+        fmt = self._formatters.get(record.levelno, self._formatters[logging.INFO])
+        kv = {}
+        if getattr(record, "color", None):
+            kv["color"] = record.color
+        if getattr(record, "on_color", None):
+            kv["on_color"] = record.on_color
+        if not kv:
+            return fmt.format(record)
+        # colors apply to the message alone, so color the message instead of the whole line
+        msg, args = record.msg, record.args
+        record.msg, record.args = termcolor.colored(record.getMessage(), **kv), None
+        try:
+            return fmt.format(record)
+        finally:
+            record.msg, record.args = msg, args
+
+
+class JsonFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord):
-        args, kwargs = self.COLORS[record.levelno]
-        fmt = termcolor.colored("%(levelname)s: %(message)s", *args, **kwargs)
-        return logging.Formatter(fmt).format(record)
+        out = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out)
+
+
+# Records are only queued by the logging call, and formatted and written by the listener thread.
+# NOTE: Message args are formatted in the listener thread, so they shouldn't be mutated after
+# logging (pass the formatted value or a callable message for those).
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord):
+        return record
+
+
+def _stream_handler(stream=None) -> logging.Handler:
+    hdr = logging.StreamHandler(stream)
+    # structured output when logs go to files or collectors instead of a terminal
+    is_tty = hasattr(hdr.stream, "isatty") and hdr.stream.isatty()
+    hdr.setFormatter(ColoredFormatter() if is_tty else JsonFormatter())
+    return hdr
+
+
+def get_logger(name: str) -> ColoredAdapter:
+    return ColoredAdapter(logging.getLogger(name), {})
+
+
+def configure_levels(spec: str):
+    # "trader.utils=debug,trader.clients=warning" - levels for modules (and everything under them)
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
 
 
 ROOT = logging.getLogger()
 ROOT.setLevel(logging.INFO)
-hdr = logging.StreamHandler()
-hdr.setFormatter(ColoredFormatter())
-ROOT.addHandler(hdr)
+_queue = queue.SimpleQueue()
+ROOT.addHandler(_QueueHandler(_queue))
+LISTENER = logging.handlers.QueueListener(_queue, _stream_handler(sys.stderr))
+LISTENER.start()
+atexit.register(LISTENER.stop)  # flushes whatever's still queued
+
+configure_levels(os.getenv("LOG_LEVELS", ""))
 
 DEFAULT_LOGGER = ColoredAdapter(ROOT, {})
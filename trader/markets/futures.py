@@ -3,23 +3,29 @@ import traceback
 from typing import Awaitable, Callable
 
 from ..errors import (EntryCrossedException, InsufficientMarginException,
-                      InsufficientQuantityException, PriceUnavailableException)
+                      InsufficientQuantityException, MinNotionalException,
+                      PriceUnavailableException, QuantityLimitException)
 from ..clients import (FuturesExchangeClient, OrderSide, OrderPositionSide,
                        OrderRequest, OrderFillEvent, OrderCancelEvent)
-from ..logger import DEFAULT_LOGGER as logging
+from ..logger import get_logger
 from ..messages import Message
+from ..metrics import TRACER
+from ..scheduler import SCHEDULER_MAX_QUEUED, SCHEDULER_WORKERS, Scheduler
 from ..signal import Signal
 from ..storage import Storage
 from ..utils import get_tag
 
+logging = get_logger(__name__)
+
 PRICE_SLIPPAGE = 1.2  # skip order if funds allocated exceeds estimation by this much
 
 
 class FuturesTrader:
-    def __init__(self, client: FuturesExchangeClient, storage: Storage):
+    def __init__(self, client: FuturesExchangeClient, storage: Storage,
+                 workers: int = SCHEDULER_WORKERS, max_queued: int = SCHEDULER_MAX_QUEUED):
         self.client = client
         self.storage = storage
-        self.order_queue = asyncio.Queue()
+        self.scheduler = Scheduler(workers, max_queued)
         self._msg_handler = None
 
     async def init(self, loop=None):
@@ -32,54 +38,70 @@ class FuturesTrader:
     def register_message_handler(self, handler: Callable[[str], Awaitable[None]]):
         self._msg_handler = handler
 
-    async def queue_signal(self, signal: Signal):
-        await self.order_queue.put(signal)
+    async def queue_signal(self, signal: Signal) -> bool:
+        def _dropped(reason: str):
+            TRACER.discard(signal.trace)
+            logging.info(f"Dropped signal {signal.tag} for {signal.symbol} ({reason})", color="yellow")
+
+        return self.scheduler.submit(signal.symbol, lambda: self._process_signal(signal),
+                                     on_drop=_dropped)
 
     def _gather_orders(self):
-        async def _gatherer():
-            logging.info("Waiting for orders to be queued...")
-
-            async def _process(signal):
-                while True:
-                    pos = await self.storage.get_position(signal.tag)
-                    if pos is None:  # Ensure that we don't have a position with the same tag
-                        break
-                    signal.tag = get_tag()
-
-                try:
-                    return await self._place_order(signal)
-                except PriceUnavailableException:
-                    logging.info(f"Price unavailable for {signal.symbol}", color="red")
-                    await self._publish_message(
-                        Message.error(signal.tag, "Couldn't get price for symbol"))
-                except EntryCrossedException as err:
-                    logging.info(
-                        f"Price went too fast ({err.price}) for signal {signal}", color="yellow")
-                    await self._publish_message(
-                        Message.error(signal.tag, "Price went too fast for signal"))
-                except InsufficientMarginException:
-                    await self._publish_message(Message.no_margin(signal.asset))
-                except InsufficientQuantityException as err:
-                    logging.info(
-                        f"Allocated ${round(err.alloc_funds, 2)} for {err.alloc_q} {signal.coin} "
-                        f"but requires ${round(err.est_funds, 2)} for {err.est_q} {signal.coin}",
-                        color="red")
-                    await self._publish_message(
-                        Message.error(signal.tag, "Cannot allocate required quantity for position"))
-                except Exception as err:
-                    logging.error(f"Failed to place order: {traceback.format_exc()} {err}")
-                    await self._publish_message(
-                        Message.error(signal.tag, "Unexpected error occurred while placing order"))
-
-            while True:
-                signal = await self.order_queue.get()
-                asyncio.ensure_future(_process(signal))
-
-        asyncio.ensure_future(_gatherer())
+        logging.info("Waiting for orders to be queued...")
+        self.scheduler.start()
+
+    async def close(self):
+        await self.scheduler.close()
+
+    async def _process_signal(self, signal: Signal):
+        TRACER.mark(signal.trace, "dequeue")
+        while True:
+            pos = await self.storage.get_position(signal.tag)
+            if pos is None:  # Ensure that we don't have a position with the same tag
+                break
+            signal.tag = get_tag()
+
+        try:
+            return await self._place_order(signal)
+        except PriceUnavailableException:
+            logging.info(f"Price unavailable for {signal.symbol}", color="red")
+            await self._publish_message(
+                Message.error(signal.tag, "Couldn't get price for symbol"))
+        except EntryCrossedException as err:
+            logging.info(
+                f"Price went too fast ({err.price}) for signal {signal}", color="yellow")
+            await self._publish_message(
+                Message.error(signal.tag, "Price went too fast for signal"))
+        except InsufficientMarginException:
+            await self._publish_message(Message.no_margin(signal.asset))
+        except InsufficientQuantityException as err:
+            logging.info(
+                f"Allocated ${round(err.alloc_funds, 2)} for {err.alloc_q} {signal.coin} "
+                f"but requires ${round(err.est_funds, 2)} for {err.est_q} {signal.coin}",
+                color="red")
+            await self._publish_message(
+                Message.error(signal.tag, "Cannot allocate required quantity for position"))
+        except MinNotionalException as err:
+            logging.info(f"Order value ${round(err.notional, 2)} for {signal.symbol} is below "
+                         f"the minimum of ${err.min_notional}", color="red")
+            await self._publish_message(
+                Message.error(signal.tag, "Order value is below the minimum notional"))
+        except QuantityLimitException as err:
+            logging.info(f"Quantity {err.quantity} for {signal.symbol} is outside "
+                         f"[{err.min_qty}, {err.max_qty}]", color="red")
+            await self._publish_message(
+                Message.error(signal.tag, "Order quantity is outside the allowed limits"))
+        except Exception as err:
+            logging.error(f"Failed to place order: {traceback.format_exc()} {err}")
+            await self._publish_message(
+                Message.error(signal.tag, "Unexpected error occurred while placing order"))
+        TRACER.discard(signal.trace)
 
     async def _place_order(self, signal: Signal):
-        asyncio.ensure_future(self.client.change_leverage(signal.symbol, signal.leverage))
-        price = await self.client.get_symbol_price(signal.symbol)
+        # usually a cache hit, but the order has to wait for the leverage if it's changed
+        _, price = await asyncio.gather(self.client.change_leverage(signal.symbol, signal.leverage),
+                                        self.client.get_symbol_price(signal.symbol))
+        TRACER.mark(signal.trace, "price")
         signal.correct(price)
         side = OrderSide.BUY if signal.is_long else OrderSide.SELL
         pos = OrderPositionSide.LONG if signal.is_long else OrderPositionSide.SHORT
@@ -90,6 +112,7 @@ class FuturesTrader:
         est_funds = qty * signal.entry / signal.leverage
         if (est_funds / alloc_funds) > PRICE_SLIPPAGE:
             raise InsufficientQuantityException(alloc_q, alloc_funds, qty, est_funds)
+        self.client.validate_order(signal.symbol, signal.entry, qty, is_market=signal.is_market_order)
 
         req = OrderRequest(signal.symbol, side, qty, pos)
         if signal.is_market_order:
@@ -99,7 +122,11 @@ class FuturesTrader:
             req.limit(self.client.normalize_price(signal.symbol, signal.entry))
 
         order = await self.client.create_order(req)
+        TRACER.finish(signal.trace, "order")
         logging.info(f"Created order {order.order_id} ({signal}): {order.response}")
+        await self.storage.register_position(order.order_id, signal.symbol, signal.entry, qty,
+                                             signal.targets, signal.sl, signal.tag,
+                                             is_soft=signal.soft_sl)
 
     async def _publish_message(self, msg: str):
         if self._msg_handler is None:
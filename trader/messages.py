@@ -30,6 +30,21 @@ class Message:
             msg = f"🛑 Loss: ${round(profit, 3)}"
         return (f"{s} {tag}: {side} {q_target} {coin} @ {round(target, 5)}\n{msg}")
 
+    @classmethod
+    def amended(cls, tag, coin, sl=None, targets=None):
+        changes = []
+        if sl:
+            changes.append(f"SL @ {round(sl, 5)}")
+        if targets:
+            changes.append("TP @ " + ", ".join(str(round(i, 5)) for i in targets))
+        return f"✏️ {tag}: {coin} moved {', '.join(changes)}"
+
+    @classmethod
+    def latency(cls, summary: list):
+        lines = [f"{stage}: {round(p50 * 1000, 1)} / {round(p99 * 1000, 1)} / {round(mx * 1000, 1)} ms ({count})"
+                 for stage, count, p50, p99, mx in summary]
+        return "⏱ Signal latency (p50 / p99 / max):\n" + "\n".join(lines)
+
     @classmethod
     def no_margin(cls, symbol: str):
         return f"‼️ No margin available for {symbol}"
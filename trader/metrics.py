@@ -0,0 +1,156 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from .logger import get_logger
+from .utils import NamedLock
+
+logging = get_logger(__name__)
+
+HISTOGRAM_SUB_BUCKETS = 16  # per power of two, so values are within ~6% of their bucket
+HISTOGRAM_MAX_EXPONENT = 40  # 2^40 us (~12 days) - anything longer is clamped
+TRACE_MAX_OPEN = 1000  # traces which are never finished are dropped beyond this
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+# Log-linear (HDR-style) histogram of durations in microseconds. Recording is an index
+# computation and a list increment, so it's cheap enough to do on every stage of every signal.
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (HISTOGRAM_SUB_BUCKETS * (HISTOGRAM_MAX_EXPONENT + 1))
+        self.count = 0
+        self.total = 0.0  # secs
+        self.max = 0.0  # secs
+
+    @staticmethod
+    def _index(us: int) -> int:
+        if us < HISTOGRAM_SUB_BUCKETS:
+            return us
+        # top 5 bits of the value (2^4 == HISTOGRAM_SUB_BUCKETS), i.e. 16 buckets per power of two
+        exp = min(us.bit_length() - 5, HISTOGRAM_MAX_EXPONENT - 1)
+        sub = min((us >> exp) - HISTOGRAM_SUB_BUCKETS, HISTOGRAM_SUB_BUCKETS - 1)
+        return (exp + 1) * HISTOGRAM_SUB_BUCKETS + sub
+
+    @staticmethod
+    def _upper(idx: int) -> int:
+        exp, sub = divmod(idx, HISTOGRAM_SUB_BUCKETS)
+        if exp == 0:
+            return sub
+        return ((HISTOGRAM_SUB_BUCKETS + sub + 1) << (exp - 1)) - 1
+
+    def record(self, secs: float):
+        self.counts[self._index(max(0, int(secs * 1e6)))] += 1
+        self.count += 1
+        self.total += secs
+        if secs > self.max:
+            self.max = secs
+
+    def quantile(self, q: float) -> float:
+        # upper bound (in secs) of the bucket holding the value at this quantile
+        if not self.count:
+            return 0.0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper(idx) / 1e6, self.max)
+        return self.max
+
+
+class Trace:
+    __slots__ = ("tag", "start", "last", "stages")
+
+    def __init__(self, tag: str, start: float):
+        self.tag = tag
+        self.start = start
+        self.last = start
+        self.stages = []  # (stage, secs)
+
+
+# Times each stage of a signal's way from the message to the acknowledged order. A stage's
+# duration is the time since the previous mark (or the start), and goes into that stage's
+# histogram - along with the whole trace's duration (under "total") when it's finished.
+class Tracer:
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._open: Dict[int, Trace] = {}
+
+    def start(self, tag: str, at: Optional[float] = None) -> Trace:
+        trace = Trace(tag, time.perf_counter() if at is None else at)
+        if len(self._open) >= TRACE_MAX_OPEN:
+            # dicts are ordered, so this drops the oldest
+            self._open.pop(next(iter(self._open)))
+        self._open[id(trace)] = trace
+        return trace
+
+    def mark(self, trace: Optional[Trace], stage: str):
+        if trace is None:
+            return
+        now = time.perf_counter()
+        secs = now - trace.last
+        trace.last = now
+        trace.stages.append((stage, secs))
+        self._histogram(stage).record(secs)
+
+    def finish(self, trace: Optional[Trace], stage: Optional[str] = None):
+        if trace is None or self._open.pop(id(trace), None) is None:
+            return
+        if stage is not None:
+            self.mark(trace, stage)
+        total = trace.last - trace.start
+        self._histogram("total").record(total)
+        logging.debug(lambda: f"Trace for {trace.tag} ({round(total * 1000, 2)} ms): " + ", ".join(
+            f"{stage} {round(secs * 1000, 2)} ms" for stage, secs in trace.stages))
+
+    def discard(self, trace: Optional[Trace]):
+        if trace is not None:
+            self._open.pop(id(trace), None)
+
+    def _histogram(self, stage: str) -> LatencyHistogram:
+        hist = self.histograms.get(stage)
+        if hist is None:
+            hist = self.histograms[stage] = LatencyHistogram()
+        return hist
+
+    def summary(self) -> List[tuple]:
+        # (stage, count, p50, p99, max) in secs
+        return [(stage, hist.count, hist.quantile(0.5), hist.quantile(0.99), hist.max)
+                for stage, hist in self.histograms.items() if hist.count]
+
+    def prometheus(self) -> str:
+        lines = ["# TYPE trader_signal_stage_seconds summary"]
+        for stage, hist in self.histograms.items():
+            for q in SUMMARY_QUANTILES:
+                lines.append(f'trader_signal_stage_seconds{{stage="{stage}",quantile="{q}"}} '
+                             f"{hist.quantile(q)}")
+            lines.append(f'trader_signal_stage_seconds_sum{{stage="{stage}"}} {hist.total}')
+            lines.append(f'trader_signal_stage_seconds_count{{stage="{stage}"}} {hist.count}')
+        return "\n".join(lines) + "\n"
+
+
+TRACER = Tracer()
+
+
+async def serve_metrics(port: int, tracer: Tracer = TRACER, host: str = "127.0.0.1",
+                        locks: Optional[Dict[str, NamedLock]] = None):
+    # Bare-bones HTTP server answering every request with the metrics in Prometheus' text format,
+    # the signal stages' and the contention of `locks` (by the kind of name they lock)
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = (tracer.prometheus() + "".join(
+                lock.prometheus(kind) for kind, lock in (locks or {}).items())).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                         b"Connection: close\r\n\r\n" + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(_handle, host, port)
+    logging.info(f"Serving metrics on {host}:{port}")
+    return server
@@ -0,0 +1,208 @@
+import asyncio
+import collections
+import heapq
+import itertools
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from .logger import get_logger
+
+logging = get_logger(__name__)
+
+SCHEDULER_WORKERS = 8
+SCHEDULER_MAX_QUEUED = 100  # jobs waiting to start, beyond which the overflow policy applies
+
+
+class Priority:
+    COMMAND = 0  # closing or modifying trades
+    ENTRY = 1  # new trades
+
+
+class Overflow:
+    DROP_NEW = "drop-new"  # a full queue turns away new entries
+    DROP_OLDEST = "drop-oldest"  # a full queue drops its oldest entry to make room
+
+
+class Dropped:
+    MERGED = "merged"  # replaced by a newer job with the same merge key
+    OVERFLOW = "overflow"  # the queue was full
+    CLOSED = "closed"  # the scheduler closed without draining
+
+
+class _Job:
+    __slots__ = ("key", "run", "priority", "seq", "merge_key", "on_drop", "started")
+
+    def __init__(self, key, run, priority, seq, merge_key, on_drop):
+        self.key = key
+        self.run = run
+        self.priority = priority
+        self.seq = seq
+        self.merge_key = merge_key
+        self.on_drop = on_drop
+        self.started = False
+
+
+# Runs queued jobs on a fixed number of workers. Jobs of a key (a symbol) run one at a time, in
+# the order they were submitted, while different keys run in parallel - the next to run being
+# the key whose first job has the highest priority, so commands go ahead of new entries.
+# Jobs waiting to start are bounded: over `max_queued`, commands still get in (making room by
+# dropping an entry if there's one), and entries are turned away or replace the oldest entry,
+# by `overflow`. A job given a merge key replaces a waiting job with the same one in its place.
+# Failed jobs are logged.
+class Scheduler:
+    def __init__(self, workers: int = SCHEDULER_WORKERS, max_queued: int = SCHEDULER_MAX_QUEUED,
+                 overflow: str = Overflow.DROP_NEW):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.overflow = overflow
+        self.queued = 0  # waiting to start
+        self.running = 0
+        self.dropped = collections.Counter()  # by reason
+        self._keys: Dict[Hashable, Deque[_Job]] = {}
+        self._merges: Dict[Hashable, _Job] = {}
+        self._ready = []  # (priority, seq, key) of keys whose first job may start
+        self._available = asyncio.Semaphore(0)  # one per entry in `_ready`
+        self._seq = itertools.count()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks: List[asyncio.Task] = []
+        self._closed = False
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    def submit(self, key: Optional[Hashable], run: Callable[[], Awaitable], priority=Priority.ENTRY,
+               merge_key: Optional[Hashable] = None,
+               on_drop: Optional[Callable[[str], None]] = None) -> bool:
+        # `run` is called to get the job's awaitable once it's due. A job without a key isn't
+        # ordered with any other.
+        if self._closed:
+            self._drop(_Job(key, run, priority, None, merge_key, on_drop), Dropped.CLOSED)
+            return False
+        job = _Job(object() if key is None else key, run, priority, next(self._seq), merge_key, on_drop)
+        if merge_key is not None:
+            queued = self._merges.get(merge_key)
+            if queued is not None and not queued.started and queued.priority == priority:
+                self._replace(queued, job)
+                return True
+        if self.queued >= self.max_queued:
+            victim = self._oldest(Priority.ENTRY)
+            if priority == Priority.ENTRY and (self.overflow == Overflow.DROP_NEW or victim is None):
+                self._drop(job, Dropped.OVERFLOW)
+                return False
+            if victim is not None:
+                self._remove(victim)
+                self._drop(victim, Dropped.OVERFLOW)
+        self._add(job)
+        return True
+
+    def depth(self, key: Hashable) -> int:
+        # waiting and running jobs of the key
+        return len(self._keys.get(key, ()))
+
+    async def close(self, drain=True):
+        # Stops taking jobs and waits for the ones running (and, if draining, the ones waiting)
+        # to finish before stopping the workers
+        self._closed = True
+        if not drain:
+            for jobs in list(self._keys.values()):
+                for job in [job for job in jobs if not job.started]:
+                    self._remove(job)
+                    self._drop(job, Dropped.CLOSED)
+        if self._tasks:
+            await self._idle.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _add(self, job: _Job):
+        jobs = self._keys.get(job.key)
+        if jobs is None:
+            jobs = self._keys[job.key] = collections.deque()
+        jobs.append(job)
+        if job.merge_key is not None:
+            self._merges[job.merge_key] = job
+        self.queued += 1
+        self._idle.clear()
+        if len(jobs) == 1:
+            self._push(job)
+
+    def _push(self, job: _Job):
+        heapq.heappush(self._ready, (job.priority, job.seq, job.key))
+        self._available.release()
+
+    def _replace(self, old: _Job, new: _Job):
+        # in the old job's place, so neither its key's order nor the ready heap changes
+        new.key, new.seq = old.key, old.seq
+        jobs = self._keys[old.key]
+        jobs[jobs.index(old)] = new
+        self._merges[new.merge_key] = new
+        self._drop(old, Dropped.MERGED)
+
+    def _remove(self, job: _Job):
+        # a job that hasn't started - if it was its key's first, the next one becomes ready (the
+        # heap entry left behind is skipped)
+        jobs = self._keys[job.key]
+        first = jobs[0] is job
+        jobs.remove(job)
+        self.queued -= 1
+        if self._merges.get(job.merge_key) is job:
+            del self._merges[job.merge_key]
+        if not jobs:
+            del self._keys[job.key]
+        elif first:
+            self._push(jobs[0])
+        self._check_idle()
+
+    def _oldest(self, priority: int) -> Optional[_Job]:
+        oldest = None
+        for jobs in self._keys.values():
+            for job in jobs:
+                if not job.started and job.priority == priority:
+                    if oldest is None or job.seq < oldest.seq:
+                        oldest = job
+                    break  # the rest of the key's jobs are newer
+        return oldest
+
+    def _drop(self, job: _Job, reason: str):
+        self.dropped[reason] += 1
+        if job.on_drop is None:
+            logging.warning(f"Dropped job for {job.key} ({reason})")
+            return
+        try:
+            job.on_drop(reason)
+        except Exception:
+            logging.exception(f"Failed to handle dropped job for {job.key}")
+
+    def _check_idle(self):
+        if not self._keys:
+            self._idle.set()
+
+    async def _work(self):
+        while True:
+            await self._available.acquire()
+            _, seq, key = heapq.heappop(self._ready)
+            jobs = self._keys.get(key)
+            if not jobs or jobs[0].seq != seq or jobs[0].started:
+                continue  # removed or replaced since
+            job = jobs[0]
+            job.started = True
+            self.queued -= 1
+            self.running += 1
+            if self._merges.get(job.merge_key) is job:
+                del self._merges[job.merge_key]
+            try:
+                await job.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception(f"Job for {key} failed")
+            finally:
+                self.running -= 1
+                jobs.popleft()
+                if jobs:
+                    self._push(jobs[0])
+                else:
+                    del self._keys[key]
+                    self._check_idle()
@@ -8,15 +8,23 @@ from .errors import (CloseTradeException, ModifyRiskException,
 BINANCE_USDT_FUTURES = -1001271281417
 
 
+_NUMBER = re.compile(r"\.?\d+(?:\.\d+)?")
+_SIGNAL_PREFIXES = ("long ", "short ", "l ", "s ")
+
+
 def extract_optional_number(line: str):
-    res = re.search(r"(\.?\d+(?:\.\d+)?)", line.replace(",", "."))
-    return float(res[1]) if res else None
+    if line.isdecimal():  # most numbers, without the regex
+        return float(line)
+    res = _NUMBER.search(line.replace(",", ".") if "," in line else line)
+    return float(res[0]) if res else None
 
 
 class Signal:
     MIN_PRECISION = 6
     DEFAULT_RISK = 0.01
     DEFAULT_RISK_FACTOR = 1
+    DEFAULT_LEV = 10
+    MIN_LEV = 1
 
     def __init__(self, asset, quote, sl, is_long=True, stop_percent=False, entry=None,
                  targets=[], leverage=None, risk_factor=None, soft_sl=False,
@@ -36,6 +44,7 @@ class Signal:
         self.tag = self.asset
         self.fraction = 0
         self.is_market_order = entry is None
+        self.trace = None  # set by whoever times the signal's way to its order
 
     @property
     def risk_factor(self):
@@ -59,6 +68,10 @@ class Signal:
             sig.risk_factor = sig.risk_factor + risk_factor  # maintain per-signal bias
         return sig
 
+    @property
+    def coin(self):
+        return self.asset
+
     @property
     def symbol(self):
         return f"{self.coin}{self.quote}"
@@ -71,9 +84,12 @@ class Signal:
         self.sl *= self.factor(self.sl, price)
         if self.percent_targets:
             diff = self.entry - self.sl
-            self.targets = list(map(lambda i: self.entry + diff * i / 100, self.targets))
-        self.targets = list(
-            map(lambda i: round(i * self.factor(i, price), 10), self.targets))
+            self.targets = [self.entry + diff * i / 100 for i in self.targets]
+        self.targets = [round(i * self.factor(i, price), 10) for i in self.targets]
+        self.size(price)
+
+    def size(self, price):
+        # once the prices are corrected
         self.wait_entry = (self.is_long and price < self.entry) or (
             self.is_short and price > self.entry)
         percent = self.entry / self.sl
@@ -83,17 +99,7 @@ class Signal:
     def factor(self, sig_p, mark_p):
         # Fix for prices which are human-readable at times when we'll find lack of
         # some precision (i.e., 0.000578 is given as 0.578
-        minima = math.inf
-        factor = 1
-        for i in range(self.MIN_PRECISION * 2):
-            f = 1 / (10 ** (self.MIN_PRECISION - i))
-            dist = abs(sig_p * f - mark_p) / mark_p
-            if dist < minima:
-                minima = dist
-                factor = f
-            else:
-                break
-        return factor
+        return PRECISION_FACTORS[precision_index(sig_p, mark_p)]
 
     def __repr__(self):
         return (f"{self.tag}: {self.coin} x{self.leverage} "
@@ -101,69 +107,108 @@ class Signal:
                 f"e: {self.entry}, sl: {self.sl}, targets: {self.targets})")
 
 
+# Powers of ten a signal's price may be scaled by, 1e-6 to 1e5, to bring it closest to the mark
+PRECISION_FACTORS = tuple(1 / (10 ** (Signal.MIN_PRECISION - i))
+                          for i in range(Signal.MIN_PRECISION * 2))
+# The distance to the mark is V-shaped over the powers, with 10^e and 10^(e+1) equally far at
+# mark/price = 5.5 * 10^e, so log10(mark/price) + log10(10 / 5.5) floors to the closest
+PRECISION_CROSSOVER = math.log10(10 / 5.5)
+PRECISION_MARGIN = 1e-9  # of the log, away from a crossover, beyond which rounding can't matter
+
+
+def precision_index(price: float, mark: float) -> int:
+    # index of the closest factor - the closed form, which is only checked against its neighbours
+    # close to a crossover, as the log may round across it (ties go to the smaller factor)
+    last = len(PRECISION_FACTORS) - 1
+    if price <= 0:
+        return 0  # no factor moves it closer
+    exp = math.log10(mark / price) + PRECISION_CROSSOVER
+    guess = math.floor(exp) + Signal.MIN_PRECISION
+    if 0 < guess < last and PRECISION_MARGIN < exp % 1 < 1 - PRECISION_MARGIN:
+        return guess
+    if abs(price * PRECISION_FACTORS[1] - mark) == mark:
+        return 0  # too small for the first factors to tell apart
+    guess = min(max(guess, 0), last)
+    best, minima = guess, math.inf
+    for i in range(max(guess - 1, 0), min(guess + 2, last + 1)):
+        dist = abs(price * PRECISION_FACTORS[i] - mark) / mark
+        if dist < minima:
+            best, minima = i, dist
+    return best
+
+
+# Commands are read off their space-separated tokens in one pass, with a cursor instead of
+# popping from the front:
+#
+#   (long|l|short|s) <coin> [entry] [sl <price>] [soft] [tp <price|pct%>...] [risk <factor>]
+#   change <tag> (r (+|-)<pct>% [@ <price>] | sl <price> | tp <price|pct%>...)
+#   ... (cancel|close) <tag> ...
+#
+# Anything else fails the same assertion as an incomplete command, before being split.
 class FuturesParser:
     def __init__(self, quote):
         self.quote = quote
 
     def parse(self, text: str) -> Signal:
         if "cancel " in text or "close " in text:
-            raise CloseTradeException(tag=text.split(" ")[1].lower())
+            raise CloseTradeException(tag=text.split(" ", 2)[1].lower())
 
-        sig, tag, parts = [None] * 3
-        if (text.startswith("long ") or text.startswith("short ") or
-                text.startswith("l ") or text.startswith("s ")):
+        if text.startswith(_SIGNAL_PREFIXES):
             parts = text.split(" ")
-            is_long = parts.pop(0) in ("long", "l")
-            sig = Signal(parts.pop(0), self.quote, 0, is_long=is_long)
-            res = extract_optional_number(parts[0])
+            sig, tag, i = Signal(parts[1], self.quote, 0, is_long=parts[0] in ("long", "l")), None, 2
+            res = extract_optional_number(parts[2])
             if res:
-                parts.pop(0)
                 sig.entry = res
-        if text.startswith("change"):
-            parts = text.split(" ")[1:]
-            tag = parts.pop(0)
-        assert parts
-        if parts[0] == "r":
-            parts.pop(0)
-            assert (parts[0].startswith("+") or parts[0].startswith("-")) \
-                and parts[0].endswith("%")
-            risk = float(parts.pop(0)[:-1])
+                i = 3
+        elif text.startswith("change"):
+            parts = text.split(" ")
+            sig, tag, i = None, parts[1], 2
+        else:
+            parts, i = (), 0
+        n = len(parts)
+        assert i < n
+        token = parts[i]
+        if token == "r":
+            token = parts[i + 1]
+            assert token.startswith(("+", "-")) and token.endswith("%")
+            risk = float(token[:-1])
+            i += 2
             entry = None
-            if parts:
-                assert parts.pop(0) == "@"
-                entry = extract_optional_number(parts.pop(0))
+            if i < n:
+                assert parts[i] == "@"
+                entry = extract_optional_number(parts[i + 1])
             raise ModifyRiskException(tag, risk, entry)
-        if parts[0] == "sl":
-            parts.pop(0)
-            res = extract_optional_number(parts.pop(0))
+        if token == "sl":
+            res = extract_optional_number(parts[i + 1])
             if sig is None:
                 raise MoveStopLossException(tag, res)
             assert res
             sig.sl = res
-        if parts and parts[0] == "soft":
+            i += 2
+        if i < n and parts[i] == "soft":
             sig.soft_sl = True
-            parts.pop(0)
-        if parts and parts[0] == "tp":
-            parts.pop(0)
+            i += 1
+        if i < n and parts[i] == "tp":
+            i += 1
             targets = []
             is_percent = False
-            while parts:
-                res = extract_optional_number(parts[0])
+            while i < n:
+                token = parts[i]
+                res = extract_optional_number(token)
                 if not res:
                     break
-                if parts[0].endswith("%") and not is_percent:
+                if token.endswith("%"):
                     is_percent = True
-                parts.pop(0)
                 targets.append(res)
-            targets = sorted(targets)
+                i += 1
+            targets.sort()
             if sig is None:
                 raise ModifyTargetsException(tag, targets, is_percent=is_percent)
             assert targets
             sig.targets = targets
             sig.percent_targets = is_percent
-        if len(parts) > 1 and parts[0] == "risk":
-            parts.pop(0)
-            sig.risk_factor = float(parts.pop(0))
+        if n - i > 1 and parts[i] == "risk":
+            sig.risk_factor = float(parts[i + 1])
         return sig
 
 
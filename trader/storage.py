@@ -1,8 +1,120 @@
 import asyncio
 import json
-from typing import List, Optional
+import os
+import sqlite3
+from collections import defaultdict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
 
-from .logger import DEFAULT_LOGGER as logging
+from .logger import get_logger
+
+logging = get_logger(__name__)
+
+
+def tag_keys(tag: str):
+    # Tags look like "<channel tag>-<count>", and closing by either the full tag or
+    # just its prefix should find the position.
+    tag = tag.lower()
+    return {tag, tag.split("-")[0]}
+
+
+# Order state keyed by client order ID, with indexes for the lookups done on every command and
+# fill event. Parents (positions) carry "tag" and "sym" and children carry "parent" - those
+# are indexed when an order is added and never change afterwards.
+# NOTE: This wraps the given dict (instead of copying it), so that the persisted state
+# still sees every change. With `track_changes`, orders added, replaced or removed are
+# remembered until taken, for them to be journaled.
+class OrderStore(MutableMapping):
+    def __init__(self, orders: Optional[dict] = None, track_changes=False):
+        self._orders = {} if orders is None else orders
+        self._changed = set() if track_changes else None
+        self._tags = defaultdict(set)  # lowercase tag (and tag prefix) -> parent IDs
+        self._symbols = defaultdict(set)  # symbol -> parent IDs
+        self._children = defaultdict(set)  # parent ID -> child IDs
+        for order_id, order in self._orders.items():
+            self._index(order_id, order)
+
+    def _index(self, order_id: str, order: dict):
+        parent = order.get("parent")
+        if parent is not None:
+            self._children[parent].add(order_id)
+            return
+        if order.get("tag"):
+            for key in tag_keys(order["tag"]):
+                self._tags[key].add(order_id)
+        if order.get("sym"):
+            self._symbols[order["sym"]].add(order_id)
+
+    def _unindex(self, order_id: str, order: dict):
+        parent = order.get("parent")
+        if parent is not None:
+            _discard(self._children, parent, order_id)
+            return
+        if order.get("tag"):
+            for key in tag_keys(order["tag"]):
+                _discard(self._tags, key, order_id)
+        if order.get("sym"):
+            _discard(self._symbols, order["sym"], order_id)
+
+    def __getitem__(self, order_id: str) -> dict:
+        return self._orders[order_id]
+
+    def __setitem__(self, order_id: str, order: dict):
+        old = self._orders.get(order_id)
+        if old is not None:
+            self._unindex(order_id, old)
+        self._orders[order_id] = order
+        self._index(order_id, order)
+        if self._changed is not None:
+            self._changed.add(order_id)
+
+    def __delitem__(self, order_id: str):
+        order = self._orders.pop(order_id)
+        self._unindex(order_id, order)
+        if self._changed is not None:
+            self._changed.add(order_id)
+
+    def __iter__(self):
+        return iter(self._orders)
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def find(self, tag: str, symbol: Optional[str] = None) -> List[str]:
+        ids = self._tags.get(tag.lower(), ())
+        if symbol is not None:
+            ids = self._symbols.get(symbol, set()).intersection(ids)
+        return list(ids)
+
+    def positions(self, symbol: str) -> List[str]:
+        return list(self._symbols.get(symbol, ()))
+
+    def children(self, parent_id: str) -> List[str]:
+        return list(self._children.get(parent_id, ()))
+
+    def take_changed(self) -> List[str]:
+        if not self._changed:
+            return []
+        changed, self._changed = list(self._changed), set()
+        return changed
+
+    def pop_position(self, parent_id: str) -> Optional[dict]:
+        for oid in self.children(parent_id):
+            self.pop(oid, None)
+        return self.pop(parent_id, None)
+
+
+def _discard(index: Dict[str, set], key: str, order_id: str):
+    ids = index.get(key)
+    if ids is None:
+        return
+    ids.discard(order_id)
+    if not ids:
+        index.pop(key)
 
 
 class Position:
@@ -14,6 +126,8 @@ class Position:
         self.sl = sl
         self.target_orders = []
         self.sl_order = None
+        self.order_id = None
+        self.tag = None
 
 
 class Storage:
@@ -23,16 +137,20 @@ class Storage:
     def __exit__(self, exc_type, exc, tb):
         raise NotImplementedError
 
-    async def register_position(self, order_id: str, symbol: str, price: float, quantity: float,
-                                targets: List[float], sl: float, is_soft: bool = False):
+    async def init(self):
         raise NotImplementedError
 
-    async def 
+    async def register_position(self, order_id: str, symbol: str, price: float, quantity: float,
+                                targets: List[float], sl: float, tag: str, is_soft: bool = False):
+        raise NotImplementedError
 
     async def get_position(self, tag: str) -> Optional[Position]:
         raise NotImplementedError
 
-    async def set_sl_order(self, parent_id: str, tag: str):
+    async def get_positions(self, tag: str, symbol: Optional[str] = None) -> List[Position]:
+        raise NotImplementedError
+
+    async def set_sl_order(self, parent_id: str, order_id: str):
         raise NotImplementedError
 
     async def set_position_entry(self, tag: str, price: float):
@@ -45,10 +163,21 @@ class Storage:
         raise NotImplementedError
 
 
+def _position(order_id: str, order: dict) -> Position:
+    pos = Position(order["sym"], order["ent"], order["sl"], order["qty"])
+    pos.order_id = order_id
+    pos.tag = order["tag"]
+    pos.targets = order["tgt"]
+    pos.target_orders = order["t_ord"]
+    pos.sl_order = order.get("s_ord")
+    return pos
+
+
 class PersistentDict(Storage):
     def __init__(self, path: str):
         self._lock = asyncio.Lock()
         self._state = {}
+        self.orders = OrderStore()
         self.path = path
 
     def __enter__(self):
@@ -59,3 +188,430 @@ class PersistentDict(Storage):
     def __exit__(self, exc_type, exc_value, tb):
         with open(self.path, "w") as fd:
             json.dump(self._state, fd)
+
+    @property
+    def state(self) -> dict:
+        # everything persisted, orders included
+        return self._state
+
+    async def init(self):
+        self.orders = OrderStore(self._state.setdefault("orders", {}), track_changes=True)
+        logging.info(f"Loaded {len(self.orders)} order(s) from {self.path}")
+
+    async def save(self, *order_ids: Optional[str]):
+        # For changes made to the orders directly, instead of through the methods here - the
+        # ones given (changed in place) are saved along with those added or removed since
+        await self._commit(*order_ids)
+
+    async def save_state(self, section: str, keys: Iterable[str]):
+        # the same for keys of another dict in the state (e.g. recently seen signals)
+        pass
+
+    def _find(self, tag: str) -> Optional[str]:
+        # exact tags are unique, so this won't match other positions sharing the prefix
+        for order_id in self.orders.find(tag):
+            if self.orders[order_id]["tag"].lower() == tag.lower():
+                return order_id
+        return None
+
+    async def register_position(self, order_id: str, symbol: str, price: float, quantity: float,
+                                targets: List[float], sl: float, tag: str, is_soft: bool = False):
+        self.orders[order_id] = {
+            "sym": symbol,
+            "ent": price,
+            "qty": quantity,
+            "tgt": targets,
+            "sl": sl,
+            "soft": is_soft,
+            "tag": tag,
+            "t_ord": [],
+            "s_ord": None,
+        }
+        await self._commit(order_id)
+
+    async def get_position(self, tag: str) -> Optional[Position]:
+        order_id = self._find(tag)
+        if order_id is None:
+            return None
+        return _position(order_id, self.orders[order_id])
+
+    async def get_positions(self, tag: str, symbol: Optional[str] = None) -> List[Position]:
+        return [_position(oid, self.orders[oid]) for oid in self.orders.find(tag, symbol)]
+
+    async def set_sl_order(self, parent_id: str, order_id: str):
+        parent = self.orders[parent_id]
+        old = parent.get("s_ord")
+        if old is not None:
+            self.orders.pop(old, None)
+        self.orders[order_id] = {"parent": parent_id, "filled": False}
+        parent["s_ord"] = order_id
+        await self._commit(parent_id, order_id, old)
+
+    async def set_position_entry(self, tag: str, price: float):
+        await self._update(tag, "ent", price)
+
+    async def set_targets(self, tag: str, targets: List[float]):
+        await self._update(tag, "tgt", targets)
+
+    async def set_sl(self, tag: str, sl: float):
+        await self._update(tag, "sl", sl)
+
+    async def _update(self, tag: str, key: str, value):
+        order_id = self._find(tag)
+        if order_id is None:
+            logging.warning(f"No position found for tag {tag}")
+            return
+        self.orders[order_id][key] = value
+        await self._commit(order_id)
+
+    async def _commit(self, *order_ids: Optional[str]):
+        # Called with the orders changed by every update (removed ones included). Everything's
+        # written at exit, so there's nothing to do here.
+        self.orders.take_changed()
+
+
+JOURNAL_SNAPSHOT_EVERY = 50000  # compact the journal into a snapshot after this many records
+
+
+# Orders are kept in memory like `PersistentDict`, but every change is appended to a journal
+# (`<path>.journal`) and fsync'd before the update returns, so a killed process loses nothing.
+# Updates made while a write is in progress are written (and fsync'd) together in the next
+# one. Once the journal grows large enough, it's compacted into a snapshot at `<path>`.
+#
+# NOTE: Journal records are `[seq, order_id, order]` lines (`order` is null for removals), or
+# `[seq, [section, key], value]` for the rest of the state. Snapshots hold the whole state and
+# the last sequence number they include, so records left behind by a crash between writing the
+# snapshot and truncating the journal are skipped on replay.
+class JournaledStorage(PersistentDict):
+    def __init__(self, path: str, snapshot_every: int = JOURNAL_SNAPSHOT_EVERY):
+        super().__init__(path)
+        self.journal_path = path + ".journal"
+        self.snapshot_every = snapshot_every
+        self._seq = 0
+        self._journaled = 0  # records in the journal since the last snapshot
+        self._pending = []  # (record, future) waiting to be written
+        self._flusher = None
+        self._journal = None
+        # single thread, so that writes (and snapshots) happen in order
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __enter__(self):
+        self._state = {"orders": {}}
+        self._seq = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r") as fd:
+                self._state = json.load(fd)
+            self._seq = self._state.get("seq", 0)
+        self._journaled = self._replay()
+        self._journal = open(self.journal_path, "a")
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        # Everything's in memory, so one last snapshot covers whatever's still pending. It goes
+        # through the executor, to be written after a journal write still in flight.
+        self._executor.submit(self._write_snapshot, self._dump()).result()
+        self._journal.close()
+        self._executor.shutdown()
+        for _, fut in self._pending:
+            if not fut.done():
+                fut.set_result(None)
+        self._pending = []
+
+    def _replay(self) -> int:
+        if not os.path.exists(self.journal_path):
+            return 0
+        orders = self._state.setdefault("orders", {})
+        count, offset = 0, 0
+        with open(self.journal_path, "rb+") as fd:
+            for line in fd:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError
+                    seq, order_id, order = json.loads(line)
+                except ValueError:
+                    # torn write at the end, which was never acknowledged - drop it so that
+                    # new records aren't appended after it
+                    logging.warning(f"Dropping incomplete record at the end of {self.journal_path}")
+                    fd.truncate(offset)
+                    break
+                count += 1
+                offset += len(line)
+                if seq <= self._seq:
+                    continue
+                self._seq = seq
+                if isinstance(order_id, list):  # another section of the state
+                    section, order_id = order_id
+                    target = self._state.setdefault(section, {})
+                else:
+                    target = orders
+                if order is None:
+                    target.pop(order_id, None)
+                else:
+                    target[order_id] = order
+        logging.info(f"Replayed {count} record(s) from {self.journal_path}")
+        return count
+
+    async def _commit(self, *order_ids: Optional[str]):
+        order_ids = set(order_ids).union(self.orders.take_changed())
+        order_ids.discard(None)
+        await self._write([(order_id, self.orders.get(order_id)) for order_id in sorted(order_ids)])
+
+    async def save_state(self, section: str, keys: Iterable[str]):
+        values = self._state.get(section, {})
+        await self._write([([section, key], values.get(key)) for key in keys])
+
+    async def _write(self, records: list):
+        if not records:
+            return
+        loop = asyncio.get_event_loop()
+        futures = []
+        for key, value in records:
+            self._seq += 1
+            record = json.dumps([self._seq, key, value]) + "\n"
+            fut = loop.create_future()
+            self._pending.append((record, fut))
+            futures.append(fut)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush())
+        await asyncio.gather(*futures)
+
+    async def _flush(self):
+        loop = asyncio.get_event_loop()
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                if self._journaled + len(batch) > self.snapshot_every:
+                    # memory already has every record assigned so far (including this batch)
+                    await loop.run_in_executor(self._executor, self._write_snapshot, self._dump())
+                else:
+                    await loop.run_in_executor(
+                        self._executor, self._append, "".join(r for r, _ in batch))
+                    self._journaled += len(batch)
+            except Exception as err:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(err)
+                continue
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_result(None)
+
+    def _dump(self) -> str:
+        return json.dumps(dict(self._state, seq=self._seq))
+
+    def _append(self, data: str):
+        self._journal.write(data)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _write_snapshot(self, data: str):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fd:
+            fd.write(data)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_path, self.path)
+        _fsync_dir(self.path)
+        self._journal.truncate(0)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journaled = 0
+
+
+def _fsync_dir(path: str):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    order_id TEXT PRIMARY KEY,
+    sym TEXT NOT NULL,
+    ent REAL,
+    qty REAL,
+    tgt TEXT NOT NULL,
+    sl REAL,
+    soft INTEGER NOT NULL DEFAULT 0,
+    tag TEXT NOT NULL,
+    tag_key TEXT NOT NULL,
+    tag_prefix TEXT NOT NULL,
+    t_ord TEXT NOT NULL DEFAULT '[]',
+    s_ord TEXT
+);
+CREATE INDEX IF NOT EXISTS positions_tag ON positions (tag_key);
+CREATE INDEX IF NOT EXISTS positions_tag_prefix ON positions (tag_prefix);
+CREATE INDEX IF NOT EXISTS positions_sym ON positions (sym);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    filled INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS orders_parent ON orders (parent);
+"""
+
+POSITION_COLUMNS = "order_id, sym, ent, qty, tgt, sl, soft, tag, t_ord, s_ord"
+
+
+# Positions live in a SQLite database (WAL mode) instead of memory, so that neither memory nor
+# startup time grows with the number of positions kept around.
+# All queries run on a single executor thread which owns the connection. Queries issued while
+# another batch is running are run together in the next batch, in a single transaction (each
+# query gets its own savepoint, so a failing query doesn't roll back the others). Callers are
+# resumed only after their batch has been committed.
+class SqliteStorage(Storage):
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._pending = []  # (query, args, future) waiting to be run
+        self._flusher = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __enter__(self):
+        self._executor.submit(self._connect).result()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        # the loop's gone by now, so run whatever's left right here
+        batch, self._pending = self._pending, []
+        if batch:
+            self._executor.submit(self._run_batch, [(q, a) for q, a, _ in batch]).result()
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown()
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    async def init(self):
+        count = await self._run(_count_positions)
+        logging.info(f"Loaded {count} position(s) from {self.path}")
+
+    async def _run(self, query, *args):
+        fut = asyncio.get_event_loop().create_future()
+        self._pending.append((query, args, fut))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush())
+        return await fut
+
+    async def _flush(self):
+        loop = asyncio.get_event_loop()
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self._run_batch, [(q, a) for q, a, _ in batch])
+            except Exception as err:
+                results = [(None, err)] * len(batch)
+            for (_, _, fut), (result, err) in zip(batch, results):
+                if fut.done():
+                    continue
+                if err is not None:
+                    fut.set_exception(err)
+                else:
+                    fut.set_result(result)
+
+    def _run_batch(self, batch) -> list:
+        results = []
+        cursor = self._conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            for query, args in batch:
+                cursor.execute("SAVEPOINT query")
+                try:
+                    results.append((query(cursor, *args), None))
+                except Exception as err:
+                    cursor.execute("ROLLBACK TO query")
+                    results.append((None, err))
+                cursor.execute("RELEASE query")
+            cursor.execute("COMMIT")
+        except Exception:
+            if self._conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        return results
+
+    async def register_position(self, order_id: str, symbol: str, price: float, quantity: float,
+                                targets: List[float], sl: float, tag: str, is_soft: bool = False):
+        await self._run(_insert_position, order_id, symbol, price, quantity, targets, sl, tag,
+                        is_soft)
+
+    async def get_position(self, tag: str) -> Optional[Position]:
+        return await self._run(_select_position, tag)
+
+    async def get_positions(self, tag: str, symbol: Optional[str] = None) -> List[Position]:
+        return await self._run(_select_positions, tag, symbol)
+
+    async def set_sl_order(self, parent_id: str, order_id: str):
+        await self._run(_replace_sl_order, parent_id, order_id)
+
+    async def set_position_entry(self, tag: str, price: float):
+        await self._update(tag, "ent", price)
+
+    async def set_targets(self, tag: str, targets: List[float]):
+        await self._update(tag, "tgt", json.dumps(targets))
+
+    async def set_sl(self, tag: str, sl: float):
+        await self._update(tag, "sl", sl)
+
+    async def _update(self, tag: str, column: str, value):
+        if not await self._run(_update_position, tag, column, value):
+            logging.warning(f"No position found for tag {tag}")
+
+
+def _count_positions(cursor) -> int:
+    return cursor.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+
+def _insert_position(cursor, order_id, symbol, price, quantity, targets, sl, tag, is_soft):
+    tag_key = tag.lower()
+    cursor.execute(
+        "INSERT OR REPLACE INTO positions "
+        "(order_id, sym, ent, qty, tgt, sl, soft, tag, tag_key, tag_prefix) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (order_id, symbol, price, quantity, json.dumps(targets), sl, int(is_soft), tag, tag_key,
+         tag_key.split("-")[0]))
+
+
+def _row_position(row) -> Position:
+    order_id, sym, ent, qty, tgt, sl, soft, tag, t_ord, s_ord = row
+    return _position(order_id, {"sym": sym, "ent": ent, "qty": qty, "tgt": json.loads(tgt),
+                                "sl": sl, "soft": bool(soft), "tag": tag,
+                                "t_ord": json.loads(t_ord), "s_ord": s_ord})
+
+
+def _select_position(cursor, tag: str) -> Optional[Position]:
+    row = cursor.execute(f"SELECT {POSITION_COLUMNS} FROM positions WHERE tag_key = ?",
+                         (tag.lower(),)).fetchone()
+    return None if row is None else _row_position(row)
+
+
+def _select_positions(cursor, tag: str, symbol: Optional[str]) -> List[Position]:
+    # same matches as `OrderStore.find` - either the full tag or its prefix
+    query = f"SELECT {POSITION_COLUMNS} FROM positions WHERE (tag_key = ? OR tag_prefix = ?)"
+    args = [tag.lower(), tag.lower()]
+    if symbol is not None:
+        query += " AND sym = ?"
+        args.append(symbol)
+    return [_row_position(row) for row in cursor.execute(query, args)]
+
+
+def _replace_sl_order(cursor, parent_id: str, order_id: str):
+    row = cursor.execute("SELECT s_ord FROM positions WHERE order_id = ?", (parent_id,)).fetchone()
+    if row is None:
+        raise KeyError(parent_id)
+    if row[0] is not None:
+        cursor.execute("DELETE FROM orders WHERE order_id = ?", (row[0],))
+    cursor.execute("INSERT OR REPLACE INTO orders (order_id, parent, filled) VALUES (?, ?, 0)",
+                   (order_id, parent_id))
+    cursor.execute("UPDATE positions SET s_ord = ? WHERE order_id = ?", (order_id, parent_id))
+
+
+def _update_position(cursor, tag: str, column: str, value) -> bool:
+    # column names come from `SqliteStorage` methods, never from callers
+    cursor.execute(f"UPDATE positions SET {column} = ? WHERE tag_key = ?", (value, tag.lower()))
+    return cursor.rowcount > 0
@@ -1,17 +1,29 @@
 import asyncio
+import time
 
+from cachetools import LRUCache
 from telethon import TelegramClient, events
 from telethon.tl.custom import Message
 
-from . import FuturesTrader
+from . import FuturesTrader, messages
 from .errors import CloseTradeException, MoveStopLossException, ModifyTargetsException
-from .logger import DEFAULT_LOGGER as logging
-from .signal import CHANNELS, Signal, RESULTS_CHANNEL
+from .logger import get_logger
+from .metrics import TRACER, serve_metrics
+from .signal import CHANNELS, Signal
+
+logging = get_logger(__name__)
+
+LATENCY_SUMMARY_INTERVAL = 24 * 60 * 60  # post latency percentiles to results this often
+EDIT_INDEX_SIZE = 500  # recent signal messages whose edits amend their trades
 
 
 class TeleTrader(TelegramClient):
-    def __init__(self, api_id, api_hash, session=None, state={}, loop=None):
-        self.state = state
+    def __init__(self, api_id, api_hash, session=None, state={}, loop=None, metrics_port=None,
+                 results_channel=None, storage=None):
+        self.state = state if storage is None else storage.state
+        self.storage = storage
+        self.results_channel = results_channel  # where results are posted and commands are read
+        self.metrics_port = metrics_port
         self.trader = FuturesTrader()
         self.trader.results_handler = self._post_result
         super().__init__(session, api_id, api_hash, loop=loop)
@@ -21,6 +33,7 @@ class TeleTrader(TelegramClient):
         if not self.state.get("config"):
             self.state["config"] = {}
         self.lock = asyncio.Lock()
+        self.posts = LRUCache(maxsize=EDIT_INDEX_SIZE)  # (chat ID, message ID) -> signal tag
 
     async def init(self, api_key, api_secret):
         logging.info("Initializing telegram client")
@@ -30,24 +43,45 @@ class TeleTrader(TelegramClient):
             logging.error("User is not authorized")
         await self.start()
         logging.info("Initializing binance trader")
-        await self.trader.init(api_key, api_secret, state=self.state, loop=self.loop)
+        await self.trader.init(api_key, api_secret, state=self.state, loop=self.loop,
+                                storage=self.storage)
 
     async def run(self):
         self.add_event_handler(self._handler, events.NewMessage)
+        self.add_event_handler(self._edit_handler, events.MessageEdited)
+        if self.metrics_port is not None:
+            await serve_metrics(self.metrics_port,
+                                locks={"coin": self.trader.clocks, "position": self.trader.plocks})
+        asyncio.ensure_future(self._post_latency_summary())
         try:
             await self.run_until_disconnected()
         finally:
             await self.disconnect()
+            await self.trader.close()  # lets queued signals and closes finish
 
     async def _post_result(self, message: str):
+        if self.results_channel is None:
+            logging.info(f"Result: {message}")
+            return
         try:
-            await self.send_message(RESULTS_CHANNEL, message)
+            await self.send_message(self.results_channel, message)
         except Exception:
             logging.exception("Failed to send result")
 
+    async def _post_latency_summary(self):
+        posted = 0
+        while True:
+            await asyncio.sleep(LATENCY_SUMMARY_INTERVAL)
+            total = TRACER.histograms.get("total")
+            if total is None or total.count == posted:
+                continue
+            posted = total.count
+            await self._post_result(messages.Message.latency(TRACER.summary()))
+
     async def _handler(self, event: Message):
+        received = time.perf_counter()
         sig, tag = None, None
-        if event.chat_id == RESULTS_CHANNEL:
+        if event.chat_id == self.results_channel:
             try:
                 await self._handle_command(event.text)
             except AssertionError:
@@ -56,30 +90,29 @@ class TeleTrader(TelegramClient):
                 logging.exception(f"Ignoring command due to parse failure: {err}")
         try:
             if CHANNELS.get(event.chat_id):
-                tag = CHANNELS[event.chat_id].__name__
+                tag = type(CHANNELS[event.chat_id]).__name__
             async with self.lock:
                 sig = Signal.parse(event.chat_id, event.text,
                                    risk_factor=self.state["config"].get("rf"))
-        # except MoveStopLossException as err:
-        #     pass
-        # except ModifyTargetsException as err:
-        #     pass
+        except MoveStopLossException as err:
+            coin = await self._reply_coin(event, tag)
+            if coin is not False:
+                logging.info(f"Received message for moving SL of {coin if coin else 'all'} "
+                             f"trades from {err.tag}: {event.text}", color="cyan")
+                self.trader.queue_amend(err.tag, coin, sl=err.price)
+        except ModifyTargetsException as err:
+            coin = await self._reply_coin(event, tag)
+            if coin is not False:
+                logging.info(f"Received message for changing TPs of {coin if coin else 'all'} "
+                             f"trades from {err.tag}: {event.text}", color="cyan")
+                self.trader.queue_amend(err.tag, coin, targets=err.targets, is_percent=err.is_percent)
         except CloseTradeException as err:
-            coin = err.coin
-            reply = await event.get_reply_message()
-            if reply is not None:
-                try:
-                    parent = Signal.parse(event.chat_id, reply.text)
-                    coin = parent.coin
-                except AssertionError:
-                    logging.info(f"Ignoring previous message from {tag} as requirements are not met", color="white")
-                    return
-                except Exception:
-                    logging.exception(f"Unable to parse previous message as signal:\n{reply.text}")
-                    return
+            coin = await self._reply_coin(event, tag, err.coin)
+            if coin is False:
+                return
             logging.info(f"Received message for closing {coin if coin else 'all'} "
                          f"trades from {err.tag}: {event.text}", color="red")
-            await self.trader.close_trades(err.tag, coin)
+            self.trader.queue_close(err.tag, coin)
         except AssertionError:
             logging.info(f"Ignoring message from {tag} as requirements are not met:\n{event.text}", color="white")
         except Exception:
@@ -88,8 +121,44 @@ class TeleTrader(TelegramClient):
         if sig is None:
             return
 
+        sig.trace = TRACER.start(tag or sig.tag, at=received)
+        TRACER.mark(sig.trace, "parse")
         logging.info(f"Received signal {sig}", color="cyan")
-        await self.trader.queue_signal(sig)
+        if await self.trader.queue_signal(sig):
+            self.posts[(event.chat_id, event.id)] = sig.tag
+
+    async def _edit_handler(self, event: Message):
+        # Only edits of signals which were traded are followed, and only their SL and TPs - the
+        # trader works out what changed against the live position
+        tag = self.posts.get((event.chat_id, event.id))
+        if tag is None:
+            return
+        try:
+            sig = Signal.parse(event.chat_id, event.text)
+        except AssertionError:
+            logging.info(f"Ignoring edit of {tag} as requirements are not met:\n{event.text}", color="white")
+            return
+        except Exception:
+            logging.exception(f"Ignoring edit of {tag} due to parse failure:\n{event.text}")
+            return
+        if sig is None:
+            return
+        logging.info(f"Received edit of signal {tag}: {sig}", color="cyan")
+        self.trader.queue_amend(tag, sig.coin, sl=sig.sl, targets=sig.targets, is_percent=sig.percent_targets)
+
+    async def _reply_coin(self, event: Message, tag, coin=None):
+        # The coin of the signal a command replies to, if it does (`coin` otherwise) - False if
+        # that can't be parsed
+        reply = await event.get_reply_message()
+        if reply is None:
+            return coin
+        try:
+            return Signal.parse(event.chat_id, reply.text).coin
+        except AssertionError:
+            logging.info(f"Ignoring previous message from {tag} as requirements are not met", color="white")
+        except Exception:
+            logging.exception(f"Unable to parse previous message as signal:\n{reply.text}")
+        return False
 
     async def _handle_command(self, text: str):
         assert text.startswith("set ")
@@ -104,6 +173,7 @@ class TeleTrader(TelegramClient):
                     else:
                         self.state["config"].pop("rf", None)
                         await self._post_result("Risk is now reset to default")
+                    await self._save_config("rf")
             elif args[1] == "rr":
                 rr = float(args[2])
                 async with self.lock:
@@ -113,3 +183,8 @@ class TeleTrader(TelegramClient):
                     else:
                         self.state["config"].pop("rr", None)
                         await self._post_result("RR is now reset to default")
+                    await self._save_config("rr")
+
+    async def _save_config(self, key: str):
+        if self.storage is not None:
+            await self.storage.save_state("config", [key])
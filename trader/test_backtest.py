@@ -0,0 +1,159 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from .backtest import (Backtester, Outcome, PriceSeries, correct_prices, correct_signals,
+                       load_history, summary)
+from .signal import BINANCE_USDT_FUTURES, Signal
+
+START = 1_600_000_000  # secs
+
+
+def write_klines(path: str, symbol: str, closes: list, start=START):
+    # 1s klines, each spanning the previous close and its own
+    with open(os.path.join(path, f"{symbol}-1s-2020-09-13.csv"), "w") as f:
+        f.write("open_time,open,high,low,close,volume,close_time,quote_volume,count,"
+                "taker_buy_volume,taker_buy_quote_volume,ignore\n")
+        prev = closes[0]
+        for i, close in enumerate(closes):
+            ms = (start + i) * 1000
+            f.write(f"{ms},{prev},{max(prev, close)},{min(prev, close)},{close},1,{ms + 999},"
+                    f"1,1,1,1,0\n")
+            prev = close
+
+
+def messages(*texts, step=1):
+    return [(START + i * step, BINANCE_USDT_FUTURES, text) for i, text in enumerate(texts)]
+
+
+class TestPriceSeries(unittest.TestCase):
+    def test_first_touch(self):
+        values = np.array([1.0, 2, 3, 2, 5, 1, 7] * 3000)
+        series = PriceSeries(np.arange(len(values), dtype=float), values, values, values)
+        self.assertEqual(series.first_touch(5, 0, len(values), above=True), 4)
+        self.assertEqual(series.first_touch(7, 0, len(values), above=True), 6)
+        self.assertEqual(series.first_touch(8, 0, len(values), above=True), len(values))
+        self.assertEqual(series.first_touch(1, 1, len(values), above=False), 5)
+        # past the first window
+        self.assertEqual(series.first_touch(7, 5000, len(values), above=True), 5004)
+        self.assertEqual(series.first_touch(7, 0, 6, above=True), 6)
+        self.assertEqual(series.index(START), len(values) - 1)
+        self.assertEqual(series.index(-1), -1)
+
+    def test_loads_aggtrades(self):
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "BTCUSDT-aggTrades-2020-09-13.csv"), "w") as f:
+                f.write("1,100.5,1,1,1,1600000000500,true\n2,99.5,1,2,2,1600000000100,false\n")
+            series = PriceSeries.load([os.path.join(path, "BTCUSDT-aggTrades-2020-09-13.csv")])
+        self.assertEqual(list(series.times), [1600000000.1, 1600000000.5])  # sorted by time
+        self.assertEqual(list(series.high), [99.5, 100.5])
+        self.assertEqual(list(series.low), [99.5, 100.5])
+
+
+class TestCorrection(unittest.TestCase):
+    def test_prices(self):
+        sig = Signal("BTC", "USDT", 1)
+        rng = np.random.default_rng(5)
+        marks = 10 ** rng.uniform(-9, 7, 20000)
+        prices = np.concatenate([marks[:10000] * 10 ** rng.uniform(-14, 14, 10000),
+                                 marks[10000:] / 5.5 * 10.0 ** rng.integers(-8, 9, 10000)])
+        prices[:3] = [0, -2, 1e-20]
+        expected = [price * sig.factor(price, mark) for price, mark in zip(prices, marks)]
+        self.assertEqual(correct_prices(prices, marks).tolist(), expected)
+
+    def test_signals(self):
+        def signals():
+            return [
+                Signal("DYDX", "USDT", 20.4, targets=[75, 150], percent_targets=True),
+                Signal("ATOM", "USDT", 32.73, entry=32.7, targets=[50, 75], is_long=False,
+                       percent_targets=True),
+                Signal("SHIB", "USDT", 0.578, entry=0.6, targets=[0.7, 0.8], leverage=20),
+                Signal("BTC", "USDT", 40.5, entry=41, targets=[43, 42]),
+                Signal("ETH", "USDT", 2900, targets=[]),
+            ]
+
+        marks = [20.573, 34, 0.000612, 41200, 3050]
+        expected = signals()
+        for sig, mark in zip(expected, marks):
+            sig.correct(mark)
+        batch = signals()
+        correct_signals(batch, marks)
+        for sig, other in zip(batch, expected):
+            self.assertEqual((sig.entry, sig.sl, sig.wait_entry, sig.fraction),
+                             (other.entry, other.sl, other.wait_entry, other.fraction))
+            self.assertEqual(len(sig.targets), len(other.targets))
+            for target, other_target in zip(sig.targets, other.targets):
+                self.assertAlmostEqual(target, other_target, places=12)
+
+
+class TestBacktester(unittest.TestCase):
+    def test_sl_to_entry_after_target(self):
+        with tempfile.TemporaryDirectory() as path:
+            write_klines(path, "BTCUSDT", [100, 103, 106, 101, 99, 112])
+            trades = Backtester(path).run(messages("long btc sl 90 tp 105 110"))
+        self.assertEqual(len(trades), 1)
+        trade = trades[0]
+        self.assertEqual(trade.outcome, Outcome.STOPPED)
+        self.assertEqual(trade.entry, 100)
+        self.assertEqual(trade.targets_hit, 1)
+        self.assertAlmostEqual(trade.r, 0.4 * 5 / 10)  # the rest stopped at entry
+        self.assertEqual(trade.closed_at, START + 4)
+
+    def test_all_targets(self):
+        with tempfile.TemporaryDirectory() as path:
+            write_klines(path, "BTCUSDT", [100, 106, 111, 120, 130])
+            trade = Backtester(path).run(messages("long btc sl 90 tp 105 110"))[0]
+        self.assertEqual(trade.outcome, Outcome.OPEN)
+        self.assertEqual(trade.targets_hit, 2)
+        self.assertAlmostEqual(trade.r, 0.4 * 0.5 + 0.4 * 1 + 0.2 * 3)  # the rest marked at 130
+
+    def test_short_limit_entry(self):
+        with tempfile.TemporaryDirectory() as path:
+            write_klines(path, "ETHUSDT", [198, 199, 201, 205, 211, 180])
+            trade = Backtester(path).run(messages("short eth 200 sl 210 tp 190 180"))[0]
+        self.assertEqual(trade.outcome, Outcome.STOPPED)
+        self.assertEqual(trade.filled_at, START + 2)
+        self.assertEqual(trade.targets_hit, 0)
+        self.assertAlmostEqual(trade.r, -1)
+
+    def test_skips_and_expires(self):
+        with tempfile.TemporaryDirectory() as path:
+            write_klines(path, "BTCUSDT", [100, 101, 102, 103])
+            backtester = Backtester(path, expiry=2)
+            trades = backtester.run(messages(
+                "long btc sl 90 tp 101",  # RR 0.1
+                "long btc 95 sl 90 tp 110",  # never comes down to entry
+                "long eth sl 90 tp 110",  # no data
+            ))
+        self.assertEqual([t.outcome for t in trades],
+                         [Outcome.SKIPPED, Outcome.EXPIRED, Outcome.SKIPPED])
+        self.assertEqual(dict(summary(trades))["trades"], 0)
+
+    def test_close_message(self):
+        with tempfile.TemporaryDirectory() as path:
+            write_klines(path, "BTCUSDT", [100, 102, 104, 103, 80])
+            trades = Backtester(path).run(messages("long btc sl 90 tp 120", "close btc", step=2))
+        self.assertEqual(trades[0].outcome, Outcome.CLOSED)
+        self.assertEqual(trades[0].closed_at, START + 2)
+        self.assertAlmostEqual(trades[0].r, 0.4)
+
+
+class TestHistory(unittest.TestCase):
+    def test_load_export(self):
+        export = {"id": 1271281417, "messages": [
+            {"id": 2, "type": "message", "date_unixtime": "1600000010",
+             "text": ["long btc sl 90 ", {"type": "bold", "text": "tp 105"}]},
+            {"id": 1, "type": "message", "date_unixtime": "1600000000", "text": "hello"},
+            {"id": 3, "type": "service", "date_unixtime": "1600000020", "text": ""},
+        ]}
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "result.json"), "w") as f:
+                json.dump(export, f)
+            history = load_history(os.path.join(path, "result.json"))
+        self.assertEqual(history, [
+            (1600000000, BINANCE_USDT_FUTURES, "hello"),
+            (1600000010, BINANCE_USDT_FUTURES, "long btc sl 90 tp 105"),
+        ])
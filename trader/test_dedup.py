@@ -0,0 +1,81 @@
+import json
+import random
+import unittest
+
+from .dedup import DEDUP_TTL, Field, SignalIndex
+from .signal import Signal
+
+
+def signal(coin="BTC", entry=100.0, targets=(110.0, 120.0), is_long=True, sl=90.0):
+    return Signal(coin, "USDT", sl, is_long=is_long, entry=entry, targets=list(targets))
+
+
+class TestSignalIndex(unittest.TestCase):
+    def test_repeats(self):
+        index = SignalIndex(tolerance=0.002)
+        self.assertFalse(index.check(signal(), now=0))
+        self.assertTrue(index.check(signal(), now=10))
+        # within half the tolerance, on either side of a price bucket
+        self.assertTrue(index.check(signal(entry=100.08, targets=(120.0, 109.95)), now=20))
+        self.assertTrue(index.check(signal(entry=99.92), now=20))
+        for other in [signal(entry=100.25), signal(targets=(111, 120)), signal(is_long=False),
+                      signal(coin="ETH"), signal(entry=None)]:
+            self.assertFalse(index.check(other, now=30), other)
+        self.assertTrue(index.check(signal(entry=None, sl=80), now=40))  # SL isn't a field
+        self.assertEqual((index.hits, index.misses), (4, 6))
+
+    def test_tolerance(self):
+        rng = random.Random(7)
+        for _ in range(2000):
+            price = 10 ** rng.uniform(-6, 5)
+            diff = rng.uniform(0, 0.004)
+            index = SignalIndex(fields=(Field.ENTRY,), tolerance=0.002)
+            index.check(signal(entry=price), now=0)
+            repeated = index.check(signal(entry=price * (1 + diff)), now=0)
+            if diff < 0.00099:
+                self.assertTrue(repeated, (price, diff))
+            elif diff > 0.00201:
+                self.assertFalse(repeated, (price, diff))
+
+    def test_tracks_changes(self):
+        index = SignalIndex(max_keys=2, track_changes=True)
+        index.check(signal(), now=0)
+        self.assertEqual(index.take_changed(), [index.fingerprint(signal())])
+        self.assertEqual(index.take_changed(), [])
+        for i, coin in enumerate(["ETH", "XRP"]):  # the last one evicts BTC, the oldest
+            index.check(signal(coin=coin), now=(i + 1) * DEDUP_TTL / 12)
+        index.forget(signal(coin="ETH"))
+        self.assertEqual(sorted(index.take_changed()),
+                         sorted(index.fingerprint(signal(coin=c)) for c in ["BTC", "ETH", "XRP"]))
+
+    def test_fields(self):
+        index = SignalIndex(fields=(Field.SYMBOL, Field.SIDE, Field.SL))
+        self.assertFalse(index.check(signal(), now=0))
+        self.assertTrue(index.check(signal(entry=101, targets=(130,)), now=0))
+        self.assertFalse(index.check(signal(sl=80), now=0))
+
+    def test_expires(self):
+        index = SignalIndex()
+        index.check(signal(), now=0)
+        self.assertTrue(index.check(signal(), now=DEDUP_TTL - 3600))
+        # seen again in the first time bucket, which has now expired
+        self.assertFalse(index.check(signal(), now=DEDUP_TTL + 1))
+        self.assertEqual(len(index), 1)
+
+    def test_bounded(self):
+        index = SignalIndex(max_keys=3)
+        for i in range(5):
+            index.check(signal(entry=100 + i * 10), now=i * DEDUP_TTL / 12)
+        self.assertEqual(len(index), 3)
+        self.assertFalse(index.check(signal(entry=100), now=5 * DEDUP_TTL / 12))  # oldest went first
+        self.assertTrue(index.check(signal(entry=140), now=5 * DEDUP_TTL / 12))
+
+    def test_persisted(self):
+        state = {}
+        index = SignalIndex(state)
+        index.check(signal(), now=0)
+        index.check(signal(coin="ETH"), now=0)
+        index.forget(signal(coin="ETH"))
+        restored = SignalIndex(json.loads(json.dumps(state)))
+        self.assertTrue(restored.check(signal(), now=60))
+        self.assertFalse(restored.check(signal(coin="ETH"), now=60))
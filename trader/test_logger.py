@@ -0,0 +1,58 @@
+import json
+import logging
+import unittest
+
+import termcolor
+
+from .logger import ColoredFormatter, JsonFormatter, configure_levels, get_logger
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        self.capture = Capture()
+        self.inner = logging.getLogger("trader.test_logger.inner")
+        self.inner.addHandler(self.capture)
+        self.inner.propagate = False
+        self.logger = get_logger(self.inner.name)
+
+    def tearDown(self):
+        self.inner.removeHandler(self.capture)
+        self.inner.propagate = True
+        logging.getLogger("trader.test_logger").setLevel(logging.NOTSET)
+
+    def test_lazy_messages(self):
+        calls = []
+        configure_levels("trader.test_logger=warning")
+        self.logger.info(lambda: calls.append(1) or "skipped")
+        self.assertEqual(calls, [])
+        self.assertEqual(self.capture.records, [])
+
+        configure_levels("trader.test_logger=debug")
+        self.logger.debug(lambda: calls.append(1) or "built")
+        self.assertEqual(calls, [1])
+        self.assertEqual(self.capture.records[0].getMessage(), "built")
+
+    def test_colors(self):
+        self.logger.warning("price %s", 10, color="green", on="blue")
+        record = self.capture.records[0]
+        self.assertEqual((record.color, record.on_color), ("green", "on_blue"))
+
+        line = ColoredFormatter().format(record)
+        self.assertIn(termcolor.colored("price 10", color="green", on_color="on_blue"), line)
+        # the record itself isn't changed for other handlers
+        self.assertEqual(record.getMessage(), "price 10")
+
+    def test_json(self):
+        self.logger.error("failed: %s", "boom")
+        out = json.loads(JsonFormatter().format(self.capture.records[0]))
+        self.assertEqual((out["level"], out["logger"], out["msg"]),
+                         ("ERROR", "trader.test_logger.inner", "failed: boom"))
@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from . import metrics
+from .metrics import LatencyHistogram, Tracer, serve_metrics
+from .utils import NamedLock
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_bucket_bounds(self):
+        for us in [0, 1, 15, 16, 31, 32, 33, 1000, 123456, 10 ** 9]:
+            idx = LatencyHistogram._index(us)
+            self.assertGreaterEqual(LatencyHistogram._upper(idx), us)
+            if idx:
+                self.assertLess(LatencyHistogram._upper(idx - 1), us)
+
+    def test_quantiles(self):
+        hist = LatencyHistogram()
+        for ms in range(1, 1001):
+            hist.record(ms / 1000)
+        self.assertEqual(hist.count, 1000)
+        self.assertAlmostEqual(hist.quantile(0.5), 0.5, delta=0.5 * 0.07)
+        self.assertAlmostEqual(hist.quantile(0.99), 0.99, delta=0.99 * 0.07)
+        self.assertEqual(hist.quantile(1), 1.0)
+        self.assertEqual(LatencyHistogram().quantile(0.5), 0.0)
+
+
+class TestTracer(unittest.TestCase):
+    def test_stages(self):
+        tracer = Tracer()
+        with mock.patch("time.perf_counter", side_effect=[0.01, 0.05, 0.25]):
+            trace = tracer.start("alpha", at=0.0)
+            tracer.mark(trace, "parse")
+            tracer.mark(trace, "price")
+            tracer.finish(trace, "order")
+        self.assertEqual([s for s, _ in trace.stages], ["parse", "price", "order"])
+        self.assertAlmostEqual(tracer.histograms["price"].max, 0.04)
+        self.assertAlmostEqual(tracer.histograms["total"].max, 0.25)
+        # finished (or discarded) traces aren't counted again
+        tracer.finish(trace)
+        self.assertEqual(tracer.histograms["total"].count, 1)
+        self.assertEqual([row[:2] for row in tracer.summary()],
+                         [("parse", 1), ("price", 1), ("order", 1), ("total", 1)])
+
+    def test_drops_oldest_open(self):
+        tracer = Tracer()
+        with mock.patch.object(metrics, "TRACE_MAX_OPEN", 2):
+            traces = [tracer.start(f"tag-{i}") for i in range(3)]
+        tracer.finish(traces[0])
+        tracer.finish(traces[2])
+        self.assertEqual(tracer.histograms["total"].count, 1)
+
+    def test_serve_metrics(self):
+        tracer = Tracer()
+        tracer.finish(tracer.start("alpha"), "order")
+
+        async def _test():
+            server = await serve_metrics(0, tracer, locks={"coin": NamedLock()})
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            resp = await reader.read()
+            writer.close()
+            server.close()
+            return resp.decode()
+
+        resp = asyncio.run(_test())
+        self.assertTrue(resp.startswith("HTTP/1.1 200 OK"))
+        self.assertIn('trader_signal_stage_seconds_count{stage="order"} 1', resp)
+        self.assertIn('trader_signal_stage_seconds{stage="total",quantile="0.99"}', resp)
+        self.assertIn('trader_lock_acquired_total{lock="coin"} 0', resp)
@@ -0,0 +1,126 @@
+import asyncio
+import unittest
+
+from .scheduler import Dropped, Overflow, Priority, Scheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Jobs:
+    def __init__(self, secs=0.01):
+        self.secs = secs
+        self.started = []
+        self.finished = []
+        self.dropped = []
+        self.active = 0
+        self.max_active = 0
+
+    def job(self, name):
+        async def _run():
+            self.started.append(name)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            await asyncio.sleep(self.secs)
+            self.active -= 1
+            self.finished.append(name)
+
+        return _run
+
+    def on_drop(self, name):
+        return lambda reason: self.dropped.append((name, reason))
+
+
+class TestScheduler(unittest.TestCase):
+    def test_fifo_per_key(self):
+        async def _test():
+            jobs = Jobs()
+            scheduler = Scheduler(workers=3)
+            scheduler.start()
+            for name in ["btc-1", "eth-1", "btc-2", "btc-3", "eth-2", "xrp-1"]:
+                scheduler.submit(name.split("-")[0], jobs.job(name))
+            self.assertEqual(scheduler.depth("btc"), 3)
+            await scheduler.close()
+            self.assertEqual([n for n in jobs.finished if n.startswith("btc")], ["btc-1", "btc-2", "btc-3"])
+            self.assertEqual(jobs.started[:3], ["btc-1", "eth-1", "xrp-1"])  # keys in parallel
+            self.assertEqual(jobs.max_active, 3)
+            self.assertEqual(len(jobs.finished), 6)
+
+        run(_test())
+
+    def test_commands_first(self):
+        async def _test():
+            jobs = Jobs()
+            scheduler = Scheduler(workers=1)
+            for i in range(3):
+                scheduler.submit(f"entry-{i}", jobs.job(f"entry-{i}"))
+            scheduler.submit("entry-1", jobs.job("close-1"), Priority.COMMAND)  # after its entry
+            scheduler.submit("other", jobs.job("close-other"), Priority.COMMAND)
+            scheduler.start()
+            await scheduler.close()
+            self.assertEqual(jobs.finished, ["close-other", "entry-0", "entry-1", "close-1", "entry-2"])
+
+        run(_test())
+
+    def test_overflow(self):
+        async def _test():
+            for overflow, finished, dropped in [
+                (Overflow.DROP_NEW, ["b", "cmd"], ["a", "c", "d"]),
+                (Overflow.DROP_OLDEST, ["d", "cmd"], ["a", "b", "c"]),
+            ]:
+                jobs = Jobs()
+                scheduler = Scheduler(workers=1, max_queued=2, overflow=overflow)
+                for name in ["a", "b", "c"]:
+                    scheduler.submit(name, jobs.job(name), on_drop=jobs.on_drop(name))
+                # commands make room by dropping the oldest entry, whatever the policy
+                scheduler.submit("cmd", jobs.job("cmd"), Priority.COMMAND, on_drop=jobs.on_drop("cmd"))
+                scheduler.submit("d", jobs.job("d"), on_drop=jobs.on_drop("d"))
+                scheduler.start()
+                await scheduler.close()
+                self.assertEqual(sorted(jobs.finished), sorted(finished))
+                self.assertEqual(sorted(name for name, _ in jobs.dropped), dropped)
+                self.assertEqual({reason for _, reason in jobs.dropped}, {Dropped.OVERFLOW})
+
+        run(_test())
+
+    def test_merge(self):
+        async def _test():
+            jobs = Jobs()
+            scheduler = Scheduler(workers=1)
+            scheduler.submit("btc", jobs.job("btc-1"), merge_key="btc", on_drop=jobs.on_drop("btc-1"))
+            scheduler.submit("eth", jobs.job("eth-1"), merge_key="eth")
+            scheduler.submit("btc", jobs.job("btc-2"), merge_key="btc")
+            scheduler.start()
+            await asyncio.sleep(0.001)
+            scheduler.submit("btc", jobs.job("btc-3"), merge_key="btc")  # btc-2 has started
+            await scheduler.close()
+            self.assertEqual(jobs.finished, ["btc-2", "eth-1", "btc-3"])  # in btc-1's place
+            self.assertEqual(jobs.dropped, [("btc-1", Dropped.MERGED)])
+            self.assertEqual(scheduler.queued, 0)
+
+        run(_test())
+
+    def test_failures_and_close(self):
+        async def _test():
+            jobs = Jobs()
+            scheduler = Scheduler(workers=1)
+            scheduler.start()
+
+            async def _fail():
+                raise ValueError("boom")
+
+            with self.assertLogs("trader.scheduler", "ERROR"):
+                scheduler.submit("btc", _fail)
+                scheduler.submit("btc", jobs.job("btc-2"))
+                await asyncio.sleep(0.005)
+            self.assertEqual(jobs.started, ["btc-2"])  # went on after the failure
+
+            scheduler.submit("btc", jobs.job("btc-3"), on_drop=jobs.on_drop("btc-3"))
+            await scheduler.close(drain=False)
+            self.assertEqual(jobs.finished, ["btc-2"])  # the running one finished
+            self.assertEqual(jobs.dropped, [("btc-3", Dropped.CLOSED)])
+            self.assertFalse(scheduler.submit("btc", jobs.job("late"), on_drop=jobs.on_drop("late")))
+            self.assertEqual(jobs.dropped[-1], ("late", Dropped.CLOSED))
+
+        run(_test())
@@ -1,3 +1,6 @@
+import math
+import random
+import re
 import unittest
 
 from .errors import (CloseTradeException, ModifyRiskException,
@@ -108,3 +111,143 @@ class TestUSDT_FUTURES_PARSER(TestSignal):
         self.assertEqual(tag, "my_tag")
         self.assertEqual(risk, -0.5)
         self.assertEqual(entry, 15.7)
+
+
+def _extract_number(line: str):
+    res = re.search(r"(\.?\d+(?:\.\d+)?)", line.replace(",", "."))
+    return float(res[1]) if res else None
+
+
+# The parser as it was before the single-pass tokenizer, which the fuzz corpus is checked against
+class ReferenceParser:
+    def __init__(self, quote):
+        self.quote = quote
+
+    def parse(self, text: str) -> Signal:
+        if "cancel " in text or "close " in text:
+            raise CloseTradeException(tag=text.split(" ")[1].lower())
+
+        sig, tag, parts = [None] * 3
+        if (text.startswith("long ") or text.startswith("short ") or
+                text.startswith("l ") or text.startswith("s ")):
+            parts = text.split(" ")
+            is_long = parts.pop(0) in ("long", "l")
+            sig = Signal(parts.pop(0), self.quote, 0, is_long=is_long)
+            res = _extract_number(parts[0])
+            if res:
+                parts.pop(0)
+                sig.entry = res
+        if text.startswith("change"):
+            parts = text.split(" ")[1:]
+            tag = parts.pop(0)
+        assert parts
+        if parts[0] == "r":
+            parts.pop(0)
+            assert (parts[0].startswith("+") or parts[0].startswith("-")) \
+                and parts[0].endswith("%")
+            risk = float(parts.pop(0)[:-1])
+            entry = None
+            if parts:
+                assert parts.pop(0) == "@"
+                entry = _extract_number(parts.pop(0))
+            raise ModifyRiskException(tag, risk, entry)
+        if parts[0] == "sl":
+            parts.pop(0)
+            res = _extract_number(parts.pop(0))
+            if sig is None:
+                raise MoveStopLossException(tag, res)
+            assert res
+            sig.sl = res
+        if parts and parts[0] == "soft":
+            sig.soft_sl = True
+            parts.pop(0)
+        if parts and parts[0] == "tp":
+            parts.pop(0)
+            targets = []
+            is_percent = False
+            while parts:
+                res = _extract_number(parts[0])
+                if not res:
+                    break
+                if parts[0].endswith("%") and not is_percent:
+                    is_percent = True
+                parts.pop(0)
+                targets.append(res)
+            targets = sorted(targets)
+            if sig is None:
+                raise ModifyTargetsException(tag, targets, is_percent=is_percent)
+            assert targets
+            sig.targets = targets
+            sig.percent_targets = is_percent
+        if len(parts) > 1 and parts[0] == "risk":
+            parts.pop(0)
+            sig.risk_factor = float(parts.pop(0))
+        return sig
+
+
+FUZZ_WORDS = ["long", "short", "l", "s", "change", "cancel", "close", "btc", "akro", "my_tag",
+              "sl", "soft", "tp", "r", "risk", "@", "force", "0", "1", "25", "0.05", ".5", "1,5",
+              "2.5.1", "x5", "-3", "75%", "150%", "+0.5%", "-1%", "+%", "٣", "1e5", "", "hello"]
+
+
+def _outcome(parse, text):
+    try:
+        sig = parse(text)
+    except Exception as err:
+        return type(err), sorted(vars(err).items())
+    if sig is None:
+        return None
+    return (sig.asset, sig.quote, sig.entry, sig.is_long, sig.sl, sig.targets, sig.leverage,
+            sig.risk, sig.tag, sig.soft_sl, sig.percent_targets, sig.is_market_order)
+
+
+def _search_factor(sig_p, mark_p):
+    # the power-by-power search the closed form replaced
+    minima = math.inf
+    factor = 1
+    for i in range(Signal.MIN_PRECISION * 2):
+        f = 1 / (10 ** (Signal.MIN_PRECISION - i))
+        dist = abs(sig_p * f - mark_p) / mark_p
+        if dist < minima:
+            minima = dist
+            factor = f
+        else:
+            break
+    return factor
+
+
+class TestPrecisionFactor(unittest.TestCase):
+    def test_matches_search(self):
+        sig = Signal("BTC", "USDT", 1)
+        rng = random.Random(3)
+        cases = [(0, 5), (-2, 3), (0.578, 0.000578), (5.5, 1), (0.55, 1), (1, 5.5), (1, 55),
+                 (1e-20, 1e-7), (1e-7, 1e9), (41000, 41.2), (20.4, 20.573)]
+        for _ in range(20000):
+            mark = 10 ** rng.uniform(-9, 7)
+            if rng.random() < 0.5:
+                cases.append((mark * 10 ** rng.uniform(-14, 14), mark))
+            else:  # right at the crossovers
+                cases.append((mark / 5.5 * 10 ** rng.randint(-8, 8), mark))
+        for price, mark in cases:
+            with self.subTest(price=price, mark=mark):
+                self.assertEqual(sig.factor(price, mark), _search_factor(price, mark))
+
+
+class TestParserFuzz(unittest.TestCase):
+    def test_matches_reference(self):
+        reference = ReferenceParser("USDT")
+        rng = random.Random(7)
+        corpus = ["long akro sl 0.05", "l chr 0.25 sl 0.23 tp 0.27 0.29", "cancel my_tag",
+                  "change my_tag sl 25.45", "change my_tag tp 25 30 34",
+                  "long dydx sl 20.4 tp 75% 150%", "s atom 32.7 sl 32.73 tp 50% 75% force",
+                  "change my_tag r +0.5%", "change my_tag r -0.5% @ 15.7", "change", "long ",
+                  "s btc 1 sl 2 soft tp 3 4 risk 2", "we're going to close soon", "gm"]
+        for _ in range(5000):
+            words = rng.choices(FUZZ_WORDS, k=rng.randint(1, 9))
+            if rng.random() < 0.7:  # mostly commands, with noise after the keyword
+                words.insert(0, rng.choice(["long", "short", "l", "s", "change"]))
+            corpus.append(" ".join(words))
+        for text in corpus:
+            with self.subTest(text=text):
+                self.assertEqual(_outcome(USDT_FUTURES_PARSER.parse, text),
+                                 _outcome(reference.parse, text))
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from .storage import JournaledStorage, OrderStore, PersistentDict, SqliteStorage
+
+
+def position(symbol, tag):
+    return {"sym": symbol, "tag": tag, "ent": 10.0, "sl": 9.0, "qty": 1.0,
+            "tgt": [11.0], "t_ord": [], "t_q": []}
+
+
+def child(parent):
+    return {"parent": parent, "filled": False}
+
+
+class TestOrderStore(unittest.TestCase):
+    def setUp(self):
+        self.state = {}
+        self.store = OrderStore(self.state)
+        self.store["wait-1"] = position("BTCUSDT", "Alpha-0")
+        self.store["wait-2"] = position("ETHUSDT", "alpha-1")
+        self.store["wait-3"] = position("BTCUSDT", "beta-2")
+        self.store["trgt-1"] = child("wait-1")
+        self.store["stop-1"] = child("wait-1")
+
+    def test_find_by_tag(self):
+        self.assertEqual(sorted(self.store.find("alpha")), ["wait-1", "wait-2"])
+        self.assertEqual(self.store.find("ALPHA-1"), ["wait-2"])
+        self.assertEqual(self.store.find("alpha", "BTCUSDT"), ["wait-1"])
+        self.assertEqual(self.store.find("alpha-1", "BTCUSDT"), [])
+        self.assertEqual(self.store.find("gamma"), [])
+        # children aren't tagged
+        self.assertEqual(self.store.find("wait"), [])
+
+    def test_children(self):
+        self.assertEqual(sorted(self.store.children("wait-1")), ["stop-1", "trgt-1"])
+        self.store.pop("trgt-1")
+        self.assertEqual(self.store.children("wait-1"), ["stop-1"])
+        self.assertEqual(self.store.children("wait-2"), [])
+
+    def test_pop_position(self):
+        order = self.store.pop_position("wait-1")
+        self.assertEqual(order["tag"], "Alpha-0")
+        self.assertEqual(sorted(self.state), ["wait-2", "wait-3"])
+        self.assertEqual(self.store.find("alpha", "BTCUSDT"), [])
+        self.assertEqual(self.store.positions("BTCUSDT"), ["wait-3"])
+        self.assertIsNone(self.store.pop_position("wait-1"))
+
+    def test_replace(self):
+        self.store["wait-3"] = position("XRPUSDT", "gamma-3")
+        self.assertEqual(self.store.find("beta"), [])
+        self.assertEqual(self.store.find("gamma", "XRPUSDT"), ["wait-3"])
+        self.assertEqual(self.store.positions("BTCUSDT"), ["wait-1"])
+
+    def test_indexes_existing_orders(self):
+        store = OrderStore(json.loads(json.dumps(self.state)))
+        self.assertEqual(store, self.store)
+        self.assertEqual(sorted(store.find("alpha")), ["wait-1", "wait-2"])
+        self.assertEqual(sorted(store.children("wait-1")), ["stop-1", "trgt-1"])
+
+
+class TestPersistentDict(unittest.TestCase):
+    def test_round_trip(self):
+        async def _test(storage):
+            await storage.init()
+            await storage.register_position("wait-1", "BTCUSDT", 20000, 0.1, [21000], 19000, "alpha-0")
+            await storage.set_sl_order("wait-1", "stop-1")
+            await storage.set_sl_order("wait-1", "stop-2")
+            await storage.set_sl("alpha-0", 19500)
+
+        async def _check(storage):
+            await storage.init()
+            self.assertIsNone(await storage.get_position("alpha"))
+            pos = await storage.get_position("Alpha-0")
+            self.assertEqual((pos.order_id, pos.symbol, pos.sl, pos.sl_order),
+                             ("wait-1", "BTCUSDT", 19500, "stop-2"))
+            self.assertEqual(storage.orders.children("wait-1"), ["stop-2"])
+            self.assertEqual(len(await storage.get_positions("alpha", "BTCUSDT")), 1)
+
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, "state.json")
+            with open(path, "w") as fd:
+                fd.write("{}")
+            with PersistentDict(path) as storage:
+                asyncio.run(_test(storage))
+            with PersistentDict(path) as storage:
+                asyncio.run(_check(storage))
+
+
+async def register(storage, count, start=0):
+    await asyncio.gather(*[
+        storage.register_position(f"wait-{i}", "BTCUSDT", 20000, 0.1, [21000], 19000, f"tag-{i}")
+        for i in range(start, start + count)])
+
+
+class TestJournaledStorage(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "state.json")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _open(self, **kwargs):
+        storage = JournaledStorage(self.path, **kwargs).__enter__()
+        asyncio.run(storage.init())
+        return storage
+
+    def test_survives_without_exit(self):
+        storage = self._open()
+        writes = []
+        append = storage._append
+        storage._append = lambda data: writes.append(data) or append(data)
+
+        async def _test():
+            await register(storage, 100)
+            await storage.set_sl_order("wait-1", "stop-1")
+            await storage.set_sl_order("wait-1", "stop-2")
+            await storage.set_targets("tag-2", [22000])
+
+        asyncio.run(_test())
+        # concurrent updates share writes
+        self.assertLess(len(writes), 10)
+        self.assertFalse(os.path.exists(self.path))
+
+        # killed - nothing else gets written
+        recovered = self._open()
+        self.assertEqual(recovered.orders, storage.orders)
+        self.assertEqual(recovered.orders.children("wait-1"), ["stop-2"])
+        self.assertEqual(recovered.orders["wait-2"]["tgt"], [22000])
+
+    def test_saves_direct_changes(self):
+        storage = self._open()
+        storage.state["config"] = {"rr": 1}
+
+        async def _test():
+            storage.orders["wait-1"] = position("BTCUSDT", "tag-1")
+            storage.orders["stop-1"] = child("wait-1")
+            await storage.save()
+            storage.orders["wait-1"]["sl"] = 9.5  # in place
+            storage.orders.pop("stop-1")
+            await storage.save("wait-1")
+            storage.state["config"]["rf"] = 2
+            storage.state["seen"] = {"a": 1, "b": 2}
+            await storage.save_state("config", ["rf"])
+            await storage.save_state("seen", ["a", "b"])
+            del storage.state["seen"]["a"]
+            await storage.save_state("seen", ["a"])
+
+        asyncio.run(_test())
+        recovered = self._open()
+        self.assertEqual(dict(recovered.orders), {"wait-1": dict(position("BTCUSDT", "tag-1"), sl=9.5)})
+        self.assertEqual(recovered.state["config"], {"rf": 2})  # "rr" was never saved
+        self.assertEqual(recovered.state["seen"], {"b": 2})
+
+        # snapshots keep the whole state
+        recovered.__exit__(None, None, None)
+        self.assertEqual(self._open().state["config"], {"rf": 2})
+
+    def test_exit_waits_for_journal_write(self):
+        storage = self._open()
+        written = []
+        append = storage._append
+        storage._append = lambda data: time.sleep(0.05) or append(data) or written.append(data)
+
+        async def _test():
+            await asyncio.sleep(0)
+            storage.orders["wait-1"] = position("BTCUSDT", "tag-1")
+            asyncio.ensure_future(storage.save())
+            await asyncio.sleep(0.01)  # the write is in flight
+
+        asyncio.run(_test())
+        storage.__exit__(None, None, None)
+        self.assertEqual(len(written), 1)
+        with open(storage.journal_path) as fd:
+            self.assertEqual(fd.read(), "")  # truncated after, not before, the write
+        self.assertIn("wait-1", self._open().orders)
+
+    def test_snapshots(self):
+        storage = self._open(snapshot_every=30)
+        asyncio.run(register(storage, 100))
+        with open(self.path) as fd:
+            self.assertGreater(len(json.load(fd)["orders"]), 70)
+        with open(storage.journal_path) as fd:
+            self.assertLessEqual(len(fd.readlines()), 30)
+        self.assertEqual(self._open().orders, storage.orders)
+
+        storage.__exit__(None, None, None)
+        with open(storage.journal_path) as fd:
+            self.assertEqual(fd.read(), "")
+        self.assertEqual(len(self._open().orders), 100)
+
+    def test_skips_records_in_snapshot(self):
+        storage = self._open()
+        asyncio.run(register(storage, 5))
+        with open(storage.journal_path) as fd:
+            journal = fd.read()
+        storage.__exit__(None, None, None)
+        # crashed after the snapshot was written, but before the journal was truncated
+        with open(storage.journal_path, "w") as fd:
+            fd.write(journal.replace("20000", "1"))
+        self.assertEqual(self._open().orders["wait-0"]["ent"], 20000)
+
+    def test_drops_torn_record(self):
+        storage = self._open()
+        asyncio.run(register(storage, 5))
+        with open(storage.journal_path, "a") as fd:
+            fd.write('[6, "wait-5", {"sym": "BTC')
+
+        recovered = self._open()
+        self.assertEqual(len(recovered.orders), 5)
+        asyncio.run(register(recovered, 5, start=5))
+        self.assertEqual(len(self._open().orders), 10)
+
+
+class TestSqliteStorage(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "state.db")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        async def _test(storage):
+            await storage.init()
+            await storage.register_position("wait-1", "BTCUSDT", 20000, 0.1, [21000], 19000, "Alpha-0")
+            await storage.register_position("wait-2", "ETHUSDT", 1500, 1, [1600], 1400, "alpha-1")
+            await storage.set_sl_order("wait-1", "stop-1")
+            await storage.set_sl_order("wait-1", "stop-2")
+            await storage.set_sl("alpha-0", 19500)
+            await storage.set_targets("alpha-1", [1550, 1600])
+            await storage.set_position_entry("gamma-0", 1)  # no such position
+
+        async def _check(storage):
+            await storage.init()
+            self.assertIsNone(await storage.get_position("alpha"))
+            pos = await storage.get_position("ALPHA-0")
+            self.assertEqual((pos.order_id, pos.symbol, pos.sl, pos.sl_order, pos.targets),
+                             ("wait-1", "BTCUSDT", 19500, "stop-2", [21000]))
+            self.assertEqual(pos.tag, "Alpha-0")
+            self.assertEqual((await storage.get_position("alpha-1")).targets, [1550, 1600])
+            self.assertEqual(len(await storage.get_positions("alpha")), 2)
+            self.assertEqual([p.order_id for p in await storage.get_positions("alpha", "ETHUSDT")],
+                             ["wait-2"])
+            self.assertEqual(await storage.get_positions("alpha-1", "BTCUSDT"), [])
+
+        with SqliteStorage(self.path) as storage:
+            asyncio.run(_test(storage))
+        with SqliteStorage(self.path) as storage:
+            asyncio.run(_check(storage))
+            children = storage._executor.submit(
+                lambda: storage._conn.execute("SELECT order_id FROM orders").fetchall()).result()
+            self.assertEqual(children, [("stop-2",)])
+
+    def test_batches_queries(self):
+        storage = SqliteStorage(self.path).__enter__()
+        batches = []
+        run_batch = storage._run_batch
+        storage._run_batch = lambda batch: batches.append(len(batch)) or run_batch(batch)
+
+        async def _test():
+            await register(storage, 100)
+            # queries are run in order, so reads see earlier writes from the same batch
+            await asyncio.gather(storage.set_sl("tag-5", 18000), storage.get_position("tag-5"))
+            return await storage.get_position("tag-5")
+
+        self.assertEqual(asyncio.run(_test()).sl, 18000)
+        self.assertEqual(sum(batches), 103)
+        self.assertLess(len(batches), 10)
+        storage.__exit__(None, None, None)
+
+    def test_failed_query_keeps_batch(self):
+        async def _test(storage):
+            return await asyncio.gather(
+                storage.register_position("wait-1", "BTCUSDT", 20000, 0.1, [21000], 19000, "tag-1"),
+                storage.set_sl_order("wait-9", "stop-1"),
+                storage.register_position("wait-2", "BTCUSDT", 20000, 0.1, [21000], 19000, "tag-2"),
+                return_exceptions=True)
+
+        with SqliteStorage(self.path) as storage:
+            results = asyncio.run(_test(storage))
+        self.assertIsInstance(results[1], KeyError)
+        with SqliteStorage(self.path) as storage:
+            self.assertEqual(len(asyncio.run(storage.get_positions("tag"))), 2)
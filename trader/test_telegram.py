@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+
+from .signal import BINANCE_USDT_FUTURES
+from .telegram import TeleTrader
+
+RESULTS = -100123
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Event:
+    def __init__(self, id, text, chat_id=BINANCE_USDT_FUTURES, reply=None):
+        self.id = id
+        self.text = text
+        self.chat_id = chat_id
+        self.reply = reply
+
+    async def get_reply_message(self):
+        return self.reply
+
+
+class RecordingTrader:
+    def __init__(self):
+        self.calls = []
+        self.count = 0
+
+    async def queue_signal(self, signal):
+        signal.tag = f"{signal.coin.lower()}-{self.count}"
+        self.count += 1
+        self.calls.append(("signal", signal.tag, signal.coin, signal.sl, signal.targets))
+        return True
+
+    def queue_amend(self, tag, coin=None, sl=None, targets=None, is_percent=False):
+        self.calls.append(("amend", tag, coin, sl, targets, is_percent))
+        return True
+
+    def queue_close(self, tag, coin=None):
+        self.calls.append(("close", tag, coin))
+        return True
+
+
+def create_client():
+    client = TeleTrader(1, "hash", state={}, results_channel=RESULTS)
+    client.trader = RecordingTrader()
+    return client
+
+
+class TestTeleTrader(unittest.TestCase):
+    def test_edits_amend_traded_signals(self):
+        async def _test():
+            client = create_client()
+            await client._handler(Event(1, "long btc sl 90 tp 105 110"))
+            await client._handler(Event(2, "hello"))
+            self.assertEqual(client.trader.calls, [("signal", "btc-0", "BTC", 90, [105, 110])])
+            self.assertEqual(dict(client.posts), {(BINANCE_USDT_FUTURES, 1): "btc-0"})
+
+            await client._edit_handler(Event(1, "long btc sl 92 tp 105 112"))
+            await client._edit_handler(Event(2, "long eth sl 90 tp 105"))  # never traded
+            await client._edit_handler(Event(1, "long btc"))  # incomplete
+            self.assertEqual(client.trader.calls[1:], [("amend", "btc-0", "BTC", 92, [105, 112], False)])
+
+        run(_test())
+
+    def test_commands(self):
+        async def _test():
+            client = create_client()
+            signal = Event(1, "long btc sl 90 tp 105 110")
+            await client._handler(Event(2, "change btc sl 95"))
+            await client._handler(Event(3, "change btc-0 tp 50% 100%", reply=signal))
+            await client._handler(Event(4, "close btc", reply=signal))
+            await client._handler(Event(5, "change btc sl 95", reply=Event(1, "hello")))  # not a signal
+            self.assertEqual(client.trader.calls, [
+                ("amend", "btc", None, 95, None, False),
+                ("amend", "btc-0", "BTC", None, [50, 100], True),
+                ("close", "btc", "BTC"),
+            ])
+
+        run(_test())
+
+    def test_results_channel(self):
+        async def _test():
+            client = create_client()
+            await client._handler(Event(1, "set rr 0.5", chat_id=RESULTS))
+            self.assertEqual(client.state["config"], {"rr": 0.5})
+            self.assertEqual(client.trader.calls, [])
+
+        run(_test())
@@ -0,0 +1,481 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from binance.exceptions import BinanceAPIException
+
+from . import OrderID
+from .clients import OrderType
+from .clients.binance import compile_symbol_rules
+from .dedup import SignalIndex
+from .errors import QuantityLimitException
+from .signal import Signal
+from .storage import JournaledStorage
+from .testing import FakeExchange, add_position, create_trader, fill_event, symbol_info
+
+
+def legacy_signal(entry=10):
+    signal = Signal("BTC", "USDT", entry * 0.9, targets=[entry * 1.05, entry * 1.1], entry=entry, leverage=10)
+    # what the legacy trader expects of its signals, which `Signal` doesn't have
+    signal.tag, signal.risk_reward, signal.max_entry, signal.force_limit_order = "btc-0", 2, entry * 1.05, False
+    return signal
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestCollectionOrders(unittest.TestCase):
+    def test_batches(self):
+        async def _test():
+            exchange = FakeExchange()
+            trader = create_trader(exchange)
+            add_position(trader, "wait-1", targets=10)
+            await trader._place_collection_orders("wait-1")
+            parent = trader.state["orders"]["wait-1"]
+            self.assertEqual(exchange.calls, {"batch": 2, "create": 1})  # SL + 10 TPs
+            self.assertTrue(OrderID.is_stop_loss(parent["s_ord"]))
+            self.assertEqual(len(parent["t_ord"]), 10)
+            self.assertEqual(parent["t_q"], [8.0] * 10)
+            prices = [exchange.orders[oid]["price"] for oid in parent["t_ord"]]
+            self.assertEqual(prices, [10.1, 10.2, 10.3, 10.4, 10.5, 10.6, 10.7, 10.8, 10.9, 11.0])
+            for oid in parent["t_ord"] + [parent["s_ord"]]:
+                self.assertEqual(trader.state["orders"][oid], {"parent": "wait-1", "filled": False})
+
+        run(_test())
+
+    def test_retries_failed_orders(self):
+        async def _test():
+            exchange = FakeExchange()
+            exchange.fail_batch.add(OrderType.STOP_MARKET)
+            trader = create_trader(exchange)
+            add_position(trader, "wait-1", targets=4)
+            await trader._place_collection_orders("wait-1")
+            parent = trader.state["orders"]["wait-1"]
+            self.assertEqual(exchange.calls, {"batch": 1, "create": 1})
+            self.assertEqual(len(parent["t_ord"]), 4)
+            # SL would've triggered immediately, so it's closed at market instead
+            self.assertEqual(exchange.orders[parent["s_ord"]]["type"], OrderType.MARKET)
+
+        run(_test())
+
+    def test_drops_orders_which_keep_failing(self):
+        async def _test():
+            exchange = FakeExchange()
+            exchange.fail_batch.add(OrderType.LIMIT)
+            exchange.fail_create[OrderType.LIMIT] = -1013
+            trader = create_trader(exchange)
+            add_position(trader, "wait-1", targets=2)
+            await trader._place_collection_orders("wait-1")
+            parent = trader.state["orders"]["wait-1"]
+            self.assertEqual(parent["t_ord"], [])
+            self.assertIsNotNone(parent["s_ord"])
+            self.assertEqual(len(trader.state["orders"]), 2)
+
+        run(_test())
+
+
+class TestConcurrentPositions(unittest.TestCase):
+    SYMBOLS = [f"C{i}USDT" for i in range(30)]
+
+    def _assert_consistent(self, trader, exchange):
+        orders = trader.state["orders"]
+        for oid, order in orders.items():
+            if "parent" in order:
+                parent = orders[order["parent"]]
+                self.assertTrue(oid == parent.get("s_ord") or oid in parent["t_ord"])
+                continue
+            open_ids = {o["clientOrderId"] for o in exchange.open_orders(order["sym"])}
+            # only the live SL and the unfilled TPs are open on the exchange
+            expected = {tid for tid in order["t_ord"] if not orders[tid]["filled"]}
+            expected.add(order["s_ord"])
+            self.assertEqual(open_ids, expected)
+            for tid in order["t_ord"]:
+                self.assertEqual(orders[tid]["parent"], oid)
+            self.assertEqual(orders[order["s_ord"]]["parent"], oid)
+
+    def test_stress(self):
+        async def _test():
+            random.seed(42)
+            exchange = FakeExchange(latency=0.002, jitter=0.01)
+            trader = create_trader(exchange, self.SYMBOLS)
+            for i, symbol in enumerate(self.SYMBOLS):
+                add_position(trader, f"mrkt-{i}", symbol, targets=4)
+
+            # entries fill all at once
+            await asyncio.gather(*[trader._handle_event(fill_event(f"mrkt-{i}"))
+                                   for i in range(len(self.SYMBOLS))])
+            self._assert_consistent(trader, exchange)
+
+            # first two TPs of each position fill concurrently (and out of order)
+            fills = []
+            for i in range(len(self.SYMBOLS)):
+                fills += trader.state["orders"][f"mrkt-{i}"]["t_ord"][:2]
+            random.shuffle(fills)
+            await asyncio.gather(*[trader._handle_event(exchange.fill(tid)) for tid in fills])
+            self._assert_consistent(trader, exchange)
+            for i in range(len(self.SYMBOLS)):
+                parent = trader.state["orders"][f"mrkt-{i}"]
+                sl = exchange.orders[parent["s_ord"]]
+                self.assertEqual(sl["stopPrice"], parent["ent"])  # SL moved to entry
+                self.assertEqual(sl["quantity"], 100 - 20 * 2)
+
+            # SL hits for half the positions while the rest are being closed
+            half = len(self.SYMBOLS) // 2
+            sl_hits = [trader._handle_event(exchange.fill(trader.state["orders"][f"mrkt-{i}"]["s_ord"]))
+                       for i in range(half)]
+            closes = [trader.close_trades(symbol.lower(), symbol[:-4])
+                      for symbol in self.SYMBOLS[half:]]
+            await asyncio.gather(*sl_hits, *closes)
+            self.assertEqual(trader.state["orders"], {})
+            for symbol in self.SYMBOLS:
+                self.assertEqual(exchange.open_orders(symbol), [])
+
+        run(_test())
+
+    def test_fills_before_responses(self):
+        async def _test():
+            exchange = FakeExchange(latency=0.01)
+            trader = create_trader(exchange)
+            add_position(trader, "mrkt-1", targets=4)
+            handled = []
+
+            def _fill_immediately(order):  # first TP fills before its batch response arrives
+                if OrderID.is_target(order["clientOrderId"]) and order["price"] == 10.1:
+                    handled.append(asyncio.ensure_future(
+                        trader._handle_event(fill_event(order["clientOrderId"]))))
+
+            exchange.on_order = _fill_immediately
+            await trader._handle_event(fill_event("mrkt-1"))
+            await asyncio.gather(*handled)
+            parent = trader.state["orders"]["mrkt-1"]
+            self.assertEqual(len(handled), 1)
+            self.assertTrue(trader.state["orders"][parent["t_ord"][0]]["filled"])
+            self.assertEqual(exchange.orders[parent["s_ord"]]["stopPrice"], 10.0)
+
+        run(_test())
+
+    def test_entry_fills_before_response(self):
+        async def _test():
+            exchange = FakeExchange(latency=0.01)
+            trader = create_trader(exchange)
+            trader.balance = 1000
+            trader.prices["BTCUSDT"] = 10.0
+            handled = []
+
+            def _fill_immediately(order):  # the entry fills before its response arrives
+                if OrderID.is_market(order["clientOrderId"]):
+                    handled.append(asyncio.ensure_future(
+                        trader._handle_event(fill_event(order["clientOrderId"]))))
+
+            async def _slow_response(**params):
+                resp = await create(**params)
+                await asyncio.sleep(0.01)  # the fill's handled while the response is on its way
+                return resp
+
+            create = exchange.futures_create_order
+            exchange.futures_create_order = _slow_response
+            exchange.on_order = _fill_immediately
+            self.assertTrue(await trader._place_order(legacy_signal()))
+            await asyncio.gather(*handled)
+            self.assertEqual(len(handled), 1)
+            order_id = next(iter(trader.state["orders"]))
+            parent = trader.state["orders"][order_id]
+            self.assertIsNotNone(parent.get("s_ord"))
+            self.assertEqual(len(parent["t_ord"]), 2)
+
+        run(_test())
+
+    def test_slow_position_does_not_block_others(self):
+        async def _test():
+            exchange = FakeExchange(latency=0.001, cancel_latency={"SLOWUSDT": 0.3})
+            trader = create_trader(exchange, ["SLOWUSDT", "FASTUSDT"])
+            add_position(trader, "mrkt-1", "SLOWUSDT", targets=2)
+            add_position(trader, "mrkt-2", "FASTUSDT", targets=2)
+            await trader._handle_event(fill_event("mrkt-1"))
+            await trader._handle_event(fill_event("mrkt-2"))
+
+            slow = asyncio.ensure_future(trader.close_trades("slowusdt"))
+            await asyncio.sleep(0.01)
+            start = time.monotonic()
+            await trader._handle_event(fill_event(trader.state["orders"]["mrkt-2"]["t_ord"][0]))
+            self.assertLess(time.monotonic() - start, 0.2)
+            self.assertFalse(slow.done())
+            await slow
+            self.assertNotIn("mrkt-1", trader.state["orders"])
+
+        run(_test())
+
+
+class TestPlaceOrder(unittest.TestCase):
+    def test_validates_market_limits(self):
+        async def _test():
+            exchange = FakeExchange()
+            trader = create_trader(exchange)
+            info = symbol_info("BTCUSDT")
+            info["filters"].append({"filterType": "MARKET_LOT_SIZE", "maxQty": "1"})
+            trader.rules["BTCUSDT"] = compile_symbol_rules(info)
+            trader.balance = 1000
+
+            trader.prices["BTCUSDT"] = 10.0
+            with self.assertRaises(QuantityLimitException):
+                await trader._place_order(legacy_signal())
+            self.assertEqual(exchange.calls["create"], 0)
+
+            trader.prices["BTCUSDT"] = 12.0  # past the max entry, so it's a limit order
+            self.assertTrue(await trader._place_order(legacy_signal()))
+            order = next(iter(exchange.orders.values()))
+            self.assertEqual(order["type"], OrderType.LIMIT)
+            self.assertGreater(order["quantity"], 1)
+
+        run(_test())
+
+
+class TestCloseTrades(unittest.TestCase):
+    def test_closes_symbols_concurrently(self):
+        async def _test():
+            symbols = [f"C{i}USDT" for i in range(10)]
+            exchange = FakeExchange(latency=0.001)
+            trader = create_trader(exchange, symbols)
+            for i, symbol in enumerate(symbols):
+                add_position(trader, f"mrkt-{i}", symbol, targets=10, tag="tag")
+                await trader._handle_event(fill_event(f"mrkt-{i}"))
+            exchange.latency = 0.05
+            exchange.calls.clear()
+
+            start = time.monotonic()
+            results = await trader.close_trades("tag")
+            # one after the other, it'd be more than 100 requests
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertEqual(exchange.calls, {"cancel_all": 10, "create": 10})
+            self.assertEqual(sorted(res.order_id for res in results),
+                             sorted(f"mrkt-{i}" for i in range(10)))
+            for res in results:
+                self.assertTrue(res.ok)
+                self.assertEqual(res.quantity, 80.0)
+                self.assertEqual(res.response["type"], OrderType.MARKET)
+            self.assertEqual(trader.state["orders"], {})
+            for symbol in symbols:
+                self.assertEqual(exchange.open_orders(symbol), [])
+
+        run(_test())
+
+    def test_leaves_other_positions_on_symbol(self):
+        async def _test():
+            exchange = FakeExchange()
+            trader = create_trader(exchange)
+            add_position(trader, "mrkt-1", targets=4)
+            add_position(trader, "mrkt-2", targets=4, tag="other")
+            await trader._handle_event(fill_event("mrkt-1"))
+            await trader._handle_event(fill_event("mrkt-2"))
+            await trader._handle_event(exchange.fill(trader.state["orders"]["mrkt-1"]["t_ord"][0]))
+            add_position(trader, "wait-3", targets=4)  # entry not filled yet
+            exchange._order({"newClientOrderId": "wait-3", "symbol": "BTCUSDT", "quantity": 1})
+            exchange.calls.clear()
+
+            results = await trader.close_trades("btcusdt")
+            self.assertEqual(exchange.calls, {"cancel_batch": 1, "create": 1})
+            results = {res.order_id: res for res in results}
+            self.assertEqual(results["mrkt-1"].quantity, 60.0)  # 3 TPs left
+            self.assertEqual(results["wait-3"].quantity, 0)
+            self.assertIsNone(results["wait-3"].response)
+            self.assertEqual(exchange.orders["wait-3"]["status"], "CANCELED")
+            # only the other position's orders are still open
+            self.assertEqual(set(trader.state["orders"]), {"mrkt-2", *trader.orders.children("mrkt-2")})
+            open_ids = {o["clientOrderId"] for o in exchange.open_orders("BTCUSDT")}
+            self.assertEqual(open_ids, set(trader.orders.children("mrkt-2")))
+
+        run(_test())
+
+    def test_reports_failures(self):
+        async def _test():
+            exchange = FakeExchange()
+            trader = create_trader(exchange)
+            add_position(trader, "mrkt-1", targets=2)
+            await trader._handle_event(fill_event("mrkt-1"))
+            exchange.fail_create[OrderType.MARKET] = -2019
+            results = await trader.close_trades("btcusdt")
+            self.assertEqual(len(results), 1)
+            self.assertFalse(results[0].ok)
+            self.assertIsInstance(results[0].error, BinanceAPIException)
+            self.assertEqual(await trader.close_trades("btcusdt"), [])
+
+        run(_test())
+
+
+class TestJournaledOrders(unittest.TestCase):
+    def test_survives_crash(self):
+        async def _test(storage):
+            await storage.init()
+            exchange = FakeExchange()
+            trader = create_trader(exchange)
+            trader.storage, trader.orders = storage, storage.orders
+            trader.state = storage.state
+            add_position(trader, "mrkt-1", targets=4)
+            add_position(trader, "mrkt-2", targets=2, tag="other")
+            await trader._handle_event(fill_event("mrkt-1"))
+            await trader._handle_event(fill_event("mrkt-2"))
+            await trader._handle_event(exchange.fill(trader.orders["mrkt-1"]["t_ord"][0]))
+            await trader.close_trades("other")
+            return trader
+
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, "state.json")
+            storage = JournaledStorage(path).__enter__()
+            trader = run(_test(storage))
+            # killed without a snapshot - everything's replayed from the journal
+            recovered = JournaledStorage(path).__enter__()
+            self.assertEqual(recovered.state["orders"], json.loads(json.dumps(trader.state["orders"])))
+            self.assertNotIn("mrkt-2", recovered.state["orders"])
+            parent = recovered.state["orders"]["mrkt-1"]
+            self.assertTrue(recovered.state["orders"][parent["t_ord"][0]]["filled"])
+            self.assertEqual(len(parent["t_ord"]), 4)
+
+
+class TestSignalQueue(unittest.TestCase):
+    def test_orders_signals_and_closes(self):
+        async def _test():
+            exchange = FakeExchange()
+            trader = create_trader(exchange, ["BTCUSDT", "ETHUSDT"])
+            add_position(trader, "mrkt-1", tag="tag")
+            await trader._handle_event(fill_event("mrkt-1"))
+            done = []
+            exchange.on_order = lambda order: done.append(order["type"])
+
+            async def _process(signal):
+                await asyncio.sleep(0.01 if signal.coin == "BTC" else 0.05)
+                done.append(signal.tag)
+
+            trader._process_signal = _process
+            self.assertFalse(await trader.queue_signal(Signal("XRP", "USDT", 1)))  # unknown symbol
+            for coin, entry in [("BTC", 10), ("ETH", 10), ("BTC", 12)]:
+                self.assertTrue(await trader.queue_signal(Signal(coin, "USDT", 1, entry=entry)))
+            self.assertFalse(await trader.queue_signal(Signal("BTC", "USDT", 1, entry=12.01)))  # repost
+            self.assertTrue(trader.queue_close("tag", "BTC"))
+            await trader._gather_orders()
+            await trader.close()
+            # the second BTC signal took the first's place, and the close came right after it
+            self.assertEqual(done, ["BTC-2", OrderType.MARKET, "ETH-1"])
+            self.assertEqual(trader.state["orders"], {})
+
+        run(_test())
+
+
+class TestAmendTrades(unittest.TestCase):
+    def test_replaces_only_what_changed(self):
+        async def _test():
+            exchange = FakeExchange()
+            trader = create_trader(exchange)
+            add_position(trader, "mrkt-1", targets=4)
+            await trader._handle_event(fill_event("mrkt-1"))
+            parent = trader.state["orders"]["mrkt-1"]
+            old_sl, old_targets = parent["s_ord"], list(parent["t_ord"])
+            exchange.calls.clear()
+
+            # SL given without its precision, as signals sometimes are
+            amended = await trader.amend_trades("btcusdt", "BTC", sl=95, targets=[10.1, 10.25, 10.3, 10.4])
+            self.assertEqual(amended, ["mrkt-1"])
+            self.assertEqual(exchange.calls, {"cancel": 1, "cancel_batch": 1, "create": 2})
+            self.assertEqual(exchange.orders[old_sl]["status"], "CANCELED")
+            self.assertEqual(exchange.orders[parent["s_ord"]]["stopPrice"], 9.5)
+            self.assertEqual(exchange.orders[parent["s_ord"]]["quantity"], 100)
+            self.assertEqual(parent["sl"], 9.5)
+            self.assertEqual([tid == old for tid, old in zip(parent["t_ord"], old_targets)],
+                             [True, False, True, True])
+            self.assertEqual(exchange.orders[parent["t_ord"][1]]["price"], 10.25)
+            self.assertEqual(parent["tgt"], [10.1, 10.25, 10.3, 10.4])
+            self.assertEqual(parent["t_q"], [20.0] * 4)
+            self.assertNotIn(old_targets[1], trader.state["orders"])
+            open_ids = {o["clientOrderId"] for o in exchange.open_orders("BTCUSDT")}
+            self.assertEqual(open_ids, {parent["s_ord"], *parent["t_ord"]})
+
+            exchange.calls.clear()
+            self.assertEqual(await trader.amend_trades("btcusdt", "BTC", sl=9.5, targets=[10.1, 10.25, 10.3, 10.4]), [])
+            self.assertEqual(await trader.amend_trades("btcusdt", "BTC", sl=10.5), [])  # above entry
+            self.assertEqual(exchange.calls, {})
+
+        run(_test())
+
+    def test_after_target_filled(self):
+        async def _test():
+            exchange = FakeExchange()
+            trader = create_trader(exchange)
+            add_position(trader, "mrkt-1", targets=4)
+            await trader._handle_event(fill_event("mrkt-1"))
+            parent = trader.state["orders"]["mrkt-1"]
+            first = parent["t_ord"][0]
+            await trader._handle_event(exchange.fill(first))
+            sl = parent["s_ord"]
+
+            # SL stays at entry, and the TPs left make way for the ones after the filled one
+            self.assertEqual(await trader.amend_trades("btcusdt", sl=9.5, targets=[10.1, 10.5, 10.6]),
+                             ["mrkt-1"])
+            self.assertEqual(parent["s_ord"], sl)
+            self.assertEqual(parent["sl"], 9.0)
+            self.assertEqual(parent["t_ord"][0], first)
+            self.assertEqual(parent["tgt"], [10.1, 10.5, 10.6])
+            self.assertEqual(parent["t_q"], [20.0, 30.0, 30.0])
+            open_ids = {o["clientOrderId"] for o in exchange.open_orders("BTCUSDT")}
+            self.assertEqual(open_ids, {sl, *parent["t_ord"][1:]})
+
+            for tid in parent["t_ord"][1:]:
+                await trader._handle_event(exchange.fill(tid))
+            self.assertEqual(exchange.orders[parent["s_ord"]]["quantity"], 20)  # left for moon
+            self.assertEqual(trader.orders.children("mrkt-1"), [parent["s_ord"]])
+
+        run(_test())
+
+    def test_before_entry_filled(self):
+        async def _test():
+            exchange = FakeExchange()
+            trader = create_trader(exchange)
+            add_position(trader, "wait-1", targets=4)
+            results = []
+
+            async def _result(message):
+                results.append(message)
+
+            trader.results_handler = _result
+            self.assertTrue(trader.queue_amend("btcusdt", "BTC", sl=9.2, targets=[50, 100], is_percent=True))
+            await trader._gather_orders()
+            await trader.close()
+            parent = trader.state["orders"]["wait-1"]
+            self.assertEqual(exchange.calls, {})
+            self.assertEqual((parent["sl"], parent["tgt"]), (9.2, [10.4, 10.8]))
+            self.assertIn("SL @ 9.2, TP @ 10.4, 10.8", results[0])
+
+            await trader._handle_event(fill_event("wait-1"))
+            self.assertEqual(exchange.orders[parent["s_ord"]]["stopPrice"], 9.2)
+            self.assertEqual([exchange.orders[tid]["price"] for tid in parent["t_ord"]], [10.4, 10.8])
+
+        run(_test())
+
+    def test_forgets_signals_without_orders(self):
+        async def _test(storage):
+            await storage.init()
+            trader = create_trader(FakeExchange())
+            trader.storage = storage
+            trader.seen = SignalIndex(storage.state.setdefault("seen", {}), track_changes=True)
+            placed = [False, True]
+
+            async def _process(signal):
+                return placed.pop(0)
+
+            trader._process_signal = _process
+            await trader._gather_orders()
+            for queued in [True, True, False]:  # repost after the first one placed nothing
+                self.assertEqual(await trader.queue_signal(Signal("BTC", "USDT", 9, entry=10)), queued)
+                await asyncio.sleep(0.01)
+            await trader.close()
+            return trader
+
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, "state.json")
+            trader = run(_test(JournaledStorage(path).__enter__()))
+            self.assertEqual(len(trader.seen), 1)
+            seen = JournaledStorage(path).__enter__().state["seen"]
+            self.assertEqual(list(seen), [trader.seen.fingerprint(Signal("BTC", "USDT", 9, entry=10))])
@@ -0,0 +1,87 @@
+import asyncio
+import unittest
+
+from .utils import NamedLock
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestNamedLock(unittest.TestCase):
+    def test_serializes_per_name(self):
+        async def _test():
+            locks = NamedLock()
+            events = []
+
+            async def _hold(name, secs):
+                async with locks.lock(name):
+                    events.append(("in", name))
+                    await asyncio.sleep(secs)
+                    events.append(("out", name))
+
+            await asyncio.gather(_hold("BTC", 0.02), _hold("BTC", 0.01), _hold("ETH", 0.01))
+            self.assertEqual(events[:3], [("in", "BTC"), ("in", "ETH"), ("out", "ETH")])
+            self.assertEqual(events[3:], [("out", "BTC"), ("in", "BTC"), ("out", "BTC")])
+            self.assertEqual(len(locks), 0)  # dropped once released
+            self.assertEqual(locks.acquired, 3)
+
+        run(_test())
+
+    def test_contention(self):
+        async def _test():
+            locks = NamedLock()
+            release = asyncio.Event()
+
+            async def _hold():
+                async with locks.lock("BTC"):
+                    await release.wait()
+
+            holder = asyncio.ensure_future(_hold())
+            await asyncio.sleep(0)
+            waiters = [asyncio.ensure_future(_hold()) for _ in range(3)]
+            await asyncio.sleep(0.02)
+            self.assertEqual(locks.depth("BTC"), 4)
+            self.assertIn('trader_lock_depth{lock="coin",name="BTC"} 4', locks.prometheus("coin"))
+            release.set()
+            await asyncio.gather(holder, *waiters)
+
+            self.assertEqual(locks.contended, 3)
+            [(name, stats)] = locks.contention()
+            self.assertEqual((name, stats.contended, stats.max_depth), ("BTC", 3, 4))
+            self.assertGreaterEqual(stats.max_wait, 0.02)
+            self.assertGreaterEqual(stats.wait, 0.06)
+            self.assertEqual(locks.depth("BTC"), 0)
+
+        run(_test())
+
+    def test_cancelled_waiter(self):
+        async def _test():
+            locks = NamedLock()
+            async with locks.lock("BTC"):
+                waiter = asyncio.ensure_future(locks.lock("BTC").__aenter__())
+                await asyncio.sleep(0)
+                self.assertEqual(locks.depth("BTC"), 2)
+                waiter.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await waiter
+                self.assertEqual(locks.depth("BTC"), 1)  # still held
+            self.assertEqual(len(locks), 0)
+            async with locks.lock("BTC"):
+                pass
+
+        run(_test())
+
+    def test_stats_bounded(self):
+        async def _hold(locks, name):
+            async with locks.lock(name):
+                await asyncio.sleep(0)
+
+        async def _test():
+            locks = NamedLock(max_stats=2)
+            for name in ("a", "b", "c"):
+                await asyncio.gather(_hold(locks, name), _hold(locks, name))
+            self.assertEqual(list(locks.stats), ["b", "c"])  # the oldest dropped
+            self.assertEqual(len(locks), 0)
+
+        run(_test())
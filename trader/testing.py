@@ -0,0 +1,154 @@
+# Fixtures shared by the tests and the benchmarks: a stand-in exchange and a legacy trader
+# wired to it without any network, with positions added straight into its state.
+import asyncio
+import collections
+import itertools
+import json
+import random
+
+from binance.exceptions import BinanceAPIException
+
+from . import FuturesTrader
+from .clients import OrderType
+from .clients.binance import compile_symbol_rules
+from .storage import OrderStore
+
+
+def api_error(code, msg="Injected failure"):
+    return BinanceAPIException(None, 400, json.dumps({"code": code, "msg": msg}))
+
+
+# Stand-in for the parts of `binance.AsyncClient` used by the traders, with every request
+# taking `latency` (+ up to `jitter`) seconds. `failures` maps client order IDs to error codes
+# for their (single) next placement.
+class FakeExchange:
+    def __init__(self, latency=0.001, jitter=0.0, cancel_latency=None, failures=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.cancel_latency = cancel_latency or {}  # symbol -> latency for cancelling orders
+        self.failures = failures or {}
+        self.on_order = None  # called with every order placed
+        self.calls = collections.Counter()
+        self.orders = {}
+        self.fail_batch = set()  # order types which fail inside batches
+        self.fail_create = {}  # order type -> error code for single orders
+        self._ids = itertools.count(1)
+
+    def _order(self, params):
+        code = self.failures.pop(params.get("newClientOrderId"), None)
+        if code is not None:
+            return {"code": code, "msg": "Injected failure"}
+        order_id = next(self._ids)
+        status = "FILLED" if params.get("type") == OrderType.MARKET else "NEW"
+        order = dict(params, orderId=order_id, status=status, origQty=str(params["quantity"]),
+                     clientOrderId=params.get("newClientOrderId", f"auto-{order_id}"))
+        self.orders[order["clientOrderId"]] = order
+        if self.on_order is not None:
+            self.on_order(order)
+        return order
+
+    async def _delay(self, latency=None):
+        latency = self.latency if latency is None else latency
+        await asyncio.sleep(latency + random.uniform(0, self.jitter))
+
+    async def futures_create_order(self, **params):
+        self.calls["create"] += 1
+        await self._delay()
+        code = self.fail_create.get(params["type"])
+        if code is not None:
+            raise api_error(code)
+        resp = self._order(params)
+        if "code" in resp:
+            raise api_error(resp["code"])
+        return resp
+
+    async def futures_place_batch_order(self, batchOrders):
+        self.calls["batch"] += 1
+        await self._delay()
+        return [{"code": -2021, "msg": "Order would immediately trigger."}
+                if params["type"] in self.fail_batch else self._order(params)
+                for params in batchOrders]
+
+    async def futures_change_leverage(self, symbol, leverage):
+        self.calls["leverage"] += 1
+        await self._delay()
+        return {"symbol": symbol, "leverage": leverage, "maxNotionalValue": "1000000"}
+
+    async def futures_cancel_order(self, symbol, origClientOrderId):
+        self.calls["cancel"] += 1
+        await self._delay(self.cancel_latency.get(symbol))
+        order = self.orders.get(origClientOrderId)
+        if order is None:
+            raise api_error(-2011, "Unknown order sent.")
+        order["status"] = "CANCELED"
+        return order
+
+    async def futures_cancel_orders(self, symbol, origClientOrderIdList):
+        self.calls["cancel_batch"] += 1
+        await self._delay(self.cancel_latency.get(symbol))
+        resp = []
+        for oid in json.loads(origClientOrderIdList):
+            order = self.orders.get(oid)
+            if order is None or order["status"] != "NEW":
+                resp.append({"code": -2011, "msg": "Unknown order sent."})
+                continue
+            order["status"] = "CANCELED"
+            resp.append(order)
+        return resp
+
+    async def futures_cancel_all_open_orders(self, symbol):
+        self.calls["cancel_all"] += 1
+        await self._delay(self.cancel_latency.get(symbol))
+        for order in self.open_orders(symbol):
+            order["status"] = "CANCELED"
+        return {"code": 200, "msg": "The operation of cancel all open order is done."}
+
+    def fill(self, order_id):
+        if order_id in self.orders:
+            self.orders[order_id]["status"] = "FILLED"
+        return fill_event(order_id)
+
+    def open_orders(self, symbol):
+        return [o for o in self.orders.values() if o["symbol"] == symbol and o["status"] == "NEW"]
+
+
+def symbol_info(symbol, tick_size="0.01", step_size="0.1"):
+    return {
+        "symbol": symbol,
+        "contractType": "PERPETUAL",
+        "filters": [
+            {"filterType": "PRICE_FILTER", "tickSize": tick_size},
+            {"filterType": "LOT_SIZE", "minQty": step_size, "maxQty": "100000", "stepSize": step_size},
+            {"filterType": "MIN_NOTIONAL", "notional": "5"},
+        ],
+    }
+
+
+async def _discard(*_args):
+    pass
+
+
+def create_trader(exchange, symbols=("BTCUSDT",)):
+    trader = FuturesTrader()
+    trader.client = exchange
+    trader.state = {"orders": {}, "config": {}}
+    trader.orders = OrderStore(trader.state["orders"])
+    trader.results_handler = _discard
+    for symbol in symbols:
+        info = symbol_info(symbol)
+        trader.symbols[symbol] = info
+        trader.rules[symbol] = compile_symbol_rules(info)
+    return trader
+
+
+def fill_event(order_id, price=10.0, qty=8.0):
+    return {"e": "ORDER_TRADE_UPDATE",
+            "o": {"c": order_id, "X": "FILLED", "ap": str(price), "q": str(qty)}}
+
+
+def add_position(trader, order_id, symbol="BTCUSDT", entry=10.0, targets=10, tag=None):
+    trader.orders[order_id] = {
+        "id": 1, "qty": 100.0, "sym": symbol, "side": "BUY", "ent": entry, "sl": entry * 0.9,
+        "tgt": [entry * (1 + 0.01 * (i + 1)) for i in range(targets)], "rr": 1, "fnd": 100, "lev": 10,
+        "tag": tag or symbol.lower(), "crt": 0, "t_ord": [], "t_q": [],
+    }
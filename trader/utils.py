@@ -1,31 +1,121 @@
 import asyncio
 import random
+import time
 from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List
 
-from .logger import DEFAULT_LOGGER as logging
+from .logger import get_logger
 
+logging = get_logger(__name__)
+
+NAMED_LOCK_MAX_STATS = 1000  # names whose contention is kept
 
 WORD_LIST = ["time", "year", "work", "life", "part", "case", "fact", "area", "head", "hand", "john", "side", "home", "week", "room", "road", "form", "face", "sort", "body", "name", "book", "view", "door", "line", "city", "kind", "idea", "west", "mind", "land", "care", "back", "rate", "word", "food", "team", "role", "town", "bank", "need", "east", "type", "date", "wife", "club", "lord", "king", "cost", "girl", "game", "love", "news", "rest", "hair", "bill", "fire", "size", "term", "plan", "hall", "list", "loss", "wall", "paul", "army", "unit", "park", "hour", "test", "look", "deal", "help", "page", "risk", "fish", "film", "shop", "site", "mark", "lady", "task", "sale", "lack", "post", "firm", "show", "baby", "base", "miss", "past", "cash", "rule", "turn", "duty", "ball", "race", "edge", "gold", "wood", "text", "foot", "rise", "half", "step", "pain", "hill", "will", "mary", "wind", "band", "farm", "skin", "play", "fear", "move", "rock", "tree", "wine", "star", "hope", "user", "path", "rain", "goal", "seat", "fig.", "pair", "call", "note", "tour", "card", "sign", "fund", "file", "jack", "cell", "lead", "debt", "boat", "heat", "neck", "code", "hell", "coal", "drug", "tony", "alan", "copy", "acid", "vote", "milk", "tape", "flow", "iron", "trip", "lane", "pool", "hole", "flat", "mike", "ship", "meal", "tone", "spot", "fuel", "desk", "fall", "diet", "soil", "roof", "nose", "song", "talk", "link", "ring", "rail", "lake", "bird", "loan", "walk", "mass", "jane", "bush", "bath", "item", "port", "meat", "self", "gate", "mill", "golf", "core", "snow", "camp", "gulf", "ward", "bell", "mail", "tank", "coat", "beer", "mood", "mile", "yard", "boss", "wage", "wave", "duke", "luck", "ruth", "sake", "nick", "salt", "sand", "suit", "soul", "gift", "dark", "dec.", "poll", "hold", "kong", "hong", "moon", "wing", "good", "peak", "aunt", "mode", "andy", "cake", "bond", "disk", "bomb", "host", "tail", "ford", "load", "zone", "pack", "lucy", "dust", "poem", "pipe", "bone", "anna", "earl", "jean", "lift", "jury", "hero", "gene", "cold", "dawn", "harm", "cook", "bowl", "pope", "tool", "male", "drop", "fate", "wire", "silk", "folk", "poet", "hunt", "tale", "belt", "joke", "gaze", "bulk", "root", "stop", "kate", "navy", "knee", "tube", "ease", "rank", "mess", "blow", "ross", "rape", "eric", "lock", "dean", "gear", "bull", "jews", "taxi", "chip", "shit", "bike", "plot", "wool", "coup", "pass", "inch", "tide", "pond", "ride", "rice", "pity", "lamb", "mine", "dose", "disc", "boom", "twin", "clay", "pile", "mate", "grip", "menu", "seed", "prey", "dish", "chap", "mick", "wish", "chin", "rush", "rope", "dear", "beef", "crop", "leaf", "gain", "flag", "dick", "boot", "myth", "gang", "emma", "roll", "quid", "fool", "hull", "deck", "kiss", "isle", "bias", "pole", "tray", "kick", "hint", "tune", "oven", "loch", "nest", "draw", "raid", "evil", "barn", "soup", "down", "trap", "lamp", "blue", "hook", "soap", "palm", "cave", "lion", "wake", "pint", "fame", "dock", "bear", "echo", "duck", "bile", "corn", "jazz", "coin", "plea", "rage", "grid", "beat", "halt", "lace", "stay", "lump", "tent", "clue", "shoe", "jail", "rear", "shah", "carl", "fury", "pact", "bass", "fort", "axis", "lawn", "mask", "gray", "vol.", "pump", "grin", "beam", "hire", "mist", "gall", "sigh", "sink", "horn", "seal", "swan", "cage", "solo", "norm", "cape", "cure", "pine", "exit", "heir", "hood", "dirt", "reed", "sean", "cast", "glen", "shed", "grey", "lung", "sofa", "moor", "slip", "loop", "shaw", "deer", "riot", "cult", "verb", "peat", "fist", "cork", "maid", "calm", "drum", "yarn", "chat", "cart", "exam", "jump", "iris", "fork", "jeff", "dame", "lily", "wolf", "moss", "plus", "feel", "alec", "zero", "sack", "fare", "bail", "gill", "wear", "high", "gown", "fuss", "bang", "toll", "ally", "node", "wash", "glow", "heel", "levy", "stem", "matt", "khan", "trio", "arch", "vein", "dale", "brow", "jill", "toby", "heap", "kite", "tyne", "lang", "noon", "dana", "cafe", "vale", "marc", "para", "urge", "pony", "sail", "doll", "cord", "bite", "foam", "beta", "deed", "watt", "bolt", "coun", "crap", "bend", "herd", "eden", "lime", "knot", "dome", "calf", "rack", "limb", "chef", "jake", "monk", "nail", "noun", "slot", "whip", "hart", "beck", "tomb", "goat", "kohl", "fair", "coke", "stan", "pill", "tear", "pike", "loft", "tyre", "yuan", "gran", "push", "mare", "dusk", "pork", "dole", "acre", "rosa", "junk", "gina", "turf", "polo", "scum", "worm", "leap", "nina", "kemp", "atom", "glue", "spin", "cole", "pier", "hyde", "beth", "bean", "mama", "reef", "arse", "logo", "jess", "rick", "noel", "tsar", "swim", "plug", "roar", "tina", "peer", "main", "dash", "burn", "quiz", "peel", "kirk", "otto", "bloc", "flux", "pick", "punk", "frog", "sony", "writ", "hare", "envy", "buck", "pest", "col.", "vase", "howe", "luce", "tbsp", "cock", "lava", "lust", "bach", "foil", "bait", "mast", "carr", "cane", "quay", "pull", "bark", "vice", "fuck", "bury", "papa", "veil", "gale", "rift", "maze", "todd", "wait", "zinc", "scot", "fold", "nave", "lowe", "bulb", "slab", "fine", "clan", "void", "cone", "prof", "ramp", "gala", "robe", "mesh", "saga", "fife", "mean", "veto", "spur", "dump", "vine", "lass", "liar", "weir", "drag", "jade", "aura", "visa", "icon", "boro", "tram", "tort", "loaf", "ruby", "mint", "leak", "doom", "boar", "tier", "bout", "scar", "hate", "lear", "jeep", "feat", "maud", "womb", "malt", "coil", "carp", "cube", "crag", "haul", "hawk", "butt", "tile", "joey", "ruin", "herb", "mole", "bust", "scan", "rune", "soda", "hank", "tuna", "seam", "prop", "pink", "fore", "want", "make", "flap", "haze", "dell", "fiat", "wade", "muck", "boil", "wang", "eyre", "hymn", "memo", "trek", "zeal", "crab", "crow", "rave", "stud", "safe", "liza", "apex", "pose", "putt", "sage", "frau", "josh", "vera", "kyle", "peck", "till", "dent", "raft", "hose", "font", "rump", "colt", "wild", "hype", "mona", "fuse", "tech", "boon", "open", "tack", "vent", "stab", "ploy", "beak", "stew", "mall", "skye", "dept", "clip", "lima", "holt", "comb", "slum", "slam", "toad", "bowe", "dyke", "harp", "rash", "rite", "plum", "gore", "moat", "ache", "moth", "poly", "gasp", "pore", "knob", "trim", "skip", "mead", "bunk", "helm", "bump", "nova", "chop", "mink", "rust", "chub", "pram", "wasp", "cray", "cove", "gaol", "duct", "bede", "oval", "aide", "vest", "idol", "hale", "piss", "hide", "eddy", "dart", "auto", "pulp", "flaw", "find", "brew", "coma", "epic", "lyon", "ware", "kiev", "foal", "riba", "whim", "slit", "neon", "expo", "foul", "tact", "onus", "surf", "puff", "tart", "slap", "wise", "curl", "sect", "hive", "stag", "lark", "jock", "capt", "enid", "perm", "kerb", "demo", "tait", "sill", "read", "grit", "must", "yale", "hogg", "like", "tick", "porn", "pear", "sway", "spit", "gram", "dial", "rind", "dung", "java", "coca", "yoga", "wren", "chad", "sock", "ling", "cunt", "glyn", "sham", "heck", "trot", "fern", "duel", "reel", "ness", "crux", "cool", "nape", "hick", "blur", "tuck", "midi", "guru", "loco", "mite", "rein", "info", "oral", "dada", "warp", "blot", "stir", "zeta", "sept", "babe", "duff", "yang", "hail", "sole", "hiss", "claw", "dyer", "hang", "toss", "over", "lure", "davy", "berg", "kiwi", "snag", "gull", "nana", "drip", "wick", "soot", "byte", "limp", "shin", "cert", "mule", "cuff", "dope", "flea", "cope", "zest", "slug", "take", "mayo", "tilt", "rake", "kiln", "bran", "flak", "duet", "lull", "thud", "alto", "pang", "brim", "wrap", "taff", "biff", "dune", "sash", "keep", "birt", "pons", "spar", "wink", "fill", "tung", "bray", "ritz", "bash", "axle", "mali", "mace", "tory", "bead", "loom", "hurt", "thaw", "parr", "graf", "casa", "mane", "gist", "glee", "lobe", "vial", "flop", "halo", "moan", "grub", "rota", "chan", "hush", "kill", "nome", "flue", "aria", "buff", "fray", "damn", "lore", "feud", "saul", "cath", "mime", "omen", "twig", "germ", "gait", "jerk", "silt", "zoom", "tang", "ludo", "wand", "kilo", "flex", "muse", "jolt", "pall", "heed", "brit", "gulp", "slag", "hoax", "hilt", "mono", "lego"]  # noqa: E501
 
 
-class NamedLock:
+class _NamedLockEntry:
+    __slots__ = ("lock", "users")
+
     def __init__(self):
-        self._l = asyncio.Lock()
-        self._locks = {}
+        self.lock = asyncio.Lock()
+        self.users = 0  # holding or waiting
+
+
+class LockStats:
+    __slots__ = ("contended", "wait", "max_wait", "max_depth")
+
+    def __init__(self):
+        self.contended = 0  # acquisitions which had to wait
+        self.wait = 0.0  # secs, in total
+        self.max_wait = 0.0  # secs
+        self.max_depth = 0  # most holding or waiting at once, including the waiter
+
+    def __repr__(self):
+        return (f"LockStats(contended={self.contended}, wait={round(self.wait, 4)}, "
+                f"max_wait={round(self.max_wait, 4)}, max_depth={self.max_depth})")
+
+
+# Lock per name (coin, position...), made on first use and dropped once nobody holds or waits on
+# it. Nothing is awaited between looking a name up and counting its user, so the dict needs no
+# lock of its own. Acquisitions which had to wait are counted per name, with how long they
+# waited and how deep the queue was, for up to `max_stats` names (the oldest are dropped).
+class NamedLock:
+    def __init__(self, max_stats: int = NAMED_LOCK_MAX_STATS):
+        self._locks: Dict[Hashable, _NamedLockEntry] = {}
+        self.max_stats = max_stats
+        self.stats: Dict[Hashable, LockStats] = {}
+        self.acquired = 0
+        self.contended = 0
+
+    def __len__(self):
+        return len(self._locks)
+
+    def depth(self, name: Hashable) -> int:
+        # holding or waiting on it
+        entry = self._locks.get(name)
+        return 0 if entry is None else entry.users
 
     @asynccontextmanager
-    async def lock(self, name):
-        async with self._l:
-            if name not in self._locks:
-                self._locks[name] = asyncio.Lock()
-            lock = self._locks[name]
+    async def lock(self, name: Hashable):
+        entry = self._locks.get(name)
+        if entry is None:
+            entry = self._locks[name] = _NamedLockEntry()
+        entry.users += 1
+        try:
+            if entry.users == 1:
+                await entry.lock.acquire()  # free, so it doesn't wait
+            else:
+                depth = entry.users
+                start = time.perf_counter()
+                await entry.lock.acquire()
+                self._record(name, time.perf_counter() - start, depth)
+        except BaseException:
+            self._leave(name, entry)
+            raise
+        self.acquired += 1
         try:
-            await lock.acquire()
-            logging.info(f"Acquiring lock for {name}", color="magenta")
             yield
         finally:
-            logging.info(f"Releasing lock for {name}", color="magenta")
-            lock.release()
+            entry.lock.release()
+            self._leave(name, entry)
+
+    def _leave(self, name: Hashable, entry: _NamedLockEntry):
+        entry.users -= 1
+        if not entry.users:
+            del self._locks[name]
+
+    def _record(self, name: Hashable, wait: float, depth: int):
+        self.contended += 1
+        stats = self.stats.get(name)
+        if stats is None:
+            if len(self.stats) >= self.max_stats:
+                # dicts are ordered, so this drops the oldest
+                self.stats.pop(next(iter(self.stats)))
+            stats = self.stats[name] = LockStats()
+        stats.contended += 1
+        stats.wait += wait
+        if wait > stats.max_wait:
+            stats.max_wait = wait
+        if depth > stats.max_depth:
+            stats.max_depth = depth
+
+    def contention(self, count: int = 10) -> List[tuple]:
+        # (name, stats) of the names waited on the longest
+        return sorted(self.stats.items(), key=lambda item: item[1].wait, reverse=True)[:count]
+
+    def prometheus(self, kind: str) -> str:
+        lines = [f'trader_lock_acquired_total{{lock="{kind}"}} {self.acquired}',
+                 f'trader_lock_contended_total{{lock="{kind}"}} {self.contended}',
+                 f'trader_lock_names{{lock="{kind}"}} {len(self._locks)}']
+        for name, entry in self._locks.items():
+            lines.append(f'trader_lock_depth{{lock="{kind}",name="{name}"}} {entry.users}')
+        for name, stats in self.stats.items():
+            labels = f'lock="{kind}",name="{name}"'
+            lines.append(f"trader_lock_name_contended_total{{{labels}}} {stats.contended}")
+            lines.append(f"trader_lock_wait_seconds_total{{{labels}}} {stats.wait}")
+            lines.append(f"trader_lock_wait_seconds_max{{{labels}}} {stats.max_wait}")
+            lines.append(f"trader_lock_depth_max{{{labels}}} {stats.max_depth}")
+        return "\n".join(lines) + "\n"
 
 
 def get_tag():